@@ -0,0 +1,445 @@
+"""
+AI ChatBot Pro - Headless HTTP API
+
+ASGI service exposing the same AIClient/FileProcessor core as the Streamlit
+UI, for programmatic access and load testing:
+
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+
+Endpoints:
+    POST /v1/files                     upload a file (multipart field "file"), returns its analysis
+    POST /v1/chat                      {"message", "conversation_id"?, "file_ids"?, "stream"?}
+    GET  /v1/conversations/{id}        conversation history and running summary
+    POST /v1/conversations/{id}/cancel stop the answer being generated for a conversation
+    GET  /v1/stats                     worker pool and provider statistics
+    GET  /healthz                      liveness probe
+
+Blocking work runs on bounded thread pools; requests beyond the queue limit
+are rejected with 503 instead of piling up. Model calls are shared fairly
+between clients, identified by the X-User-Id header or else their address,
+and a client over its share gets 503 as well. A chat request whose client
+disconnects is cancelled, which also stops the provider from generating.
+Conversations live in this process, so run replicas behind a sticky load
+balancer. Analyzed files stay in memory while recent and are kept
+compressed under uploads/attachments after that, so a file id stays valid
+until the attachment store evicts it; a question naming a file of an
+earlier turn brings that file back into the prompt. Each worker opens its provider connections
+at startup (AI_WARM_UP=0 skips that).
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from utils.ai_client import AIClient
+from utils.attachment_store import AttachmentStore, referenced_attachments
+from utils.cancellation import CancelToken
+from utils.conversation_memory import ConversationMemory, MemoryCompactor
+from utils.file_processor import FileProcessor
+from utils.upload_store import UploadBuffer, UploadLimits, UploadTooLarge
+
+CHAT_WORKERS = int(os.getenv("API_CHAT_WORKERS", "16"))
+FILE_WORKERS = int(os.getenv("API_FILE_WORKERS", str(os.cpu_count() or 2)))
+MAX_QUEUED = int(os.getenv("API_MAX_QUEUED", "64"))
+MAX_CONVERSATIONS = int(os.getenv("API_MAX_CONVERSATIONS", "1000"))
+MAX_FILES = int(os.getenv("API_MAX_FILES", "500"))
+DISCONNECT_POLL = float(os.getenv("API_DISCONNECT_POLL", "0.25"))
+WARM_UP = os.getenv("AI_WARM_UP", "1") == "1"
+
+
+class BoundedStore:
+    """Thread-safe LRU mapping holding at most ``limit`` items"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.limit:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class WorkerPool:
+    """Thread pool with a cap on queued work, awaited from asyncio"""
+
+    def __init__(self, name, workers, max_queued):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.workers = workers
+        self.slots = asyncio.Semaphore(workers + max_queued)
+        self.in_flight = 0
+        self.rejected = 0
+
+    def full(self):
+        return self.slots.locked()
+
+    async def run(self, func, *args):
+        """Run ``func`` on the pool; raises PoolFull when the queue is saturated"""
+        if self.full():
+            self.rejected += 1
+            raise PoolFull(self.name)
+        async with self.slots:
+            self.in_flight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            finally:
+                self.in_flight -= 1
+
+    def stats(self):
+        return {'workers': self.workers, 'in_flight': self.in_flight, 'rejected': self.rejected}
+
+
+class PoolFull(Exception):
+    """Raised when a worker pool cannot accept more work"""
+
+
+class ChatService:
+    """Conversation state plus the shared core, independent of HTTP framing"""
+
+    def __init__(self):
+        self.ai_client = AIClient()
+        self.file_processor = FileProcessor()
+        self.upload_limits = UploadLimits()
+        self.conversations = BoundedStore(MAX_CONVERSATIONS)
+        # MAX_FILES results in memory, older ones on disk
+        self.files = AttachmentStore(max_items=MAX_FILES)
+        self.memory = MemoryCompactor(self.ai_client)
+        self.chat_pool = WorkerPool("chat", CHAT_WORKERS, MAX_QUEUED)
+        self.file_pool = WorkerPool("files", FILE_WORKERS, MAX_QUEUED)
+        # conversation id -> CancelToken of the answer being generated
+        self.active = {}
+        self._active_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def request_token(self, conversation_id):
+        """CancelToken for one answer, reachable through cancel() while it runs"""
+        token = CancelToken()
+        with self._active_lock:
+            self.active[conversation_id] = token
+        try:
+            yield token
+        finally:
+            with self._active_lock:
+                if self.active.get(conversation_id) is token:
+                    del self.active[conversation_id]
+
+    def cancel(self, conversation_id, reason="stopped"):
+        """Cancel the conversation's answer in progress; False if there is none"""
+        with self._active_lock:
+            token = self.active.get(conversation_id)
+        return token is not None and token.cancel(reason)
+
+    def conversation(self, conversation_id=None):
+        """Fetch or create a conversation record"""
+        if conversation_id:
+            existing = self.conversations.get(conversation_id)
+            if existing is not None:
+                return conversation_id, existing
+        conversation_id = conversation_id or uuid.uuid4().hex
+        record = {
+            'id': conversation_id,
+            'created': datetime.now().isoformat(),
+            'messages': [],
+            'memory': ConversationMemory(),
+        }
+        self.conversations.put(conversation_id, record)
+        return conversation_id, record
+
+    def attachments(self, file_ids, prompt="", messages=()):
+        """Analysis results for uploaded file ids, plus earlier turns' files the prompt names
+
+        Returns (file ids, results, missing ids); results may be read from disk.
+        """
+        file_ids = list(file_ids or [])
+        results, missing = [], []
+        for file_id in file_ids:
+            result = self.files.get(file_id)
+            if result is None:
+                missing.append(file_id)
+            else:
+                results.append(result)
+        if missing:
+            return file_ids, results, missing
+        for entry in referenced_attachments(prompt, messages, exclude=file_ids, key='file_id'):
+            result = self.files.get(entry['file_id'])
+            if result is not None:
+                file_ids.append(entry['file_id'])
+                results.append(result)
+        return file_ids, results, missing
+
+    def record_turn(self, record, prompt, response, file_results, file_ids=(), session=None):
+        """Append a user/assistant exchange to the conversation"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        record['messages'].append({
+            "role": "user",
+            "content": prompt,
+            "files": [{'name': r.filename, 'type': r.file_type, 'size': r.size, 'file_id': file_id}
+                      for file_id, r in zip(file_ids, file_results)],
+            "timestamp": timestamp
+        })
+        record['messages'].append({
+            "role": "assistant",
+            "content": response,
+            "timestamp": datetime.now().strftime("%H:%M:%S")
+        })
+        self.memory.after_reply(record['memory'], record['messages'], session)
+
+
+def _client_key(request):
+    """Who a chat request counts against for admission control: X-User-Id, else the client address"""
+    user = request.headers.get("x-user-id")
+    if user:
+        return f"user:{user}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def _busy(pool_name):
+    return JSONResponse(
+        {"error": f"Server busy ({pool_name} queue full), retry shortly"},
+        status_code=503,
+        headers={"Retry-After": "1"}
+    )
+
+
+def _public_result(file_id, result):
+    """Analysis report and digest without the image payload"""
+    return {
+        'file_id': file_id,
+        'filename': result.filename,
+        'file_type': result.file_type,
+        'size': result.size,
+        'analysis': result.markdown,
+        'digest': result.digest(),
+    }
+
+
+async def upload_file(request):
+    service = request.app.state.service
+    form = await request.form(max_files=1)
+    upload = form.get("file")
+    if upload is None or not hasattr(upload, "read"):
+        return JSONResponse({"error": "Expected multipart field 'file'"}, status_code=400)
+
+    filename = upload.filename or "upload"
+
+    def analyze():
+        # Streams the spooled upload, spilling large files instead of reading them whole
+        buffer = UploadBuffer.from_stream(filename, upload.file, service.upload_limits)
+        try:
+            return service.file_processor.process_bytes(filename, buffer)
+        finally:
+            buffer.close()
+
+    try:
+        result = await service.file_pool.run(analyze)
+    except PoolFull as e:
+        return _busy(str(e))
+    except UploadTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    finally:
+        await upload.close()
+
+    file_id = uuid.uuid4().hex
+    service.files.put(file_id, result)
+    return JSONResponse(_public_result(file_id, result), status_code=201)
+
+
+async def chat(request):
+    service = request.app.state.service
+    try:
+        body = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Invalid JSON body"}, status_code=400)
+    if not isinstance(body, dict):
+        return JSONResponse({"error": "Expected a JSON object"}, status_code=400)
+
+    message = body.get("message")
+    if message is not None and not isinstance(message, str):
+        return JSONResponse({"error": "'message' must be a string"}, status_code=400)
+    prompt = (message or "").strip()
+    if not prompt:
+        return JSONResponse({"error": "'message' is required"}, status_code=400)
+    file_ids = body.get("file_ids")
+    if file_ids is not None and not (isinstance(file_ids, list)
+                                     and all(isinstance(file_id, str) for file_id in file_ids)):
+        return JSONResponse({"error": "'file_ids' must be a list of strings"}, status_code=400)
+    if not isinstance(body.get("conversation_id") or "", str):
+        return JSONResponse({"error": "'conversation_id' must be a string"}, status_code=400)
+
+    existing = service.conversations.get(body.get("conversation_id") or "")
+    # Off the event loop: files no longer in memory are read back from disk
+    file_ids, file_results, missing = await asyncio.get_running_loop().run_in_executor(
+        None, service.attachments, file_ids, prompt, list(existing['messages']) if existing else []
+    )
+    if missing:
+        return JSONResponse({"error": f"Unknown file ids: {', '.join(missing)}"}, status_code=404)
+
+    conversation_id, record = service.conversation(body.get("conversation_id"))
+    # Summary of older turns plus the recent ones
+    history = record['memory'].history(record['messages'])
+
+    if body.get("stream"):
+        if service.chat_pool.full():
+            service.chat_pool.rejected += 1
+            return _busy(service.chat_pool.name)
+        events = _stream_events(service, record, conversation_id, prompt, file_ids, file_results, history,
+                                _client_key(request))
+        return StreamingResponse(events, media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    start = time.perf_counter()
+    session = _client_key(request)
+    with service.request_token(conversation_id) as token:
+        watcher = asyncio.create_task(_cancel_on_disconnect(request, token))
+        try:
+            response = await service.chat_pool.run(
+                service.ai_client.get_response, prompt, file_results, history, token, session
+            )
+        except PoolFull as e:
+            return _busy(str(e))
+        finally:
+            watcher.cancel()
+    if token.reason == 'busy':
+        # Shed by admission control; nothing was generated
+        return _busy("admission")
+
+    service.record_turn(record, prompt, response, file_results, file_ids, session)
+    return JSONResponse({
+        "conversation_id": conversation_id,
+        "response": response,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    })
+
+
+async def _cancel_on_disconnect(request, token):
+    """Cancel ``token`` once the client has gone away"""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("disconnected")
+            return
+        await asyncio.sleep(DISCONNECT_POLL)
+
+
+async def _stream_events(service, record, conversation_id, prompt, file_ids, file_results, history, session):
+    """Server-sent events for a streamed answer, produced on the chat pool"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def produce(token):
+        try:
+            for piece in service.ai_client.stream_response(prompt, file_results, history,
+                                                             cancel=token, session=session):
+                loop.call_soon_threadsafe(queue.put_nowait, piece)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    yield f"event: start\ndata: {json.dumps({'conversation_id': conversation_id})}\n\n"
+
+    async with service.chat_pool.slots:
+        service.chat_pool.in_flight += 1
+        with service.request_token(conversation_id) as token:
+            try:
+                worker = loop.run_in_executor(service.chat_pool.executor, produce, token)
+                pieces = []
+                while True:
+                    piece = await queue.get()
+                    if piece is done:
+                        break
+                    pieces.append(piece)
+                    yield f"data: {json.dumps({'delta': piece})}\n\n"
+                await worker
+            except (asyncio.CancelledError, GeneratorExit):
+                # Client disconnected: the response task is cancelled and so is the request
+                token.cancel("disconnected")
+                raise
+            finally:
+                service.chat_pool.in_flight -= 1
+
+    if token.reason != 'busy':
+        # A shed request generated nothing worth keeping
+        service.record_turn(record, prompt, "".join(pieces), file_results, file_ids, session)
+    yield "event: done\ndata: {}\n\n"
+
+
+async def get_conversation(request):
+    record = request.app.state.service.conversations.get(request.path_params["conversation_id"])
+    if record is None:
+        return JSONResponse({"error": "Conversation not found"}, status_code=404)
+    return JSONResponse({**record, 'memory': record['memory'].to_dict()})
+
+
+async def cancel_conversation(request):
+    conversation_id = request.path_params["conversation_id"]
+    cancelled = request.app.state.service.cancel(conversation_id)
+    return JSONResponse({"conversation_id": conversation_id, "cancelled": cancelled})
+
+
+async def stats(request):
+    service = request.app.state.service
+    return JSONResponse({
+        'chat_pool': service.chat_pool.stats(),
+        'file_pool': service.file_pool.stats(),
+        'conversations': len(service.conversations),
+        'files': service.files.stats(),
+        'router': service.ai_client.router.stats(),
+        'semantic_cache': service.ai_client.semantic_cache.stats(),
+        'prompt_cache': service.ai_client.layout.stats(),
+        'cancellation': service.ai_client.cancellations.stats(),
+        'generation': service.ai_client.generation.stats(),
+        'admission': service.ai_client.admission.stats(),
+        'request_log': service.ai_client.recorder.stats(),
+        'decomposition': service.ai_client.decomposer.stats(),
+        'shared_cache': service.file_processor.cache.stats(),
+    })
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.service = service = ChatService()
+    if WARM_UP:
+        # Open provider connections before the first request is accepted
+        await asyncio.get_running_loop().run_in_executor(None, service.ai_client.warm_up)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/v1/files", upload_file, methods=["POST"]),
+        Route("/v1/chat", chat, methods=["POST"]),
+        Route("/v1/conversations/{conversation_id}", get_conversation, methods=["GET"]),
+        Route("/v1/conversations/{conversation_id}/cancel", cancel_conversation, methods=["POST"]),
+        Route("/v1/stats", stats, methods=["GET"]),
+        Route("/healthz", healthz, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
@@ -11,18 +11,19 @@ from pathlib import Path
 
 def check_requirements():
     """Check if required packages are installed"""
-    required_packages = [
-        'streamlit',
-        'openai', 
-        'pillow',
-        'pypdf2',
-        'chardet'
-    ]
+    # pip name -> module name
+    required_packages = {
+        'streamlit': 'streamlit',
+        'openai': 'openai',
+        'pillow': 'PIL',
+        'pypdf2': 'PyPDF2',
+        'chardet': 'chardet'
+    }
     
     missing_packages = []
-    for package in required_packages:
+    for package, module in required_packages.items():
         try:
-            __import__(package)
+            __import__(module)
         except ImportError:
             missing_packages.append(package)
     
@@ -53,6 +54,50 @@ def check_api_key():
         print("⚠️  API key format seems incorrect (should start with 'sk-')")
         return False
 
+def launch_api():
+    """Start the headless HTTP API with uvicorn"""
+    port = os.getenv('API_PORT', '8000')
+    workers = os.getenv('API_WORKERS', '1')
+    print(f"🔌 HTTP API listening on http://localhost:{port} ({workers} worker process(es))")
+    try:
+        subprocess.run([
+            sys.executable, '-m', 'uvicorn', 'api:app',
+            '--host', '0.0.0.0',
+            '--port', port,
+            '--workers', workers
+        ])
+    except KeyboardInterrupt:
+        print("\n👋 API stopped.")
+
+def warm_up_providers():
+    """Open provider connections in this process while the server starts"""
+    if os.getenv('AI_WARM_UP', '1') != '1':
+        return
+    try:
+        from utils.providers import load_providers
+        from utils.transport import start_warm_up
+        
+        providers = load_providers()
+    except Exception as e:
+        print(f"⚠️  Skipping connection warm-up: {e}")
+        return
+    if providers:
+        start_warm_up(providers)
+        print(f"🔥 Opening connections to: {', '.join(p.name for p in providers)}")
+
+def launch_streamlit(extra_args):
+    """Serve app.py from this process, so it reuses the connections opened at startup"""
+    from streamlit.web import cli as stcli
+    
+    warm_up_providers()
+    sys.argv = [
+        'streamlit', 'run', 'app.py',
+        '--server.port', '5000',
+        '--server.address', '0.0.0.0',
+        '--server.headless', 'true'
+    ] + extra_args
+    sys.exit(stcli.main())
+
 def main():
     """Main launcher function"""
     print("🤖 AI ChatBot Pro - Launcher")
@@ -76,20 +121,22 @@ def main():
     print("📱 The app will open at: http://localhost:5000")
     print("🛑 Press Ctrl+C to stop the application\n")
     
-    if not api_key_ok:
+    # Containers have no terminal to answer on
+    if not api_key_ok and sys.stdin.isatty():
         response = input("Continue anyway? (y/N): ")
         if response.lower() != 'y':
             print("👋 Setup your API key and try again!")
             sys.exit(1)
     
-    # Launch Streamlit
+    # Headless API mode: python run.py --api
+    if '--api' in sys.argv:
+        launch_api()
+        return
+    
+    # Launch Streamlit; arguments after "--" are passed on to it
+    extra_args = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
     try:
-        subprocess.run([
-            sys.executable, '-m', 'streamlit', 'run', 'app.py',
-            '--server.port', '5000',
-            '--server.address', '0.0.0.0',
-            '--server.headless', 'true'
-        ])
+        launch_streamlit(extra_args)
     except KeyboardInterrupt:
         print("\n👋 AI ChatBot Pro stopped. Thanks for using it!")
     except Exception as e:
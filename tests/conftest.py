@@ -0,0 +1,60 @@
+"""Shared fixtures: mock OpenAI-compatible servers and providers pointing at them"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+
+
+@pytest.fixture
+def mock_server():
+    """Factory starting mock servers (settings as for start_mock_server); all are shut down afterwards"""
+    servers = []
+
+    def start(**settings):
+        server, base_url = start_mock_server(**settings)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def provider(mock_server):
+    """Factory for a Provider backed by a fresh mock server; returns (provider, server)"""
+    from utils.providers import Provider
+
+    def make(name, timeout=5.0, priority=0, **settings):
+        server, base_url = mock_server(name=name, **settings)
+        return Provider(name, api_key="sk-test", base_url=base_url, timeout=timeout,
+                        connect_timeout=2.0, priority=priority), server
+
+    return make
+
+
+@pytest.fixture
+def app_env(monkeypatch, tmp_path):
+    """Environment for an AIClient against the given mock base URLs, without caches or request log"""
+
+    def configure(*base_urls, **env):
+        import json
+
+        providers = [
+            {"name": f"mock-{number}", "api_key": "sk-test", "base_url": url, "priority": number}
+            for number, url in enumerate(base_urls)
+        ]
+        monkeypatch.setenv("AI_PROVIDERS", json.dumps(providers))
+        monkeypatch.setenv("SEMANTIC_CACHE_ENABLED", "0")
+        monkeypatch.delenv("REQUEST_LOG", raising=False)
+        monkeypatch.setenv("UPLOAD_DIR", str(tmp_path / "uploads"))
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+
+    return configure
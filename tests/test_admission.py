@@ -0,0 +1,152 @@
+"""Weighted fair queueing, shedding, and admission of the background model calls"""
+
+import threading
+import time
+
+import pytest
+
+from utils.admission import AdmissionController
+from utils.cancellation import CancelToken, RequestCancelled
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def controller(**settings):
+    options = dict(max_concurrent=1, rate=1e6, burst=1e6, max_wait=5, enabled=True)
+    options.update(settings)
+    return AdmissionController(**options)
+
+
+def test_light_session_overtakes_queued_heavy_requests():
+    admission = controller()
+    held = admission.acquire("heavy", 1000)
+    order = []
+
+    def request(session, cost):
+        ticket = admission.acquire(session, cost)
+        order.append(session)
+        admission.release(ticket)
+
+    threads = []
+    for session, cost in [("heavy", 1000)] * 3 + [("light", 100)]:
+        thread = threading.Thread(target=request, args=(session, cost))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: admission.stats()['queued'] == len(threads))
+
+    admission.release(held)
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ["light", "heavy", "heavy", "heavy"]
+
+
+def test_weights_share_slots_in_proportion():
+    admission = controller(weights={"gold": 3})
+    held = admission.acquire("other", 1)
+    order = []
+
+    def request(session):
+        ticket = admission.acquire(session, 100)
+        order.append(session)
+        admission.release(ticket)
+
+    threads = []
+    for session in ["plain"] * 4 + ["gold"] * 4:
+        thread = threading.Thread(target=request, args=(session,))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: admission.stats()['queued'] == len(threads))
+
+    admission.release(held)
+    for thread in threads:
+        thread.join(5)
+
+    # Virtual finish times: gold 33, 67, 100, 133; plain 100, 200, 300, 400
+    assert order == ["gold", "gold", "plain", "gold", "gold", "plain", "plain", "plain"]
+
+
+def test_request_waiting_too_long_is_shed_as_busy():
+    admission = controller(max_wait=0.2)
+    held = admission.acquire("first", 10)
+    token = CancelToken()
+
+    with pytest.raises(RequestCancelled) as raised:
+        admission.acquire("second", 10, token)
+
+    assert raised.value.reason == 'busy'
+    assert token.reason == 'busy'
+    assert admission.stats()['shed'] == {'busy': 1}
+    admission.release(held)
+
+
+def test_session_over_its_rate_is_shed_without_waiting():
+    admission = controller(rate=100, burst=1000, max_wait=1)
+    admission.release(admission.acquire("greedy", 1000))
+
+    start = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        admission.acquire("greedy", 1000)
+
+    assert time.monotonic() - start < 0.5
+    assert admission.stats()['shed'] == {'rate_limited': 1}
+    # Other sessions are unaffected
+    admission.release(admission.acquire("other", 1000))
+
+
+def test_cancel_while_queued_leaves_the_queue():
+    admission = controller()
+    held = admission.acquire("first", 10)
+    token = CancelToken()
+    threading.Timer(0.1, token.cancel, args=("disconnected",)).start()
+
+    with pytest.raises(RequestCancelled) as raised:
+        admission.acquire("second", 10, token)
+
+    assert raised.value.reason == 'disconnected'
+    assert admission.stats()['queued'] == 0
+    admission.release(held)
+
+
+def test_summary_is_admitted_against_its_session(mock_server, app_env):
+    _, base_url = mock_server(name="summary", latency=0.0)
+    app_env(base_url)
+    from utils.ai_client import AIClient
+
+    client = AIClient()
+    summary = client.summarize_text("a long text " * 50, max_length=20, session="user-1")
+
+    assert summary.startswith("summary-reply")
+    assert client.admission.stats()['admitted'] == 1
+    assert "user-1" in client.admission._sessions
+
+
+def test_summary_is_bounded_by_total_timeout(mock_server, app_env):
+    _, base_url = mock_server(name="slow", latency=10.0)
+    app_env(base_url, AI_TOTAL_TIMEOUT="0.5")
+    from utils.ai_client import AIClient
+
+    start = time.monotonic()
+    summary = AIClient().summarize_text("text", session="user-1")
+
+    assert summary.startswith("Error summarizing text")
+    assert time.monotonic() - start < 3
+
+
+def test_summary_waits_for_a_slot(mock_server, app_env):
+    _, base_url = mock_server(name="summary", latency=0.0)
+    app_env(base_url, ADMISSION_MAX_CONCURRENT="1", ADMISSION_MAX_WAIT="0.2")
+    from utils.ai_client import AIClient
+
+    client = AIClient()
+    held = client.admission.acquire("chat", 10)
+    summary = client.summarize_text("text", session="background")
+    client.admission.release(held)
+
+    assert summary.startswith("Error summarizing text")
+    assert client.admission.stats()['shed'] == {'busy': 1}
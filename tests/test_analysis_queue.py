@@ -0,0 +1,82 @@
+"""Background analysis jobs: resubmission while a job finishes, and failed jobs"""
+
+import threading
+
+import pytest
+
+from utils.analysis_queue import AnalysisQueue
+from utils.analysis_result import AnalysisResult
+from utils.attachment_store import AttachmentStore
+from utils.upload_store import UploadBuffer
+
+
+class Processor:
+    """Stands in for FileProcessor.process_bytes"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def process_bytes(self, filename, file_bytes, cancelled=None):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("unreadable")
+        return AnalysisResult(filename, 'text/plain', len(file_bytes), kind='text')
+
+
+class SlowCloseUpload(UploadBuffer):
+    """An upload whose close() waits until released, like a large spilled file"""
+
+    def __init__(self, name, data):
+        super().__init__(name, data)
+        self.closing = threading.Event()
+        self.release = threading.Event()
+
+    def close(self):
+        if not self.closing.is_set():
+            self.closing.set()
+            self.release.wait(5)
+        super().close()
+
+
+@pytest.fixture
+def queue(tmp_path):
+    def make(processor):
+        return AnalysisQueue(processor, workers=2, store=AttachmentStore(directory=str(tmp_path), max_items=8))
+    return make
+
+
+def test_resubmit_while_the_job_finishes_does_not_block(queue):
+    analysis = queue(Processor())
+    first = SlowCloseUpload("notes.txt", b"hello")
+    key = analysis.submit("notes.txt", first)
+    assert first.closing.wait(5)
+
+    # The worker is closing the upload and has not taken the lock yet
+    done = threading.Event()
+    threading.Thread(target=lambda: (analysis.submit("notes.txt", b"hello"), done.set()), daemon=True).start()
+    assert done.wait(2), "submit blocked on the finishing job"
+
+    first.release.set()
+    assert analysis.result(key, timeout=5).filename == "notes.txt"
+    assert analysis.status(key) == 'done'
+
+
+def test_failed_job_is_dropped_but_reported(queue):
+    processor = Processor(fail=True)
+    analysis = queue(processor)
+    key = analysis.submit("broken.txt", b"data")
+
+    with pytest.raises(RuntimeError):
+        analysis.result(key, timeout=5)
+
+    assert key not in analysis._jobs
+    assert analysis.status(key) == 'failed'
+    with pytest.raises(RuntimeError):
+        analysis.result(key)
+
+    # Submitting again retries
+    processor.fail = False
+    assert analysis.submit("broken.txt", b"data") == key
+    assert analysis.result(key, timeout=5).filename == "broken.txt"
+    assert processor.calls == 2
@@ -0,0 +1,41 @@
+"""Reports of analysis results with missing fields"""
+
+from utils.analysis_result import AnalysisResult, ExtractedText
+
+
+def test_text_report_without_text():
+    result = AnalysisResult("empty.txt", 'text/plain', 0, kind='text')
+
+    report = result.markdown
+
+    assert "Text unavailable" in report
+    assert "no readable text" in result.digest()
+
+
+def test_text_report_with_text():
+    result = AnalysisResult("notes.txt", 'text/plain', 11, kind='text')
+    result.text = ExtractedText.from_text("hello world")
+
+    assert "• Words: 2" in result.markdown
+
+
+def test_image_report_without_dimensions():
+    result = AnalysisResult("broken.png", 'image/png', 2048, kind='image')
+    result.image_format = 'PNG'
+
+    report = result.markdown
+
+    assert "Dimensions: unavailable" in report
+    assert "Total Pixels" not in report
+    assert "unreadable" in result.digest()
+
+
+def test_image_report_with_dimensions():
+    result = AnalysisResult("photo.png", 'image/png', 2048, kind='image')
+    result.width, result.height = 640, 480
+
+    report = result.markdown
+
+    assert "640 × 480 pixels" in report
+    assert "Total Pixels: 307,200" in report
+    assert "Medium (Web/Screen)" in report
@@ -0,0 +1,43 @@
+"""Request validation of the headless API"""
+
+import pytest
+from starlette.testclient import TestClient
+
+
+@pytest.fixture
+def client(mock_server, app_env):
+    _, base_url = mock_server(name="api", latency=0.0)
+    app_env(base_url, AI_WARM_UP="0", CACHE_BACKEND="memory")
+    import api
+
+    with TestClient(api.app) as client:
+        yield client
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    "hello",
+    {"message": ["hello"]},
+    {"message": "hello", "file_ids": "abc"},
+    {"message": "hello", "file_ids": [1, 2]},
+    {"message": "hello", "file_ids": {"id": "abc"}},
+    {"message": "hello", "conversation_id": 7},
+])
+def test_malformed_chat_body_is_rejected(client, body):
+    response = client.post('/v1/chat', json=body)
+
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_chat_with_valid_body(client):
+    response = client.post('/v1/chat', json={"message": "hello", "file_ids": []})
+
+    assert response.status_code == 200
+    assert response.json()["response"].startswith("api-reply")
+
+
+def test_unknown_file_ids_are_not_found(client):
+    response = client.post('/v1/chat', json={"message": "hello", "file_ids": ["missing"]})
+
+    assert response.status_code == 404
@@ -0,0 +1,78 @@
+"""Stopping answers mid-stream, the total deadline, and concurrency of cancellable calls"""
+
+import threading
+import time
+
+from utils.cancellation import CancelToken
+
+
+def client_for(mock_server, app_env, env=None, **settings):
+    server, base_url = mock_server(name="mock", **settings)
+    app_env(base_url, **(env or {}))
+    from utils.ai_client import AIClient
+
+    return AIClient(), server
+
+
+def test_stop_mid_stream_keeps_what_arrived(mock_server, app_env):
+    client, _ = client_for(mock_server, app_env, latency=0.0, token_delay=0.05, completion_tokens=200)
+    token = CancelToken()
+    pieces = []
+
+    start = time.monotonic()
+    for piece in client.stream_response("tell me a story", cancel=token, session="user-1"):
+        pieces.append(piece)
+        if len(pieces) == 3:
+            token.cancel("stopped")
+
+    # 200 tokens would take 10 seconds
+    assert time.monotonic() - start < 3
+    assert pieces[-1].endswith("_(stopped)_")
+    assert 3 <= len(pieces) < 100
+    stats = client.cancellations.stats()
+    assert stats['reasons'] == {'stopped': 1}
+    assert stats['tokens_streamed'] >= 3
+
+
+def test_cancel_before_first_byte(mock_server, app_env):
+    client, _ = client_for(mock_server, app_env, latency=10.0)
+    token = CancelToken()
+    threading.Timer(0.3, token.cancel, args=("disconnected",)).start()
+
+    start = time.monotonic()
+    answer = client.get_response("hello", cancel=token, session="user-1")
+
+    assert time.monotonic() - start < 3
+    assert answer == "_(stopped)_"
+
+
+def test_total_timeout_cancels_the_answer(mock_server, app_env):
+    client, _ = client_for(mock_server, app_env, env={'AI_TOTAL_TIMEOUT': "0.5"}, latency=10.0)
+
+    start = time.monotonic()
+    answer = client.get_response("hello", session="user-1")
+
+    assert time.monotonic() - start < 3
+    assert answer.startswith("**Timeout**")
+    assert client.cancellations.stats()['reasons'] == {'timeout': 1}
+
+
+def test_cancellable_calls_are_not_capped_by_the_router(mock_server, app_env):
+    # Each call waits a second upstream; sixteen at once should take about one second, not two
+    client, server = client_for(mock_server, app_env, latency=1.0, completion_tokens=5)
+    answers = []
+
+    def ask(number):
+        answers.append(client.get_response(f"question {number}", session=f"user-{number}"))
+
+    threads = [threading.Thread(target=ask, args=(number,)) for number in range(16)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    elapsed = time.monotonic() - start
+
+    assert all(answer.startswith("mock-reply") for answer in answers)
+    assert len(answers) == 16
+    assert elapsed < 1.8
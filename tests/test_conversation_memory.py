@@ -0,0 +1,88 @@
+"""Every turn reaches the prompt, either verbatim or through the summary"""
+
+import threading
+
+from utils.conversation_memory import ConversationMemory, MemoryCompactor
+from utils.prompt_layout import PromptLayout
+
+
+class Summarizer:
+    """Stands in for AIClient.summarize_text; optionally waits until released"""
+
+    def __init__(self, block=False, fail=False):
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+        self.fail = fail
+        self.calls = 0
+        self.sessions = []
+
+    def summarize_text(self, text, max_length=200, session=None):
+        self.release.wait(5)
+        self.calls += 1
+        self.sessions.append(session)
+        if self.fail:
+            return "Error summarizing text: quota"
+        # Keep the message ids, so coverage can be checked
+        return " ".join(word for word in text.split() if word.startswith("msg-"))
+
+
+def conversation(count):
+    return [{'role': 'user' if n % 2 == 0 else 'assistant', 'content': f"msg-{n}"} for n in range(count)]
+
+
+def covered(memory, messages):
+    """Message ids that the prompt carries, verbatim or in the summary"""
+    history = PromptLayout().history(memory.history(messages))
+    return set(" ".join(message['content'] for message in history).replace(":", " ").split()) & {
+        message['content'] for message in messages}
+
+
+def test_no_turn_is_lost_while_compacting():
+    summarizer = Summarizer()
+    compactor = MemoryCompactor(summarizer, recent_messages=5, batch_messages=4)
+    memory = ConversationMemory()
+    messages = []
+    for turn in range(20):
+        messages.extend(conversation(len(messages) + 2)[len(messages):])
+        future = compactor.after_reply(memory, messages)
+        if future is not None:
+            assert future.result(5)
+        assert covered(memory, messages) == {message['content'] for message in messages}
+    assert memory.compactions > 0
+    assert len(memory.history(messages)) <= 1 + 5 + 4
+
+
+def test_turns_before_the_first_compaction_finishes_are_sent():
+    summarizer = Summarizer(block=True)
+    compactor = MemoryCompactor(summarizer, recent_messages=5, batch_messages=4)
+    memory = ConversationMemory()
+    messages = conversation(10)
+    future = compactor.after_reply(memory, messages)
+    assert future is not None and memory.pending
+    messages = conversation(14)
+    # Still summarizing: nothing covers the old turns yet, so they all go into the prompt
+    assert covered(memory, messages) == {message['content'] for message in messages}
+    summarizer.release.set()
+    assert future.result(5)
+    assert memory.covers == 5
+    assert covered(memory, messages) == {message['content'] for message in messages}
+
+
+def test_failing_summaries_keep_the_history_bounded():
+    compactor = MemoryCompactor(Summarizer(fail=True), recent_messages=5, batch_messages=4)
+    memory = ConversationMemory(max_messages=12)
+    messages = conversation(30)
+    future = compactor.after_reply(memory, messages)
+
+    assert future.result(5) is False
+    assert memory.covers == 0
+    assert [message['content'] for message in memory.history(messages)] == [f"msg-{n}" for n in range(18, 30)]
+
+
+def test_summary_counts_against_the_conversation_session():
+    summarizer = Summarizer()
+    compactor = MemoryCompactor(summarizer, recent_messages=5, batch_messages=4)
+
+    assert compactor.after_reply(ConversationMemory(), conversation(10), session="user-1").result(5)
+    assert summarizer.sessions == ["user-1"]
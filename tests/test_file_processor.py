@@ -0,0 +1,39 @@
+"""Streamed logs are indexed in full only up to TEXT_INDEX_MAX_MB"""
+
+import pytest
+
+from utils.file_processor import FileProcessor
+
+
+def log_bytes(lines, tag):
+    return "".join(
+        f"2024-05-01 12:{n // 60 % 60:02d}:{n % 60:02d} {'ERROR' if n % 7 == 0 else 'INFO'} {tag}: "
+        f"request {n} finished in {n % 97} ms\n"
+        for n in range(lines)
+    ).encode('utf-8')
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setenv("TEXT_INDEX_MAX_MB", "0.05")
+    return FileProcessor()
+
+
+def test_small_log_is_indexed_in_full(processor):
+    result = processor.process_bytes("small.log", log_bytes(200, "small"))
+
+    assert result.structure is not None
+    assert "request 150 finished" in " ".join(result.index.chunks)
+
+
+def test_large_log_is_indexed_by_its_templates(processor):
+    data = log_bytes(5000, "large")
+    assert len(data) > processor.max_stream_index_bytes
+
+    result = processor.process_bytes("large.log", data)
+
+    text = " ".join(result.index.chunks)
+    assert result.structure.lines == 5000
+    assert "request 4321 finished" not in text
+    assert "finished" in text and len(text) < len(data) // 10
+    assert any("Search Index" in note for note in result.notes)
@@ -0,0 +1,37 @@
+"""Animated images become cached contact sheets"""
+
+import io
+
+from PIL import Image
+
+from utils.frames import FrameSampler
+from utils.upload_store import UploadBuffer
+
+
+def animation(frames):
+    images = [Image.new('RGB', (64, 64), (40 * n % 256, 0, 255 - 40 * n % 256)) for n in range(frames)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:], duration=100, loop=0)
+    return buffer.getvalue()
+
+
+def test_contact_sheet_is_cached_under_upload_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv("FRAME_CACHE_DIR", raising=False)
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path))
+    sampler = FrameSampler()
+    upload = UploadBuffer("anim.gif", animation(6))
+
+    first = sampler.sample(upload)
+    second = sampler.sample(upload)
+
+    assert sampler.cache_dir == str(tmp_path / "frame_cache")
+    assert first is not None and not first.cached
+    assert second.cached
+    assert any(path.suffix == ".jpg" for path in (tmp_path / "frame_cache").iterdir())
+
+
+def test_still_image_is_not_sampled(tmp_path):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+
+    assert FrameSampler(cache_dir=str(tmp_path)).sample(UploadBuffer("still.png", buffer.getvalue())) is None
@@ -0,0 +1,87 @@
+"""Per-intent max_tokens that follow observed answer lengths"""
+
+import pytest
+
+from utils.generation_policy import GenerationPolicy, classify_intent
+
+
+@pytest.mark.parametrize('prompt, intent', [
+    ("What is the capital of France?", 'qa'),
+    ("Summarize this report", 'summary'),
+    ("Fix the bug in this Python function", 'code'),
+    ("Write a cover letter for this job", 'writing'),
+    ("explain this code in detail", 'code'),
+])
+def test_classify_intent(prompt, intent):
+    assert classify_intent(prompt) == intent
+
+
+def test_images_without_other_intent():
+    assert classify_intent("What is this?", has_images=True) == 'image'
+    assert classify_intent("Summarize this chart", has_images=True) == 'summary'
+
+
+def test_configured_limit_until_enough_samples():
+    policy = GenerationPolicy(overrides={}, adaptive=True, min_samples=5, headroom=1.25)
+    for _ in range(4):
+        policy.observe('qa', 100)
+
+    assert policy.plan('qa')['max_tokens'] == 400
+
+    policy.observe('qa', 100)
+    assert policy.plan('qa')['max_tokens'] == 125
+
+
+def test_limit_stays_within_floor_and_ceiling():
+    policy = GenerationPolicy(overrides={}, adaptive=True, min_samples=3, headroom=1.25)
+    for _ in range(3):
+        policy.observe('qa', 5)
+        policy.observe('code', 10000)
+
+    assert policy.plan('qa')['max_tokens'] == 64
+    assert policy.plan('code')['max_tokens'] == 4000
+
+
+def test_truncated_answers_raise_the_limit():
+    policy = GenerationPolicy(overrides={}, adaptive=True, min_samples=3, headroom=1.0)
+    for _ in range(3):
+        policy.observe('qa', 200)
+    assert policy.plan('qa')['max_tokens'] == 200
+
+    for _ in range(3):
+        policy.observe('qa', 200, truncated=True, max_tokens=200)
+
+    assert policy.plan('qa')['max_tokens'] == 300
+    assert policy.stats()['qa']['truncated_rate'] == 0.5
+
+
+def test_target_words_leave_room_for_the_requested_length():
+    policy = GenerationPolicy(overrides={}, adaptive=False, headroom=1.25)
+
+    assert policy.plan('summary', target_words=150)['max_tokens'] == 500
+    assert policy.plan('summary', target_words=600)['max_tokens'] == 1013
+
+
+def test_overrides_and_fixed_limits():
+    policy = GenerationPolicy(overrides={'qa': {'max_tokens': 2000, 'stop': []}}, adaptive=False, min_samples=1)
+    policy.observe('qa', 10)
+
+    plan = policy.plan('qa')
+    assert plan == {'max_tokens': 2000}
+    assert policy.plan('code')['stop'] == ["\nUser:", "\nHuman:"]
+
+
+def test_client_sends_learned_limit(mock_server, app_env):
+    _, base_url = mock_server(name="mock", latency=0.0)
+    app_env(base_url, GENERATION_MIN_SAMPLES="5")
+    from utils.ai_client import AIClient
+
+    client = AIClient()
+    for number in range(5):
+        assert client.get_response(f"question {number} [reply:100]").startswith("mock-reply")
+    assert client.generation.plan('qa')['max_tokens'] == 125
+
+    # A longer answer is cut off at the learned limit, and counted as truncated
+    answer = client.get_response("long question [reply:300]")
+    assert len(answer.split()) == 125
+    assert client.generation.stats()['qa']['truncated_rate'] > 0
@@ -0,0 +1,53 @@
+"""Scanned-PDF OCR stops promptly when its upload is cancelled"""
+
+import io
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import pytest
+
+from utils import ocr, pdf_engine
+from utils.upload_store import UploadBuffer
+
+
+def blank_pdf(pages):
+    import PyPDF2
+
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def slow_pages(monkeypatch, tmp_path):
+    """Every page takes seconds to recognize, on a thread pool instead of the process pool"""
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(pdf_engine, "get_pool", lambda *args: pool)
+    monkeypatch.setattr(ocr, "ocr_pdf_page", lambda *args: time.sleep(3) or "page text")
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path))
+    yield
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def test_cancel_stops_waiting_for_a_page(slow_pages, tmp_path):
+    engine = ocr.OcrEngine(max_pages=4)
+    upload = UploadBuffer("scan.pdf", blank_pdf(4))
+    cancelled = threading.Event()
+    threading.Timer(0.2, cancelled.set).start()
+
+    start = time.monotonic()
+    with pytest.raises(CancelledError):
+        engine.ocr_pdf(upload, cancelled=cancelled)
+
+    assert time.monotonic() - start < 1.5
+
+
+def test_cache_lives_under_upload_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv("OCR_CACHE_DIR", raising=False)
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path))
+
+    assert ocr.OcrEngine().cache_dir == str(tmp_path / "ocr_cache")
@@ -0,0 +1,98 @@
+"""Failover, hedging and the all-providers-exhausted apology against local mock servers"""
+
+import pytest
+
+from utils.cancellation import CancelToken
+from utils.providers import ProviderError, ProviderRouter
+
+
+def reply(response):
+    return response.choices[0].message.content
+
+
+@pytest.mark.parametrize('failure', ['quota', 'rate_limit', 'server'])
+def test_fails_over_to_next_provider(provider, failure):
+    broken, broken_server = provider("broken", latency=0.0, fail=failure)
+    healthy, _ = provider("healthy", latency=0.0, priority=1)
+    router = ProviderRouter([broken, healthy], hedging=False)
+
+    response = router.create('text', messages=[{"role": "user", "content": "hi"}], max_tokens=5)
+
+    assert reply(response).startswith("healthy-reply")
+    assert broken_server.settings.requests == 1
+    assert broken.health.last_error == failure
+    # The failed provider cools down and is ranked last
+    assert router.ranked('text')[0] is healthy
+
+
+def test_fails_over_on_timeout(provider):
+    stuck, _ = provider("stuck", timeout=0.5, latency=0.0, fail='timeout')
+    healthy, _ = provider("healthy", latency=0.0, priority=1)
+    router = ProviderRouter([stuck, healthy], hedging=False)
+
+    response = router.create('text', messages=[{"role": "user", "content": "hi"}], max_tokens=5)
+
+    assert reply(response).startswith("healthy-reply")
+    assert stuck.health.last_error == 'timeout'
+
+
+def test_fails_over_with_cancel_token(provider):
+    # Calls with a token go through the racing path even without hedging
+    broken, _ = provider("broken", latency=0.0, fail='quota')
+    healthy, _ = provider("healthy", latency=0.0, priority=1)
+    router = ProviderRouter([broken, healthy], hedging=False)
+
+    response = router.create('text', cancel=CancelToken(), messages=[{"role": "user", "content": "hi"}],
+                             max_tokens=5)
+
+    assert reply(response).startswith("healthy-reply")
+
+
+def test_hedge_wins_against_slow_primary(provider):
+    slow, _ = provider("slow", latency=2.0)
+    fast, fast_server = provider("fast", latency=0.0, priority=1)
+    # Both measured fast before, so the primary's hedge delay is short
+    slow.health.record_success(0.05)
+    fast.health.record_success(0.06)
+    router = ProviderRouter([slow, fast], min_hedge_delay=0.1)
+
+    response = router.create('text', messages=[{"role": "user", "content": "hi"}], max_tokens=5)
+
+    assert reply(response).startswith("fast-reply")
+    assert fast_server.settings.requests == 1
+    assert router.hedged_requests == 1
+    assert router.hedge_wins == 1
+
+
+def test_all_providers_exhausted(provider):
+    first, _ = provider("first", latency=0.0, fail='quota')
+    second, _ = provider("second", latency=0.0, fail='quota', priority=1)
+    router = ProviderRouter([first, second], hedging=False)
+
+    with pytest.raises(ProviderError) as caught:
+        router.create('text', messages=[{"role": "user", "content": "hi"}], max_tokens=5)
+
+    assert [name for name, _, _ in caught.value.errors] == ["first", "second"]
+    assert caught.value.quota_exhausted
+
+
+def test_client_apologises_when_every_provider_is_out_of_quota(mock_server, app_env):
+    _, first = mock_server(name="first", latency=0.0, fail='quota')
+    _, second = mock_server(name="second", latency=0.0, fail='quota')
+    app_env(first, second)
+    from utils.ai_client import AIClient
+
+    answer = AIClient().get_response("What is the capital of France?")
+
+    assert "Quota Exceeded" in answer
+
+
+def test_client_reports_mixed_failures_without_quota_apology(mock_server, app_env):
+    _, first = mock_server(name="first", latency=0.0, fail='quota')
+    _, second = mock_server(name="second", latency=0.0, fail='server')
+    app_env(first, second)
+    from utils.ai_client import AIClient
+
+    answer = AIClient().get_response("What is the capital of France?")
+
+    assert "Quota Exceeded" not in answer
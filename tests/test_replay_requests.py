@@ -0,0 +1,30 @@
+"""Synthesized replay questions keep the recorded intent and are never decomposed"""
+
+import pytest
+
+from tools.replay_requests import FILLER, LEAD, Synthesizer, filler
+from utils.generation_policy import classify_intent
+from utils.query_decomposition import COMPOUND_RE, question_aspects
+
+
+def test_filler_words_match_no_pattern():
+    text = " ".join(FILLER)
+
+    assert COMPOUND_RE.search(text) is None
+    assert classify_intent(text) == 'qa'
+
+
+@pytest.mark.parametrize('intent', [None, *LEAD])
+def test_synthesized_questions_are_not_compound(intent):
+    synthesizer = Synthesizer(max_text_chars=10000, hint_replies=False)
+    for number in range(200):
+        question = synthesizer.question({'q': f"question-{number}", 'qc': 400, 'i': intent})
+
+        assert COMPOUND_RE.search(question.lower()) is None, question
+        assert question_aspects(question) == [], question
+        assert classify_intent(question) == (intent or 'qa')
+
+
+def test_filler_is_deterministic():
+    assert filler("seed", 120) == filler("seed", 120)
+    assert len(filler("seed", 120)) == 120
@@ -0,0 +1,79 @@
+"""Semantic cache hits for paraphrases, misses for questions that only look alike"""
+
+import pytest
+
+from utils.semantic_cache import HashingEmbedder, SemanticCache, cache_scope
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.delenv("SEMANTIC_CACHE_THRESHOLD", raising=False)
+    return SemanticCache(embedder=HashingEmbedder(), enabled=True)
+
+
+@pytest.mark.parametrize('asked, rephrased', [
+    ("summarize this PDF", "give me a summary of the pdf"),
+    ("What is this document about?", "what's this document about"),
+    ("Summarize the report", "Please summarize the report"),
+])
+def test_paraphrase_hits(cache, asked, rephrased):
+    cache.put(asked, "scope", "answer")
+
+    assert cache.get(rephrased, "scope") == "answer"
+    assert cache.stats()['hits'] == 1
+
+
+@pytest.mark.parametrize('asked, different', [
+    ("Which clauses are enforceable?", "Which clauses are not enforceable?"),
+    ("Which clauses are not enforceable?", "Which clauses are enforceable?"),
+    ("why did revenue fall", "how did revenue fall"),
+    ("explain this code", "explain this code in detail"),
+    ("Is it valid?", "Isn't it valid?"),
+    ("What is on page 3?", "What is on page 4?"),
+])
+def test_different_questions_miss(cache, asked, different):
+    cache.put(asked, "scope", "answer")
+
+    assert cache.get(different, "scope") is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_hashing_threshold_is_above_near_duplicates(cache):
+    # Similar wording alone is not enough with the hashing embedder
+    assert cache.threshold >= 0.85
+
+
+def test_other_scope_misses(cache):
+    cache.put("summarize this PDF", "scope-a", "answer")
+
+    assert cache.get("summarize this PDF", "scope-b") is None
+
+
+def test_scope_depends_on_files_and_history():
+    class File:
+        def __init__(self, content_hash):
+            self.content_hash = content_hash
+            self.filename = "report.pdf"
+            self.size = 1
+
+    history = [{'role': 'user', 'content': "hi"}, {'role': 'assistant', 'content': "hello"}]
+    assert cache_scope([File("a")]) != cache_scope([File("b")])
+    assert cache_scope([File("a")]) != cache_scope([File("a")], history)
+    assert cache_scope([File("a"), File("b")]) == cache_scope([File("b"), File("a")])
+
+
+def test_expired_entries_miss():
+    cache = SemanticCache(embedder=HashingEmbedder(), enabled=True, ttl=60, threshold=0.85)
+    cache.put("summarize this PDF", "scope", "answer")
+    for entry in cache._entries.values():
+        entry.created -= 120
+
+    assert cache.get("summarize this PDF", "scope") is None
+
+
+def test_disabled_cache_stores_nothing():
+    cache = SemanticCache(embedder=HashingEmbedder(), enabled=False)
+    cache.put("summarize this PDF", "scope", "answer")
+
+    assert cache.get("summarize this PDF", "scope") is None
+    assert cache.stats()['entries'] == 0
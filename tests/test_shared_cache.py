@@ -0,0 +1,140 @@
+"""Signed cache entries, and no shared backend without a secret"""
+
+import logging
+import pickle
+
+import pytest
+
+from utils.shared_cache import (CacheSerializer, FileBackend, MemoryBackend, SharedCache, load_backend)
+
+
+class Exploit:
+    """Unpickling this would run code"""
+
+    def __reduce__(self):
+        return (pytest.fail, ("unsigned pickle was loaded",))
+
+
+def test_round_trip_signed_and_compressed():
+    serializer = CacheSerializer("secret")
+    value = {'text': "x" * 5000, 'numbers': list(range(100))}
+
+    data = serializer.dumps(value)
+
+    assert len(data) < 5000
+    assert serializer.loads(data) == value
+
+
+def test_unsigned_entry_is_refused():
+    forged = bytes([0]) + pickle.dumps(Exploit())
+
+    with pytest.raises(ValueError):
+        CacheSerializer("secret").loads(forged)
+
+
+def test_entry_signed_with_another_secret_is_refused():
+    data = CacheSerializer("other").dumps(Exploit())
+
+    with pytest.raises(ValueError):
+        CacheSerializer("secret").loads(data)
+
+
+def test_tampered_payload_is_refused():
+    data = bytearray(CacheSerializer("secret").dumps({'answer': 42}))
+    data[-2] ^= 0xFF
+
+    with pytest.raises(ValueError):
+        CacheSerializer("secret").loads(bytes(data))
+
+
+def test_forged_entry_is_a_miss(tmp_path):
+    backend = FileBackend(str(tmp_path))
+    cache = SharedCache(backend=backend, serializer=CacheSerializer("secret"))
+    backend.set("llm-chatbot:key", bytes([0]) + pickle.dumps(Exploit()))
+
+    assert cache.get("key", "default") == "default"
+    assert cache.stats()['errors'] == 1
+
+
+def test_shared_backend_is_shared_with_the_secret(tmp_path):
+    writer = SharedCache(backend=FileBackend(str(tmp_path)), serializer=CacheSerializer("secret"))
+    reader = SharedCache(backend=FileBackend(str(tmp_path)), serializer=CacheSerializer("secret"))
+    writer.set("key", [1, 2, 3])
+
+    assert reader.get("key") == [1, 2, 3]
+
+
+def test_shared_backend_without_secret_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        SharedCache(backend=FileBackend(str(tmp_path)), serializer=CacheSerializer(None))
+
+
+@pytest.mark.parametrize('kind', ['file', 'redis'])
+def test_configured_shared_backend_needs_secret(monkeypatch, caplog, kind):
+    monkeypatch.setenv("CACHE_BACKEND", kind)
+    monkeypatch.delenv("CACHE_SECRET", raising=False)
+
+    with caplog.at_level(logging.WARNING, logger="utils.shared_cache"):
+        cache = SharedCache()
+
+    assert isinstance(cache.backend, MemoryBackend)
+    assert "CACHE_SECRET" in caplog.text
+
+
+def test_missing_redis_package_is_logged(monkeypatch, caplog):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def without_redis(name, *args, **kwargs):
+        if name == "redis":
+            raise ImportError("No module named 'redis'")
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setenv("CACHE_BACKEND", "redis")
+    monkeypatch.setattr(builtins, "__import__", without_redis)
+
+    with caplog.at_level(logging.WARNING, logger="utils.shared_cache"):
+        backend = load_backend(signed=True)
+
+    assert isinstance(backend, MemoryBackend)
+    assert "redis package is not installed" in caplog.text
+
+
+def test_memory_backend_evicts_by_bytes():
+    backend = MemoryBackend(max_items=100, max_bytes=1000)
+    for number in range(5):
+        backend.set(f"key-{number}", bytes(300))
+        backend.get("key-0")  # kept recently used
+
+    assert backend.size_bytes <= 1000
+    assert backend.get("key-0") is not None
+    assert backend.get("key-1") is None and backend.get("key-2") is None
+    assert backend.get("key-4") is not None
+
+
+def test_memory_backend_skips_entries_over_the_budget():
+    backend = MemoryBackend(max_items=100, max_bytes=1000)
+    backend.set("small", bytes(10))
+    backend.set("huge", bytes(5000))
+
+    assert backend.get("huge") is None
+    assert backend.get("small") is not None
+    assert backend.size_bytes == 10
+
+
+def test_memory_backend_replacing_and_deleting_keeps_the_count():
+    backend = MemoryBackend(max_items=100, max_bytes=1000)
+    backend.set("key", bytes(400))
+    backend.set("key", bytes(100))
+    assert backend.size_bytes == 100
+
+    backend.delete("key")
+    assert backend.size_bytes == 0
+
+
+def test_file_backend_defaults_under_upload_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv("CACHE_DIR", raising=False)
+    monkeypatch.setenv("UPLOAD_DIR", str(tmp_path))
+
+    assert FileBackend().directory == str(tmp_path / "shared_cache")
@@ -0,0 +1,50 @@
+"""Packing images into vision requests, including images whose size could not be read"""
+
+import io
+
+from PIL import Image
+
+from utils.analysis_result import AnalysisResult, PreparedImage
+from utils.vision_batch import VisionBatcher, vision_items
+
+
+def image_result(name, data, mime_type='image/png'):
+    result = AnalysisResult(name, mime_type, len(data), kind='image')
+    result.image = PreparedImage.from_bytes(mime_type, data)
+    result.width, result.height = result.image.width, result.image.height
+    return result
+
+
+def png(width, height, color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def batcher():
+    return VisionBatcher(min_images=4, max_pixels=6000000, small_side=768, tile_side=256, grid_cells=4)
+
+
+def test_small_images_share_a_grid():
+    results = [image_result(f"shot-{n}.png", png(200, 150, 'red')) for n in range(4)]
+
+    batches = batcher().plan(vision_items(results))
+
+    assert len(batches) == 1
+    assert len(batches[0].parts) == 1
+    assert batches[0].label == "Images 1–4"
+
+
+def test_unreadable_image_is_sent_on_its_own():
+    results = [image_result(f"shot-{n}.png", png(200, 150, 'blue')) for n in range(4)]
+    results.insert(2, image_result("odd.png", b"\x89PNG not really an image"))
+
+    items = vision_items(results)
+    batches = batcher().plan(items)
+
+    assert len(items) == 5
+    assert items[2].filename == "odd.png" and not items[2].sized
+    alone = [batch for batch in batches if any(item.filename == "odd.png" for item in batch.items)]
+    assert len(alone) == 1 and len(alone[0].items) == 1
+    assert alone[0].parts[0]['image_url']['url'].startswith("data:image/png;base64,")
+    assert sorted(item.number for batch in batches for item in batch.items) == [1, 2, 3, 4, 5]
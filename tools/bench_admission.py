@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Latency of normal users while one session floods the model with big prompts.
+
+A mock server with limited capacity (requests served at once, prefill time
+growing with prompt size) is shared by a few normal users, who ask short
+questions with some think time in between, and one heavy session firing
+huge prompts from many threads. Runs once without and once with admission
+control and reports the normal users' latency and what happened to the
+heavy session's requests:
+
+    python -m tools.bench_admission --duration 20 --users 8 --capacity 4
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+
+BUSY = "**Busy**"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float('nan')
+
+
+def run(client, args):
+    """Latencies (s) of normal users' answers, plus (answered, shed) counts per group"""
+    stop = time.monotonic() + args.duration
+    lock = threading.Lock()
+    latencies = []
+    counts = {'normal': [0, 0], 'heavy': [0, 0]}
+
+    def user(number):
+        asked = 0
+        while time.monotonic() < stop:
+            asked += 1
+            start = time.perf_counter()
+            answer = client.get_response(f"User {number}, question {asked}: what does term {asked} mean?",
+                                         session=f"user-{number}")
+            with lock:
+                counts['normal'][answer.startswith(BUSY)] += 1
+                if not answer.startswith(BUSY):
+                    latencies.append(time.perf_counter() - start)
+            time.sleep(args.think)
+
+    def heavy(number):
+        attachment = "lorem ipsum dolor sit amet " * (args.heavy_tokens * 4 // 27)
+        asked = 0
+        while time.monotonic() < stop:
+            asked += 1
+            answer = client.get_response(f"Thread {number} request {asked}: summarize this\n{attachment}",
+                                         session="heavy")
+            with lock:
+                counts['heavy'][answer.startswith(BUSY)] += 1
+            if answer.startswith(BUSY):
+                time.sleep(0.2)
+
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(args.users)]
+    threads += [threading.Thread(target=heavy, args=(n,)) for n in range(args.heavy_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark admission control under a noisy session")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds per run")
+    parser.add_argument('--users', type=int, default=8, help="Normal users")
+    parser.add_argument('--think', type=float, default=0.5, help="Seconds between a user's questions")
+    parser.add_argument('--heavy-threads', type=int, default=16, help="Concurrent requests of the heavy session")
+    parser.add_argument('--heavy-tokens', type=int, default=20000, help="Prompt tokens per heavy request")
+    parser.add_argument('--capacity', type=int, default=4, help="Requests the mock serves at once")
+    parser.add_argument('--latency', type=float, default=0.2, help="Mock base latency in seconds")
+    parser.add_argument('--rate', type=float, help="Tokens/s per session (default ADMISSION_RATE)")
+    parser.add_argument('--prefill-delay', type=float, default=0.05, help="Mock delay per 1000 prompt tokens")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(latency=args.latency, prefill_delay=args.prefill_delay,
+                                         capacity=args.capacity, completion_tokens=32)
+    os.environ.update({
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_BASE_URL': base_url,
+        # Every prompt should reach the (mock) model
+        'SEMANTIC_CACHE_ENABLED': '0',
+    })
+
+    from utils.admission import AdmissionController
+    from utils.ai_client import AIClient
+
+    print(f"{args.users} users ({args.think:g} s think time) + 1 session with {args.heavy_threads} threads "
+          f"of {args.heavy_tokens}-token prompts, mock capacity {args.capacity}, {args.duration:g} s per run")
+    print(f"{'admission':<10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+          f"{'user ok/busy':>14}{'heavy ok/busy':>15}")
+    for enabled in (False, True):
+        client = AIClient()
+        client.admission = AdmissionController(max_concurrent=args.capacity, rate=args.rate, enabled=enabled)
+        latencies, counts = run(client, args)
+        cells = "".join(f"{percentile(latencies, f) * 1000:>9.0f}" for f in (0.5, 0.95, 0.99, 1.0))
+        print(f"{'on' if enabled else 'off':<10}{cells}"
+              f"{'%d/%d' % tuple(counts['normal']):>14}{'%d/%d' % tuple(counts['heavy']):>15}")
+        if enabled:
+            stats = client.admission.stats()
+            print(f"queue wait p50/p95/p99: {stats['wait_ms_p50']}/{stats['wait_ms_p95']}/{stats['wait_ms_p99']} ms, "
+                  f"shed: {stats['shed']}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
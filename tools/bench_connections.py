@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+First-request latency and connection reuse against a TLS endpoint.
+
+Starts a TLS mock server whose connection setup costs ``--connect-delay``
+seconds (standing in for DNS, TCP and TLS round trips to a distant
+provider) and sends a mix of plain and streamed questions through a fresh
+AIClient in three setups:
+
+* ``no keep-alive``: every request opens its own connection;
+* ``pooled``: the shared pool, connections kept between requests;
+* ``pooled+warm``: the same, with ``warm_up`` run before the first question.
+
+Reports the first question's latency, the rest's p50/p95, and connections
+and TLS handshakes per request:
+
+    python -m tools.bench_connections --requests 40 --connect-delay 0.15
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float('nan')
+
+
+def run(args, keepalive, warm):
+    """(first latency s, later latencies s, pool stats, connections the server accepted)"""
+    # A server per setup: pools are per endpoint, so each run starts cold
+    server, base_url = start_mock_server(tls=True, latency=args.latency, connect_delay=args.connect_delay,
+                                         completion_tokens=24, token_delay=0.002)
+    os.environ.update({
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_BASE_URL': base_url,
+        'AI_CA_BUNDLE': server.ca_file,
+        'AI_MAX_KEEPALIVE': str(keepalive),
+        'SEMANTIC_CACHE_ENABLED': '0',
+    })
+
+    from utils.ai_client import AIClient
+
+    client = AIClient()
+    if warm:
+        client.warm_up()
+    latencies = []
+    for number in range(args.requests):
+        start = time.perf_counter()
+        if number % 2:
+            "".join(client.stream_response(f"Streamed question {number}"))
+        else:
+            client.get_response(f"Question {number}")
+        latencies.append(time.perf_counter() - start)
+        time.sleep(args.think)
+    stats = client.router.stats()['connections']['openai']
+    accepted = server.settings.connections
+    server.shutdown()
+    return latencies[0], latencies[1:], stats, accepted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark connection pooling and warm-up")
+    parser.add_argument('--requests', type=int, default=40, help="Questions per setup, half of them streamed")
+    parser.add_argument('--connect-delay', type=float, default=0.15, help="Mock connection setup time in seconds")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock base latency in seconds")
+    parser.add_argument('--think', type=float, default=0.05, help="Seconds between questions")
+    args = parser.parse_args()
+
+    print(f"{args.requests} questions per setup, {args.connect_delay * 1000:.0f} ms connection setup, "
+          f"{args.latency * 1000:.0f} ms model latency")
+    print(f"{'setup':<15}{'first ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'conns':>7}{'tls':>6}{'reuse':>8}")
+    for name, keepalive, warm in (("no keep-alive", 0, False), ("pooled", 16, False), ("pooled+warm", 16, True)):
+        first, rest, stats, accepted = run(args, keepalive, warm)
+        print(f"{name:<15}{first * 1000:>10.0f}{percentile(rest, 0.5) * 1000:>9.0f}"
+              f"{percentile(rest, 0.95) * 1000:>9.0f}{accepted:>7}{stats['tls_handshakes']:>6}"
+              f"{stats['reuse_rate']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+One prompt versus parallel subqueries for a compound question over several documents.
+
+Synthetic contracts, each a long run of boilerplate with one clause per
+aspect carrying a planted fact (e.g. "TERMINATION-FACT-3"), are asked
+"Compare the contracts on termination, liability, pricing and renewal".
+The question runs once as a single prompt and once decomposed, then
+again decomposed with one more aspect to show the subquery cache. A mock
+server with prefill and per-token delays stands in for the provider; it
+does not read the prompt, so coverage is counted from what each prompt
+put in front of the model: planted facts that appear in the single
+prompt, or in some subquery's excerpts.
+
+    python -m tools.bench_decomposition --documents 4 --aspects 4 --capacity 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+
+ASPECTS = ("termination", "liability", "pricing", "renewal", "confidentiality", "jurisdiction")
+BOILERPLATE = ("the parties agree that the services shall be provided with reasonable care and skill "
+               "in accordance with the schedule and that notices shall be given in writing to the "
+               "addresses set out above unless otherwise agreed between them from time to time").split()
+
+
+def fact(document, aspect):
+    return f"{aspect.upper()}-FACT-{document}"
+
+
+def contract(number, aspects, chunks, seed):
+    """Text of about ``chunks`` index chunks with one clause per aspect at a random place"""
+    rng = random.Random(seed * 1000 + number)
+    paragraphs = [" ".join(rng.choice(BOILERPLATE) for _ in range(120)) + "." for _ in range(chunks)]
+    for aspect in aspects:
+        clause = (f"{aspect.capitalize()}. The {aspect} terms of this agreement are set out in "
+                  f"{fact(number, aspect)}, which governs {aspect} for both parties.")
+        paragraphs.insert(rng.randrange(1, len(paragraphs)), clause)
+    return "\n\n".join(paragraphs)
+
+
+def documents(count, aspects, chunks, seed):
+    from utils.analysis_result import AnalysisResult, ExtractedText
+    from utils.text_index import TextIndex
+
+    results = []
+    for number in range(1, count + 1):
+        text = contract(number, aspects, chunks, seed)
+        result = AnalysisResult(f"contract-{number}.txt", 'text/plain', len(text),
+                                content_hash=f"bench-contract-{seed}-{number}", kind='text')
+        result.text = ExtractedText.from_text(text)
+        result.index = TextIndex.from_text(text)
+        results.append(result)
+    return results
+
+
+def covered(texts, count, aspects):
+    """Share of planted facts that appear in any of ``texts``"""
+    joined = "\n".join(texts)
+    facts = [fact(number, aspect) for number in range(1, count + 1) for aspect in aspects]
+    return sum(item in joined for item in facts) / len(facts)
+
+
+def message_text(messages):
+    return "\n".join(message['content'] for message in messages if isinstance(message.get('content'), str))
+
+
+def ask(client, question, files):
+    """(seconds to first piece, seconds in total) of a streamed answer"""
+    start = time.perf_counter()
+    first = None
+    for _ in client.stream_response(question, files, []):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query decomposition over several documents")
+    parser.add_argument('--documents', type=int, default=4, help="Attached contracts")
+    parser.add_argument('--aspects', type=int, default=4, help="Aspects the question lists (one more on the rerun)")
+    parser.add_argument('--chunks', type=int, default=60, help="Boilerplate chunks per contract")
+    parser.add_argument('--capacity', type=int, default=8, help="Requests the mock serves at once")
+    parser.add_argument('--latency', type=float, default=0.3, help="Mock base latency in seconds")
+    parser.add_argument('--prefill-delay', type=float, default=0.1, help="Mock delay per 1000 prompt tokens")
+    parser.add_argument('--token-delay', type=float, default=0.01, help="Mock seconds per streamed token")
+    parser.add_argument('--completion-tokens', type=int, default=80, help="Mock answer length in tokens")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(latency=args.latency, prefill_delay=args.prefill_delay,
+                                         token_delay=args.token_delay, capacity=args.capacity,
+                                         completion_tokens=args.completion_tokens)
+    os.environ.update({
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_BASE_URL': base_url,
+        # Every question should reach the (mock) model; the subquery cache is what is measured
+        'SEMANTIC_CACHE_ENABLED': '0',
+    })
+
+    from utils.admission import estimate_tokens
+    from utils.ai_client import AIClient
+
+    asked = ASPECTS[:args.aspects]
+    question = f"Compare the contracts on {', '.join(asked[:-1])} and {asked[-1]}."
+    files = documents(args.documents, ASPECTS, args.chunks, args.seed)
+    client = AIClient()
+    print(f"{args.documents} contracts of ~{args.chunks} chunks, question: {question!r}")
+    print(f"{'mode':<22}{'first ms':>10}{'total ms':>10}{'calls':>7}{'prompt tok':>12}{'coverage':>10}")
+
+    def row(label, timings, calls, tokens, coverage):
+        first, total = timings
+        print(f"{label:<22}{first * 1000:>10.0f}{total * 1000:>10.0f}{calls:>7}{tokens:>12}{coverage:>10.0%}")
+
+    client.decomposer.enabled = False
+    _, messages = client._build_messages(question, files, [])
+    before = server.settings.requests
+    timings = ask(client, question, files)
+    row("single prompt", timings, server.settings.requests - before, estimate_tokens(messages),
+        covered([message_text(messages)], args.documents, asked))
+
+    client.decomposer.enabled = True
+    for label, aspects in (("decomposed", asked), ("decomposed +1 aspect", ASPECTS[:args.aspects + 1])):
+        text = f"Compare the contracts on {', '.join(aspects[:-1])} and {aspects[-1]}."
+        subqueries = client.decomposer.plan(text, files)
+        synthesis = client.decomposer.synthesis_messages(text, [(subquery, "") for subquery in subqueries],
+                                                         client.layout)
+        cache = client.decomposer.cache
+        tokens = estimate_tokens(synthesis) + sum(
+            estimate_tokens(subquery.messages()) for subquery in subqueries if cache.get(subquery.key) is None)
+        excerpts = [chunk for subquery in subqueries for _, chunk in subquery.excerpts]
+        before = server.settings.requests
+        timings = ask(client, text, files)
+        row(label, timings, server.settings.requests - before, tokens,
+            covered(excerpts, args.documents, aspects))
+
+    print(f"decomposition: {client.decomposer.stats()}")
+    print("Decomposed prompt tokens: subqueries not answered from the cache, plus the synthesis with\n"
+          "empty findings. The first piece waits for the slowest subquery wave.")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Compare fixed generation limits with the per-intent generation policy.
+
+Sends prompts of each intent (short Q&A, summary, code, writing, image
+description) to a mock server whose answer lengths vary log-normally
+around a per-intent typical length, once with the old fixed limits and
+once with the adaptive policy after a warm-up. Reports latency, the
+max_tokens reserved against the provider's tokens-per-minute limit, and
+how often answers were cut off:
+
+    python -m tools.bench_generation_policy --requests 60 --token-delay 0.002
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+
+# intent: (typical answer tokens, prompt templates)
+SCENARIOS = {
+    'qa': (90, ["What is the capital of country number {n}?", "How many days are in month {n}?",
+                "Is number {n} a prime?", "Who invented invention {n}?"]),
+    'summary': (180, ["Summarize chapter {n} of the report.", "Give me the key points of memo {n}.",
+                      "TL;DR of meeting {n}?"]),
+    'code': (420, ["Write a python function that parses format {n}.", "Fix the bug in script {n}.",
+                   "Refactor class {n} to use dataclasses."]),
+    'writing': (380, ["Draft a blog post about topic {n}.", "Write a cover letter for job {n}.",
+                      "Explain process {n} step by step."]),
+    'image': (140, ["What is shown in picture {n}?", "Describe photo {n}.", "What colours dominate image {n}?"]),
+}
+
+# What the client used before the policy: 1000 for every chat answer
+LEGACY_LIMITS = {intent: {'max_tokens': 1000, 'stop': [], 'adaptive': False} for intent in SCENARIOS}
+
+
+def photo():
+    """FileProcessor result for a small PNG"""
+    from PIL import Image
+    from utils.file_processor import FileProcessor
+
+    output = io.BytesIO()
+    Image.new('RGB', (64, 64), (90, 140, 200)).save(output, format='PNG')
+    return FileProcessor().process_bytes("photo.png", output.getvalue())
+
+
+def ask(client, intent, prompt, image):
+    """One request through the client's public path; returns (seconds, planned max_tokens)"""
+    files = [image] if intent == 'image' else None
+    planned = client.generation.plan(client.generation.classify(prompt, has_images=files is not None))
+    start = time.perf_counter()
+    client.get_response(prompt, files)
+    return time.perf_counter() - start, planned['max_tokens']
+
+
+def run(client, server, requests, concurrency, image, offset):
+    """Per intent: latency, reserved tokens and truncation for ``requests`` prompts"""
+    results = {}
+    for intent, (typical, templates) in SCENARIOS.items():
+        server.settings.completion_tokens = typical
+        before = client.generation.stats()[intent]
+        prompts = [templates[n % len(templates)].format(n=offset + n) for n in range(requests)]
+        with ThreadPoolExecutor(concurrency) as pool:
+            samples = list(pool.map(lambda prompt: ask(client, intent, prompt, image), prompts))
+        after = client.generation.stats()[intent]
+        seconds = sorted(duration for duration, _ in samples)
+        truncated = after['truncated_rate'] * after['requests'] - before['truncated_rate'] * before['requests']
+        results[intent] = {
+            'max_tokens': samples[-1][1],
+            'mean_ms': statistics.mean(seconds) * 1000,
+            'p95_ms': seconds[int(0.95 * (len(seconds) - 1))] * 1000,
+            'reserved': sum(planned for _, planned in samples),
+            'truncated': round(truncated) / requests,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation policy")
+    parser.add_argument('--requests', type=int, default=60, help="Requests per intent and run")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock base latency in seconds")
+    parser.add_argument('--token-delay', type=float, default=0.002, help="Mock delay per streamed token")
+    parser.add_argument('--spread', type=float, default=0.6, help="Spread of mock answer lengths")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(latency=args.latency, token_delay=args.token_delay,
+                                         completion_spread=args.spread)
+    os.environ.update({
+        'OPENAI_API_KEY': 'sk-bench',
+        'OPENAI_BASE_URL': base_url,
+        # Every prompt should reach the (mock) model
+        'SEMANTIC_CACHE_ENABLED': '0',
+    })
+
+    from utils.ai_client import AIClient
+    from utils.generation_policy import GenerationPolicy
+
+    image = photo()
+    client = AIClient()
+    client.generation = GenerationPolicy(overrides=LEGACY_LIMITS, adaptive=False)
+    fixed = run(client, server, args.requests, args.concurrency, image, offset=0)
+
+    client.generation = GenerationPolicy(adaptive=True)
+    # Warm up on other prompts, then measure on the same prompts as the fixed run
+    run(client, server, args.requests, args.concurrency, image, offset=10000)
+    adaptive = run(client, server, args.requests, args.concurrency, image, offset=0)
+
+    print(f"{args.requests} requests per intent, {args.concurrency} concurrent, "
+          f"{args.token_delay * 1000:.1f} ms/token, spread {args.spread}")
+    print(f"{'intent':<9}{'policy':<10}{'max_tokens':>11}{'mean ms':>10}{'p95 ms':>10}"
+          f"{'reserved':>10}{'truncated':>11}")
+    for intent in SCENARIOS:
+        for name, results in (('fixed', fixed), ('adaptive', adaptive)):
+            row = results[intent]
+            print(f"{intent:<9}{name:<10}{row['max_tokens']:>11}{row['mean_ms']:>10.0f}{row['p95_ms']:>10.0f}"
+                  f"{row['reserved']:>10}{row['truncated']:>10.1%}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
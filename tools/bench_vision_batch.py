@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Compare batched vision requests with one image part per upload.
+
+Generates synthetic screenshots, runs them through FileProcessor, and
+sends the same question both ways to a mock server whose latency grows
+with prompt tokens (images are counted with OpenAI's tiling rule):
+
+    python -m tools.bench_vision_batch --images 20 --width 640 --height 400
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+
+QUESTION = "Which of these screenshots shows an error dialog?"
+
+
+def screenshot(number, width, height):
+    """PNG bytes of a fake application window"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, 28), fill=(60, 60, 90))
+    draw.text((8, 8), f"Window {number}", fill=(255, 255, 255))
+    for row in range(40, height - 20, 24):
+        draw.text((12, row), f"Line {row // 24} of screen {number}: status OK", fill=(20, 20, 20))
+    if number % 7 == 0:
+        draw.rectangle((width // 4, height // 3, 3 * width // 4, 2 * height // 3), fill=(200, 40, 40))
+        draw.text((width // 4 + 10, height // 3 + 10), "ERROR", fill=(255, 255, 255))
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def run_one_per_part(client, results):
+    """Current behaviour: one request, every image as its own part"""
+    kind, messages = client._build_messages(QUESTION, results)
+    start = time.perf_counter()
+    response = client.router.create(kind, messages=messages, max_tokens=1000)
+    return {
+        'calls': 1,
+        'seconds': time.perf_counter() - start,
+        'prompt_tokens': response.usage.prompt_tokens,
+        'payload_kb': len(json.dumps(messages)) / 1024,
+    }
+
+
+def run_batched(client, results):
+    """Grid composites packed under the pixel budget, split calls run concurrently"""
+    start = time.perf_counter()
+    requests = client._vision_requests(QUESTION, results)
+    if not requests:
+        # Below VISION_BATCH_MIN the client does not batch
+        return run_one_per_part(client, results)
+    planned = time.perf_counter() - start
+    outcomes = client.vision_batcher.run(client.router, requests, max_tokens=1000)
+    return {
+        'calls': len(requests),
+        'seconds': time.perf_counter() - start,
+        'planning_seconds': planned,
+        'prompt_tokens': sum(response.usage.prompt_tokens for _, response in outcomes),
+        'payload_kb': sum(len(json.dumps(messages)) for _, messages in requests) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched vision requests")
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.5, help="Mock base latency in seconds")
+    parser.add_argument('--prefill-delay', type=float, default=0.15, help="Mock delay per 1000 prompt tokens")
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(latency=args.latency, prefill_delay=args.prefill_delay)
+    os.environ['OPENAI_API_KEY'] = 'sk-bench'
+    os.environ['OPENAI_BASE_URL'] = base_url
+
+    from utils.ai_client import AIClient
+    from utils.file_processor import FileProcessor
+
+    processor = FileProcessor()
+    results = [
+        processor.process_bytes(f"screen_{n}.png", screenshot(n, args.width, args.height))
+        for n in range(1, args.images + 1)
+    ]
+    client = AIClient()
+
+    print(f"{args.images} images of {args.width}x{args.height}, best of {args.runs} runs")
+    for name, scenario in (('one image per part', run_one_per_part), ('batched', run_batched)):
+        best = min((scenario(client, results) for _ in range(args.runs)), key=lambda r: r['seconds'])
+        details = ", ".join(
+            f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in best.items()
+        )
+        print(f"{name:>20}: {details}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Measure cold-start cost of the app core in fresh interpreters.
+
+Reports wall time and peak RSS for importing the headless core, building
+the clients, and (for comparison) eagerly importing every file parser:
+
+    python -m tools.measure_startup
+"""
+
+import json
+import subprocess
+import sys
+
+SCENARIOS = {
+    'core import': "import utils.ai_client, utils.file_processor",
+    'core + clients': (
+        "import os; os.environ.setdefault('OPENAI_API_KEY', 'sk-measure');"
+        "from utils import AIClient, FileProcessor; AIClient(); FileProcessor()"
+    ),
+    'eager parsers': "import magic, chardet, PyPDF2; from PIL import Image; import openai",
+}
+
+PROBE = """
+import resource, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def measure(code, runs=5):
+    """Best-of-N import time (ms) and peak RSS (MB) in fresh interpreters"""
+    times, rss = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(code=code)],
+            capture_output=True, text=True, check=True
+        ).stdout.split()
+        times.append(float(output[0]) * 1000)
+        rss.append(int(output[1]) / 1024)
+    return min(times), min(rss)
+
+
+def main():
+    results = {}
+    for name, code in SCENARIOS.items():
+        try:
+            elapsed, peak = measure(code)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:16} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        results[name] = {'ms': round(elapsed, 1), 'rss_mb': round(peak, 1)}
+        print(f"{name:16} {elapsed:8.1f} ms  {peak:7.1f} MB")
+    if '--json' in sys.argv:
+        print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI-compatible server for local development and benchmarking.
+
+Answers /v1/chat/completions (plain and streaming) and /v1/models with
+configurable latency and injected failures, so provider failover and
+hedging can be exercised without an API key:
+
+    python -m tools.mock_openai_server --port 8081 --latency 0.3
+    python -m tools.mock_openai_server --port 8082 --fail quota
+
+Point the app at it with OPENAI_BASE_URL=http://localhost:8081/v1 or via
+an AI_PROVIDERS entry. With ``--tls`` it serves HTTPS with a throwaway
+self-signed certificate (made with the openssl command line tool); trust it
+with AI_CA_BUNDLE=<printed path>. ``--connect-delay`` adds a pause before
+each new connection is served, standing in for the DNS, TCP and TLS round
+trips to a distant provider. A user message containing ``[reply:N]``
+gets an answer of N tokens (replayed request logs use it to reproduce the
+recorded answer lengths).
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_HINT_RE = re.compile(r"\[reply:(\d+)\]")
+
+# Error bodies shaped like the real API's
+FAILURES = {
+    'quota': (429, "insufficient_quota",
+              "You exceeded your current quota, please check your plan and billing details."),
+    'rate_limit': (429, "rate_limit_exceeded", "Rate limit reached for requests."),
+    'server': (500, "server_error", "The server had an error while processing your request."),
+    'auth': (401, "invalid_api_key", "Incorrect API key provided."),
+}
+
+
+class MockSettings:
+    """Behaviour knobs shared by all request handlers of one server"""
+
+    def __init__(self, latency=0.2, jitter=0.0, fail=None, fail_rate=1.0,
+                 completion_tokens=64, completion_spread=0.0, token_delay=0.0, prefill_delay=0.0,
+                 capacity=0, connect_delay=0.0, name="mock"):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail = fail
+        self.fail_rate = fail_rate
+        self.completion_tokens = completion_tokens
+        # Log-normal spread of answer lengths around completion_tokens (0 = all equal)
+        self.completion_spread = completion_spread
+        self.token_delay = token_delay
+        # Extra delay per 1000 prompt tokens, so big (image) prompts are slower
+        self.prefill_delay = prefill_delay
+        # Requests generated at once; more wait for a free slot, like a busy provider (0 = unlimited)
+        self.capacity = capacity
+        self.slots = threading.BoundedSemaphore(capacity) if capacity else None
+        # Pause before serving a new connection, like connection setup to a distant host
+        self.connect_delay = connect_delay
+        self.name = name
+        self.requests = 0
+        self.connections = 0
+        # Prompt prefixes seen so far (hash -> tokens), to report cached tokens
+        self.prefixes = {}
+        self.lock = threading.Lock()
+
+
+def _prompt_text(messages):
+    """Flatten the chat messages into plain text"""
+    parts = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, list):
+            parts.extend(part.get('text', '') for part in content if part.get('type') == 'text')
+        elif content:
+            parts.append(content)
+    return "\n".join(parts)
+
+
+def text_tokens(text):
+    """Rough token count: about four characters per token for English"""
+    return (len(text) + 3) // 4
+
+
+def image_tokens(width, height):
+    """Prompt tokens for one high-detail image, following OpenAI's tiling rule"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _image_tokens(messages):
+    """Prompt tokens for all images in the messages (765 each if undecodable)"""
+    total = 0
+    for message in messages:
+        content = message.get('content')
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get('type') != 'image_url':
+                continue
+            try:
+                from PIL import Image
+
+                data = part['image_url']['url'].split(',', 1)[1]
+                with Image.open(io.BytesIO(base64.b64decode(data))) as image:
+                    total += image_tokens(*image.size)
+            except Exception:
+                total += 765
+    return total
+
+
+def _cached_tokens(settings, messages):
+    """Tokens of the longest message prefix seen before, the way OpenAI reports them
+
+    Only prefixes of 1024 tokens or more count, in steps of 128.
+    """
+    digest = hashlib.sha256()
+    tokens = 0
+    cached = 0
+    with settings.lock:
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True).encode('utf-8'))
+            tokens += text_tokens(_prompt_text([message])) + _image_tokens([message])
+            key = digest.hexdigest()
+            if key in settings.prefixes:
+                cached = tokens
+            settings.prefixes[key] = tokens
+        if len(settings.prefixes) > 10000:
+            settings.prefixes.clear()
+    return cached // 128 * 128 if cached >= 1024 else 0
+
+
+def _completion_words(settings, request):
+    """Deterministic answer text of the configured length
+
+    With a spread, the length the answer "wants" varies per prompt (the
+    same prompt always gets the same length), unless the last message asks
+    for ``[reply:N]`` tokens; max_tokens cuts it off.
+    """
+    natural = settings.completion_tokens
+    hint = REPLY_HINT_RE.search(_prompt_text(request.get('messages', [])[-1:]))
+    if hint:
+        natural = max(1, int(hint.group(1)))
+    elif settings.completion_spread:
+        seed = hashlib.sha256(_prompt_text(request.get('messages', [])[-1:]).encode('utf-8')).digest()
+        factor = math.exp(random.Random(seed).gauss(0, settings.completion_spread))
+        natural = max(1, round(natural * factor))
+    limit = request.get('max_tokens') or request.get('max_completion_tokens') or natural
+    count = min(natural, limit)
+    words = [f"{settings.name}-reply"] + [f"token{i}" for i in range(1, count)]
+    return words[:count], count < natural
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the subset of the API the app uses"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def setup(self):
+        settings = self.server.settings
+        with settings.lock:
+            settings.connections += 1
+        if settings.connect_delay:
+            time.sleep(settings.connect_delay)
+        if isinstance(self.request, ssl.SSLSocket):
+            # In this connection's thread rather than the accept loop
+            self.request.do_handshake()
+        super().setup()
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if self.settings.slots is None:
+            self._complete()
+            return
+        with self.settings.slots:
+            self._complete()
+
+    def _complete(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        settings = self.settings
+        with settings.lock:
+            settings.requests += 1
+
+        messages = request.get('messages', [])
+        prompt_tokens = max(1, text_tokens(_prompt_text(messages))) + _image_tokens(messages)
+        delay = settings.latency + random.uniform(0, settings.jitter)
+        cached_tokens = _cached_tokens(settings, messages)
+        # Cached prefix tokens skip prefill
+        time.sleep(delay + settings.prefill_delay * (prompt_tokens - cached_tokens) / 1000)
+
+        if settings.fail and random.random() < settings.fail_rate:
+            if settings.fail == 'timeout':
+                # Hold the connection long enough for the client to give up
+                time.sleep(3600)
+                return
+            status, code, message = FAILURES[settings.fail]
+            self._send_json(status, {"error": {"message": message, "type": code, "code": code}})
+            return
+
+        words, truncated = _completion_words(settings, request)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        finish_reason = "length" if truncated else "stop"
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get('model', 'gpt-4o')
+
+        if request.get('stream'):
+            self._stream(completion_id, model, words, finish_reason, usage, request)
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id, model, words, finish_reason, usage, request):
+        """Send the completion as server-sent events, one word per chunk
+
+        Chunked, so the connection stays open for the next request.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def chunk(delta, finish=None, extra=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            if extra:
+                payload.update(extra)
+            write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+        try:
+            chunk({"role": "assistant", "content": ""})
+            for index, word in enumerate(words):
+                if self.settings.token_delay:
+                    time.sleep(self.settings.token_delay)
+                chunk({"content": word if index == 0 else " " + word})
+            include_usage = (request.get('stream_options') or {}).get('include_usage')
+            chunk({}, finish_reason, {"usage": usage} if include_usage else None)
+            write(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except OSError:
+            # Client cancelled the stream
+            self.close_connection = True
+
+
+def self_signed_certificate(directory):
+    """(certificate, key) files for localhost and 127.0.0.1"""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+        "-nodes", "-keyout", keyfile, "-out", certfile, "-days", "2", "-subj", "/CN=localhost",
+        "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+    ], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def make_server(host, port, settings, tls=False):
+    """Server (not yet serving) and its base URL; ``server.ca_file`` is the certificate with TLS"""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.settings = settings
+    server.ca_file = None
+    scheme = "http"
+    if tls:
+        certfile, keyfile = self_signed_certificate(tempfile.mkdtemp(prefix="mock-tls-"))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        context.set_alpn_protocols(["http/1.1"])
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+        server.ca_file = certfile
+        scheme = "https"
+    return server, f"{scheme}://{host}:{server.server_address[1]}/v1"
+
+
+def start_mock_server(port=0, host="127.0.0.1", tls=False, **settings):
+    """Start a mock server on a background thread; returns (server, base_url)"""
+    server, base_url = make_server(host, port, MockSettings(**settings), tls)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.2, help="Base response delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random delay up to this many seconds")
+    parser.add_argument('--fail', choices=sorted(FAILURES) + ['timeout'], help="Inject this failure")
+    parser.add_argument('--fail-rate', type=float, default=1.0, help="Fraction of requests that fail")
+    parser.add_argument('--tokens', type=int, default=64, help="Completion length in tokens")
+    parser.add_argument('--spread', type=float, default=0.0,
+                        help="Spread of completion lengths (sigma of a log-normal factor)")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="Delay between streamed tokens")
+    parser.add_argument('--prefill-delay', type=float, default=0.0, help="Extra delay per 1000 prompt tokens")
+    parser.add_argument('--capacity', type=int, default=0, help="Requests served at once (0 = unlimited)")
+    parser.add_argument('--connect-delay', type=float, default=0.0,
+                        help="Delay before serving each new connection, in seconds")
+    parser.add_argument('--tls', action='store_true', help="Serve HTTPS with a self-signed certificate")
+    parser.add_argument('--name', default="mock")
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        fail=args.fail,
+        fail_rate=args.fail_rate,
+        completion_tokens=args.tokens,
+        completion_spread=args.spread,
+        token_delay=args.token_delay,
+        prefill_delay=args.prefill_delay,
+        capacity=args.capacity,
+        connect_delay=args.connect_delay,
+        name=args.name,
+    )
+    server, base_url = make_server(args.host, args.port, settings, args.tls)
+    print(f"Mock OpenAI server listening on {base_url}")
+    if server.ca_file:
+        print(f"Certificate: {server.ca_file} (AI_CA_BUNDLE)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Profile script execution time of the Streamlit app per interaction.
+
+Drives app.py with Streamlit's AppTest against the mock OpenAI server and
+reports, for chat histories of several lengths:
+
+* ``cold``   - first script run in a fresh interpreter
+* ``rerun``  - a full script rerun (any widget outside a fragment)
+* ``chat``   - sending a message
+* ``export`` - clicking Export
+
+``full`` is the time of the whole script run(s) an interaction triggers,
+measured around the script. ``fragment`` is the part a real browser
+session reruns when the interaction happens inside an ``st.fragment``
+(from the app's ``APP_PROFILE=1`` timings); AppTest itself always reruns
+the whole script. Compare against an earlier revision of app.py with:
+
+    python -m tools.profile_reruns --compare HEAD~1
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+
+# Runs the app under test and records the wall time of every script run,
+# including runs that end in st.rerun()
+WRAPPER = """
+import runpy, sys, time
+import streamlit as st
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+try:
+    runpy.run_path({app!r}, run_name="__main__")
+finally:
+    st.session_state.setdefault('_profile_wall_ms', []).append((time.perf_counter() - start) * 1000)
+"""
+
+# Fragment that reruns for each interaction in the current layout
+FRAGMENTS = {'chat': 'chat', 'export': 'export'}
+
+
+def history(length):
+    """Synthetic chat history of ``length`` messages"""
+    return [
+        {
+            "role": "user" if number % 2 == 0 else "assistant",
+            "content": f"Message {number}: " + "some words of a typical chat message " * 8,
+            "timestamp": "12:00:00",
+        }
+        for number in range(length)
+    ]
+
+
+def interaction(app_test, action):
+    """Run ``action``; returns (summed script ms, app profile summary)"""
+    app_test.session_state['_profile_wall_ms'] = []
+    profile = app_test.session_state['rerun_profile'] if 'rerun_profile' in app_test.session_state else None
+    if profile is not None:
+        profile.clear()
+    action()
+    if app_test.exception:
+        raise RuntimeError(app_test.exception[0].message)
+    return sum(app_test.session_state['_profile_wall_ms']), profile.summary() if profile is not None else {}
+
+
+def profile_app(app_path, lengths, runs):
+    """Worker: timings for one app file, as a dict"""
+    from streamlit.testing.v1 import AppTest
+
+    with tempfile.TemporaryDirectory() as directory:
+        wrapper = os.path.join(directory, "profiled_app.py")
+        with open(wrapper, 'w', encoding='utf-8') as handle:
+            handle.write(WRAPPER.format(repo=REPO, app=os.path.abspath(app_path)))
+
+        app_test = AppTest.from_file(wrapper, default_timeout=60)
+        cold, _ = interaction(app_test, app_test.run)
+        results = {'cold': {'full_ms': cold}}
+
+        for length in lengths:
+            app_test.session_state['messages'] = history(length)
+            app_test.session_state['message_counts'] = {'user': (length + 1) // 2, 'assistant': length // 2}
+            app_test.run()
+            samples = {'rerun': [], 'chat': [], 'export': []}
+            for run in range(runs):
+                samples['rerun'].append(interaction(app_test, app_test.run))
+                samples['export'].append(interaction(
+                    app_test, lambda: next(b for b in app_test.button if b.label == "Export").click().run()
+                ))
+                samples['chat'].append(interaction(
+                    app_test, lambda: app_test.chat_input[0].set_value(f"question {run}").run()
+                ))
+                # Keep the history length constant across runs
+                app_test.session_state['messages'] = app_test.session_state['messages'][:length]
+            for name, values in samples.items():
+                entry = {'full_ms': statistics.median(full for full, _ in values)}
+                section = FRAGMENTS.get(name)
+                fragment = [summary[section]['last_ms'] for _, summary in values if section in summary]
+                if fragment:
+                    entry['fragment_ms'] = statistics.median(fragment)
+                results[f"{name} ({length} msgs)"] = entry
+    return results
+
+
+def run_worker(app_path, lengths, runs):
+    """Profile ``app_path`` in a fresh interpreter so cold start is comparable"""
+    command = [sys.executable, "-m", "tools.profile_reruns", "--worker", app_path,
+               "--runs", str(runs), "--messages", *map(str, lengths)]
+    output = subprocess.run(command, cwd=REPO, capture_output=True, text=True)
+    if output.returncode:
+        raise RuntimeError(output.stderr.strip().splitlines()[-1])
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile Streamlit script time per interaction")
+    parser.add_argument('--app', default=os.path.join(REPO, "app.py"))
+    parser.add_argument('--compare', metavar='REV', help="Also profile app.py from this git revision")
+    parser.add_argument('--messages', type=int, nargs='+', default=[0, 50, 200])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        server, base_url = start_mock_server(latency=0.0, jitter=0.0)
+        os.environ.update({
+            'OPENAI_API_KEY': 'sk-profile',
+            'OPENAI_BASE_URL': base_url,
+            'APP_PROFILE': '1',
+            # Every message should reach the (mock) model
+            'SEMANTIC_CACHE_ENABLED': '0',
+        })
+        print(json.dumps(profile_app(args.worker, args.messages, args.runs)))
+        server.shutdown()
+        return
+
+    results = {'current': run_worker(args.app, args.messages, args.runs)}
+    if args.compare:
+        source = subprocess.run(["git", "show", f"{args.compare}:app.py"], cwd=REPO,
+                                capture_output=True, text=True, check=True).stdout
+        # Next to app.py, so the old revision finds assets/ and utils/
+        with tempfile.NamedTemporaryFile('w', suffix=".py", prefix=".profile_app_", dir=REPO,
+                                         delete=False, encoding='utf-8') as handle:
+            handle.write(source)
+        try:
+            results[args.compare] = run_worker(handle.name, args.messages, args.runs)
+        finally:
+            os.unlink(handle.name)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    columns = [(name, key) for name in results for key in ('full_ms', 'fragment_ms')
+               if any(key in entry for entry in results[name].values())]
+    print(f"{'interaction':<22}" + "".join(f"{name[:12] + ' ' + key[:-3]:>24}" for name, key in columns))
+    for scenario in results['current']:
+        cells = []
+        for name, key in columns:
+            value = results[name].get(scenario, {}).get(key)
+            cells.append(f"{value:>21.1f} ms" if value is not None else f"{'-':>24}")
+        print(f"{scenario:<22}" + "".join(cells))
+
+
+if __name__ == '__main__':
+    main()
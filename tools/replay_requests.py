@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Replay a recorded request log (REQUEST_LOG) against the app core.
+
+Every record becomes a synthetic request of the same shape: a question of
+the recorded length (the same hashed question gets the same text, so
+repeats still hit the semantic cache), history of the recorded size,
+stand-in attachments (text of the recorded length with a real retrieval
+index, random-pixel images of the recorded dimensions) and the recorded
+session, sent through AIClient at the recorded arrival times divided by
+``--speed``. Requests the user stopped are cancelled after the recorded
+time. By default a mock server answers with the recorded answer lengths;
+``--live`` uses the configured providers instead (and costs tokens).
+
+    python -m tools.replay_requests requests.log --speed 20
+    python -m tools.replay_requests requests.log --speed 50 --capacity 8 --token-delay 0.01
+
+Settings of the app core come from the environment as usual, so the same
+log can be replayed before and after a change, e.g. with
+ADMISSION_MAX_CONCURRENT or SEMANTIC_CACHE_ENABLED set differently.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.mock_openai_server import start_mock_server  # noqa: E402
+from utils.request_log import read_log  # noqa: E402
+
+# Words that trigger no intent pattern, so the lead phrase decides the intent, and no
+# compound question or aspect list, so replayed questions are not decomposed into subqueries
+FILLER = ("the quarterly numbers in the northern region look unusual this time so we would like to "
+          "know what changed most since last year then why the team thinks so given the notes "
+          "from the meeting with budget travel hiring plus office space").split()
+
+LEAD = {
+    'code': "Debug this function:",
+    'summary': "Summarize the main points:",
+    'writing': "Write a detailed note:",
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float('nan')
+
+
+def filler(seed, characters):
+    """Deterministic neutral text of about ``characters`` characters"""
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < characters:
+        word = rng.choice(FILLER)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:characters]
+
+
+class Synthesizer:
+    """Builds request arguments of a recorded shape; attachments are made once per file id"""
+
+    def __init__(self, max_text_chars, hint_replies):
+        self.max_text_chars = max_text_chars
+        self.hint_replies = hint_replies
+        self.files = {}
+
+    def question(self, record):
+        lead = LEAD.get(record.get('i'), "")
+        hint = f" [reply:{record['n']}]" if self.hint_replies and record.get('n') else ""
+        body = filler(record.get('q', ''), max(0, record.get('qc', 40) - len(lead) - len(hint)))
+        return f"{lead} {body}{hint}".strip()
+
+    def history(self, record):
+        count = record.get('h', 0)
+        if not count:
+            return []
+        size = record.get('hc', 0) // count
+        return [
+            {'role': 'user' if number % 2 == 0 else 'assistant',
+             'content': filler(f"{record.get('s')}:{number}", size)}
+            for number in range(count)
+        ]
+
+    def prepare(self, records):
+        """Make every attachment up front, as uploads are analyzed before questions are asked"""
+        for record in records:
+            for shape in record.get('f') or []:
+                if shape['id'] not in self.files:
+                    self.files[shape['id']] = self._attachment(shape)
+
+    def attachments(self, record):
+        return [self.files[shape['id']] for shape in record.get('f') or []]
+
+    def _attachment(self, shape):
+        from utils.analysis_result import AnalysisResult, ExtractedText, PreparedImage
+        from utils.text_index import TextIndex
+
+        result = AnalysisResult(f"{shape['id']}", shape.get('t', 'text/plain'), shape.get('b', 0),
+                                content_hash=shape['id'], kind=shape.get('k', 'text'))
+        result.pages = result.pages_read = shape.get('p')
+        if 'w' in shape:
+            import io
+
+            from PIL import Image
+
+            width, height = min(shape['w'], 2048), min(shape['h'], 2048)
+            # Noise in as many rows as it takes to get about the recorded file size
+            image = Image.new('RGB', (width, height), 'white')
+            rows = min(height, max(1, shape.get('b', 0) // (width * 3)))
+            image.paste(Image.frombytes('RGB', (width, rows), os.urandom(width * rows * 3)))
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG', compress_level=1)
+            result.image = PreparedImage('image/png', buffer.getvalue(), width, height)
+            result.width, result.height = width, height
+            result.image_format, result.color_mode = 'PNG', 'RGB'
+        if 'c' in shape:
+            text = filler(shape['id'], min(shape['c'], self.max_text_chars))
+            result.text = ExtractedText(shape['c'], shape['c'] // 6, max(1, shape['c'] // 60), text[:600])
+            if result.kind != 'image':
+                result.index = TextIndex.from_text(text)
+        return result
+
+
+def replay(client, records, args):
+    """Run every record at its (sped-up) time; returns start lags (ms) and the wall time"""
+    from utils.cancellation import CancelToken
+
+    synthesizer = Synthesizer(args.max_text_chars, hint_replies=not args.live)
+    synthesizer.prepare(records)
+    started = time.monotonic()
+    origin = records[0]['ts']
+    lags = []
+
+    def run(record, due):
+        lags.append((time.monotonic() - due) * 1000)
+        question = synthesizer.question(record)
+        history = synthesizer.history(record)
+        files = synthesizer.attachments(record)
+        session = f"replay-{record['s']}" if record.get('s') else None
+        cancel = CancelToken()
+        timer = None
+        if record.get('o') in ('cancelled', 'abandoned') and record.get('ms'):
+            timer = threading.Timer(record['ms'] / 1000, cancel.cancel)
+            timer.start()
+        # Timings come from the replay's own request log, measured like the recorded ones
+        if record.get('m') == 'stream':
+            for _ in client.stream_response(question, files, history, cancel=cancel, session=session):
+                pass
+        else:
+            client.get_response(question, files, history, cancel=cancel, session=session)
+        if timer is not None:
+            timer.cancel()
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for record in records:
+            due = started + (record['ts'] - origin) / args.speed
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            pool.submit(run, record, due)
+    return lags, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded request log against the app core")
+    parser.add_argument('log', help="Request log written with REQUEST_LOG")
+    parser.add_argument('--speed', type=float, default=1.0, help="Speed-up factor for arrival times")
+    parser.add_argument('--limit', type=int, help="Replay only the first N records")
+    parser.add_argument('--workers', type=int, default=256, help="Requests in flight at most")
+    parser.add_argument('--max-text-chars', type=int, default=2_000_000,
+                        help="Cap on synthesized attachment text (characters)")
+    parser.add_argument('--live', action='store_true', help="Use the configured providers instead of a mock")
+    parser.add_argument('--latency', type=float, default=0.3, help="Mock base latency in seconds")
+    parser.add_argument('--token-delay', type=float, default=0.01, help="Mock seconds per streamed token")
+    parser.add_argument('--prefill-delay', type=float, default=0.02, help="Mock delay per 1000 prompt tokens")
+    parser.add_argument('--capacity', type=int, help="Requests the mock serves at once (default unlimited)")
+    parser.add_argument('--output', help="Request log of the replay itself (default: a temporary file)")
+    args = parser.parse_args()
+
+    records = read_log(args.log)[:args.limit]
+    if not records:
+        sys.exit(f"No records in {args.log}")
+    server = None
+    if not args.live:
+        server, base_url = start_mock_server(latency=args.latency, token_delay=args.token_delay,
+                                             prefill_delay=args.prefill_delay, capacity=args.capacity)
+        os.environ.update({'OPENAI_API_KEY': 'sk-replay', 'OPENAI_BASE_URL': base_url})
+    # The replay is recorded too, for its outcomes next to the recorded ones
+    output = args.output or os.path.join(tempfile.mkdtemp(prefix="replay-"), "replay.log")
+    os.environ['REQUEST_LOG'] = output
+    os.environ['REQUEST_LOG_SAMPLE'] = '1'
+
+    from utils.ai_client import AIClient
+
+    client = AIClient()
+    span = records[-1]['ts'] - records[0]['ts']
+    print(f"Replaying {len(records)} requests recorded over {span:.0f} s at {args.speed:g}x "
+          f"({'live providers' if args.live else 'mock server'})")
+    lags, wall = replay(client, records, args)
+    replayed = read_log(output)
+
+    print(f"done in {wall:.1f} s: offered {len(records) / max(span / args.speed, 1e-9):.2f}/s, "
+          f"completed {len(replayed) / wall:.2f}/s")
+    print(f"{'':<17}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'first p50':>11}{'first p95':>11}")
+    for mode in ('get', 'stream'):
+        for label, log in (('recorded', records), ('replayed', replayed)):
+            rows = [record for record in log if record.get('m') == mode]
+            if not rows:
+                continue
+            latencies = [record['ms'] for record in rows if 'ms' in record]
+            firsts = [record['ft'] for record in rows if 'ft' in record]
+            print(f"{mode + ' ' + label:<17}{len(rows):>7}"
+                  + "".join(f"{percentile(latencies, f):>9.0f}" for f in (0.5, 0.95, 0.99))
+                  + "".join(f"{percentile(firsts, f):>11.0f}" for f in (0.5, 0.95)))
+
+    before = Counter(record.get('o', '?') for record in records)
+    after = Counter(record.get('o', '?') for record in replayed)
+    names = sorted(set(before) | set(after))
+    print("outcomes (recorded/replayed): " + ", ".join(f"{name} {before[name]}/{after[name]}" for name in names))
+    print(f"start lag p95 {percentile(lags, 0.95):.0f} ms, max {max(lags):.0f} ms "
+          f"(large values mean the replay itself could not keep up)")
+    stats = client.semantic_cache.stats()
+    print(f"semantic cache: {stats}")
+    print(f"replay log: {output}")
+    if server is not None:
+        print(f"mock served {server.settings.requests} upstream requests")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
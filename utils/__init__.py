@@ -0,0 +1,25 @@
+"""
+Headless core shared by the Streamlit UI and other entry points.
+
+Attributes are resolved lazily so ``import utils`` stays cheap; heavy
+dependencies (openai, Pillow, PyPDF2, ...) load only when first used.
+"""
+
+import importlib
+
+_EXPORTS = {
+    'AIClient': 'utils.ai_client',
+    'FileProcessor': 'utils.file_processor',
+    'ProviderRouter': 'utils.providers',
+    'ProviderError': 'utils.providers',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module 'utils' has no attribute {name!r}")
@@ -0,0 +1,287 @@
+"""
+Admission control in front of upstream model calls.
+
+Every Streamlit session and API client shares one AIClient, and without
+coordination one user sending prompts with huge attachments in a loop
+fills the provider's capacity while everyone else waits behind them.
+The AdmissionController, one per process, runs model calls through:
+
+* a token bucket per session, refilled at ``ADMISSION_RATE`` estimated
+  tokens per second up to ``ADMISSION_BURST``, so a session that sends
+  more than its share waits for its own refill;
+* a weighted fair queue in front of ``ADMISSION_MAX_CONCURRENT`` upstream
+  slots: a waiting request is tagged with its session's virtual finish
+  time (cost / weight after the session's previous request), and the
+  smallest tag goes next, so a session with many big requests queued
+  cannot push a light user's question back;
+* load shedding: a request that would wait longer than
+  ``ADMISSION_MAX_WAIT`` seconds (or finds ``ADMISSION_MAX_QUEUE``
+  requests waiting) is refused with a "busy" answer instead of adding to
+  everyone's latency.
+
+Shed requests are cancelled with reason ``'busy'`` through their
+CancelToken, so callers handle them like any other cancellation.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.cancellation import CancelToken, RequestCancelled
+
+# Prompt tokens per image part (a high-detail 512x512 tile grid of 2x2)
+IMAGE_TOKENS = 765
+
+
+def estimate_tokens(messages):
+    """Rough prompt size of chat messages: four characters per token, fixed cost per image"""
+    characters = 0
+    images = 0
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'image_url':
+                    images += 1
+                else:
+                    characters += len(part.get('text', ''))
+        elif content:
+            characters += len(content)
+    return characters // 4 + images * IMAGE_TOKENS
+
+
+class TokenBucket:
+    """Refills ``rate`` tokens per second up to ``burst``; may run into debt for waiting requests"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost, now):
+        """Seconds until ``cost`` tokens are available"""
+        self._refill(now)
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def take(self, cost):
+        self.tokens -= cost
+
+    def refund(self, cost, now):
+        self._refill(now)
+        self.tokens = min(self.burst, self.tokens + cost)
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class SessionState:
+    __slots__ = ('bucket', 'finish', 'queued', 'admitted', 'shed')
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.finish = 0.0  # virtual finish time of the session's last queued request
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+
+
+class Ticket:
+    """One request waiting for, or holding, an upstream slot"""
+
+    __slots__ = ('session', 'cost', 'start', 'finish', 'eligible_at', 'enqueued', 'granted', 'order')
+
+    def __init__(self, session, cost, start, finish, eligible_at, enqueued, order):
+        self.session = session
+        self.cost = cost
+        self.start = start
+        self.finish = finish
+        self.eligible_at = eligible_at
+        self.enqueued = enqueued
+        self.granted = False
+        self.order = order
+
+
+class AdmissionController:
+    """Per-session token buckets plus a weighted fair queue of upstream slots"""
+
+    def __init__(self, max_concurrent=None, rate=None, burst=None, max_wait=None, max_queue=None,
+                 weights=None, enabled=None, max_sessions=10000):
+        if enabled is None:
+            enabled = os.getenv("ADMISSION_ENABLED", "1") == "1"
+        self.enabled = enabled
+        self.max_concurrent = int(max_concurrent or os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+        self.rate = float(rate or os.getenv("ADMISSION_RATE", "1000"))
+        self.burst = float(burst or os.getenv("ADMISSION_BURST", "30000"))
+        self.max_wait = float(max_wait or os.getenv("ADMISSION_MAX_WAIT", "10"))
+        self.max_queue = int(max_queue or os.getenv("ADMISSION_MAX_QUEUE", "256"))
+        if weights is None:
+            weights = json.loads(os.getenv("ADMISSION_WEIGHTS") or "{}")
+        self.weights = weights  # session -> weight (default 1)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # least recently active first
+        self._waiting = []
+        self._order = itertools.count()
+        self._virtual = 0.0
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = {}
+        self.waits_ms = []
+
+    def _session(self, session, now):
+        state = self._sessions.get(session)
+        if state is None:
+            state = self._sessions[session] = SessionState(TokenBucket(self.rate, self.burst, now))
+            if len(self._sessions) > self.max_sessions:
+                # Forget idle sessions with a full bucket; they lose nothing
+                for key in [key for key, old in self._sessions.items()
+                            if not old.queued and old.bucket.full(now)][:len(self._sessions) // 10 + 1]:
+                    del self._sessions[key]
+        self._sessions.move_to_end(session)
+        return state
+
+    def acquire(self, session, cost, cancel=None):
+        """Wait for an upstream slot; returns a Ticket to pass to release()
+
+        Raises RequestCancelled with reason 'busy' (after cancelling
+        ``cancel``) when the request is shed, or with the token's reason
+        when it is cancelled while waiting.
+        """
+        cancel = cancel or CancelToken()
+        now = time.monotonic()
+        with self._condition:
+            state = self._session(session, now)
+            # A request bigger than the burst could never be admitted otherwise
+            cost = max(1.0, min(float(cost), self.burst))
+            delay = state.bucket.delay(cost, now)
+            if delay > self.max_wait:
+                self._shed(state, 'rate_limited', cancel)
+            if len(self._waiting) >= self.max_queue:
+                self._shed(state, 'queue_full', cancel)
+            state.bucket.take(cost)
+            start = max(self._virtual, state.finish)
+            state.finish = start + cost / float(self.weights.get(session, 1))
+            state.queued += 1
+            ticket = Ticket(session, cost, start, state.finish, now + delay, now, next(self._order))
+            self._waiting.append(ticket)
+            self._dispatch(now)
+
+        unregister = cancel.on_cancel(self._wake)
+        try:
+            with self._condition:
+                while not ticket.granted:
+                    now = time.monotonic()
+                    if cancel.cancelled or now - ticket.enqueued >= self.max_wait:
+                        self._waiting.remove(ticket)
+                        state.queued -= 1
+                        state.bucket.refund(ticket.cost, now)
+                        if cancel.cancelled:
+                            raise RequestCancelled(cancel.reason)
+                        self._shed(state, 'busy', cancel)
+                    timeout = ticket.enqueued + self.max_wait - now
+                    pending = [t.eligible_at for t in self._waiting if t.eligible_at > now]
+                    if pending:
+                        # A bucket-delayed request becomes eligible then
+                        timeout = min(timeout, min(pending) - now)
+                    self._condition.wait(max(timeout, 0.001))
+                    self._dispatch(time.monotonic())
+        finally:
+            unregister()
+        return ticket
+
+    def release(self, ticket):
+        """Give the slot of a finished (or failed) request back"""
+        with self._condition:
+            self.in_flight -= 1
+            self._dispatch(time.monotonic())
+
+    def slot(self, session, cost, cancel=None):
+        """Context manager holding an upstream slot; pass-through when disabled"""
+        return _Slot(self, session, cost, cancel)
+
+    def _dispatch(self, now):
+        """Grant free slots to eligible requests, smallest virtual finish first"""
+        granted = False
+        while self.in_flight < self.max_concurrent:
+            eligible = [ticket for ticket in self._waiting if ticket.eligible_at <= now]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (t.finish, t.order))
+            self._waiting.remove(ticket)
+            ticket.granted = True
+            self._virtual = max(self._virtual, ticket.start)
+            self.in_flight += 1
+            self.admitted += 1
+            state = self._sessions.get(ticket.session)
+            if state is not None:
+                state.queued -= 1
+                state.admitted += 1
+            self.waits_ms.append((now - ticket.enqueued) * 1000)
+            del self.waits_ms[:-5000]
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def _shed(self, state, reason, cancel):
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        state.shed += 1
+        cancel.cancel('busy')
+        raise RequestCancelled('busy')
+
+    def stats(self):
+        """Queue length, slots in use, shed counts and queue-wait percentiles"""
+        with self._condition:
+            waits = sorted(self.waits_ms)
+
+            def percentile(fraction):
+                return round(waits[min(len(waits) - 1, int(fraction * len(waits)))], 1) if waits else None
+
+            return {
+                'enabled': self.enabled,
+                'max_concurrent': self.max_concurrent,
+                'in_flight': self.in_flight,
+                'queued': len(self._waiting),
+                'sessions': len(self._sessions),
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'wait_ms_p50': percentile(0.5),
+                'wait_ms_p95': percentile(0.95),
+                'wait_ms_p99': percentile(0.99),
+                'wait_ms_max': round(waits[-1], 1) if waits else None,
+            }
+
+
+class _Slot:
+    __slots__ = ('controller', 'session', 'cost', 'cancel', 'ticket')
+
+    def __init__(self, controller, session, cost, cancel):
+        self.controller = controller
+        self.session = session
+        self.cost = cost
+        self.cancel = cancel
+        self.ticket = None
+
+    def __enter__(self):
+        if self.controller.enabled:
+            self.ticket = self.controller.acquire(self.session, self.cost, self.cancel)
+        return self.ticket
+
+    def __exit__(self, *exc_info):
+        if self.ticket is not None:
+            self.controller.release(self.ticket)
+        return False
@@ -1,164 +1,495 @@
+"""
+Chat client used by both the Streamlit UI and headless entry points.
+
+Requests are routed through ``utils.providers`` so any OpenAI-compatible
+endpoint can serve them; nothing here imports Streamlit.
+"""
+
 import os
-import json
-from openai import OpenAI
+
+from utils.admission import AdmissionController, estimate_tokens
+from utils.cancellation import CancelToken, CancellationStats, RequestCancelled, abort_stream
+from utils.generation_policy import GenerationPolicy
+from utils.prompt_layout import PromptLayout
+from utils.providers import ProviderRouter, ProviderError, load_providers
+from utils.query_decomposition import QueryDecomposer
+from utils.request_log import RequestRecorder
+from utils.semantic_cache import SemanticCache, cache_scope
+from utils.shared_cache import get_shared_cache
+from utils.transport import warm_up
+from utils.vision_batch import VisionBatcher, vision_items
+
 
 class AIClient:
     """Client for interacting with OpenAI API"""
     
     def __init__(self):
-        api_key = os.getenv("OPENAI_API_KEY", "default_key")
-        self.client = OpenAI(api_key=api_key)
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-        # do not change this unless explicitly requested by the user
-        self.text_model = "gpt-4o"
-        self.vision_model = "gpt-4o"
-    
-    def get_response(self, user_message, file_analysis_results=None, chat_history=None):
-        """Get response from OpenAI API with optional file context"""
-        try:
-            # Determine if we need vision model
-            has_images = False
-            if file_analysis_results:
-                has_images = any(
-                    result.get('file_type', '').startswith('image/') and result.get('base64_data')
-                    for result in file_analysis_results
-                )
-            
-            # Prepare messages
-            messages = []
+        # Providers come from OPENAI_API_KEY / LOCAL_LLM_BASE_URL / AI_PROVIDERS
+        providers = load_providers()
+        if not providers:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        
+        # Stable system prompt and documents first, so providers can cache the prefix
+        self.layout = PromptLayout()
+        # Many images are tiled and split across concurrent vision calls
+        self.vision_batcher = VisionBatcher()
+        # Rephrased questions about the same files reuse earlier answers
+        self.semantic_cache = SemanticCache(shared=get_shared_cache())
+        # Upper bound for a whole answer; connect/read timeouts are per provider
+        self.total_timeout = float(os.getenv("AI_TOTAL_TIMEOUT", "120"))
+        self.cancellations = CancellationStats()
+        # max_tokens and stop sequences per kind of question, learned from answer lengths
+        self.generation = GenerationPolicy()
+        # Process-wide: fair share of upstream capacity between sessions
+        self.admission = AdmissionController()
+        # Shapes and timings of requests for replay (REQUEST_LOG), never their text
+        self.recorder = RequestRecorder()
+        # Compound questions over several documents are answered in parallel parts
+        self.decomposer = QueryDecomposer(cache=get_shared_cache())
+        # One router thread per attempt: admitted calls plus the vision and subquery
+        # fan-out, each of which may race every provider
+        calls = self.admission.max_concurrent + self.vision_batcher.max_concurrency + self.decomposer.max_concurrency
+        workers = int(os.getenv("AI_ROUTER_WORKERS", "0")) or calls * len(providers)
+        self.router = ProviderRouter(providers, max_workers=workers)
+    
+    def warm_up(self, timeout=5.0):
+        """Open a pooled connection to every provider; returns per-provider results"""
+        return warm_up(self.router.providers, timeout)
+    
+    def _build_messages(self, user_message, file_analysis_results=None, chat_history=None):
+        """Build the chat messages; returns (request kind, messages)"""
+        # Determine if we need vision model
+        has_images = any(result.is_image for result in file_analysis_results or [])
+        
+        messages = self.layout.messages(file_analysis_results, chat_history)
+        
+        # Prepare current user message
+        if has_images:
+            # Use vision model with images
+            content_parts = [{"type": "text", "text": user_message}]
             
-            # Add system context
-            system_message = {
-                "role": "system",
-                "content": (
-                    "You are a helpful AI assistant. You can analyze files and have "
-                    "conversations with users. When files are provided, incorporate their "
-                    "analysis into your responses. Be helpful, accurate, and engaging."
-                )
-            }
-            messages.append(system_message)
+            # Add images to the message
+            for result in file_analysis_results:
+                if result.is_image:
+                    content_parts.append({
+                        "type": "image_url",
+                        "image_url": {"url": result.image.data_url()}
+                    })
             
-            # Add chat history (last 5 messages to manage context)
-            if chat_history:
-                recent_history = chat_history[-5:] if len(chat_history) > 5 else chat_history
-                for msg in recent_history:
-                    if msg['role'] in ['user', 'assistant']:
-                        messages.append({
-                            "role": msg['role'],
-                            "content": msg['content']
-                        })
+            messages.append({
+                "role": "user",
+                "content": content_parts
+            })
+            return 'vision', messages
+        
+        # Use text model; file analysis is in the prefix, only the
+        # question-specific excerpts go with the question
+        user_content = user_message
+        excerpts = "".join(
+            self._relevant_excerpts(result, user_message)
+            for result in self.layout.documents(file_analysis_results)
+        )
+        if excerpts:
+            user_content += "\n\n" + excerpts
+        
+        messages.append({
+            "role": "user",
+            "content": user_content
+        })
+        return 'text', messages
+    
+    def _vision_requests(self, user_message, file_analysis_results=None, chat_history=None):
+        """(batch, messages) per vision call when there are enough images to batch, else None"""
+        if not file_analysis_results:
+            return None
+        items = vision_items(file_analysis_results)
+        if not self.vision_batcher.should_batch(items):
+            return None
+        
+        requests = []
+        for batch in self.vision_batcher.plan(items):
+            messages = self.layout.messages(file_analysis_results, chat_history)
+            messages.append({"role": "user", "content": batch.content(user_message, len(items))})
+            requests.append((batch, messages))
+        return requests
+    
+    def _batched_vision(self, requests, user_message, file_analysis_results=None, cancel=None):
+        """Run the batched vision calls and merge their answers in image order"""
+        # Fixed limit: each call answers for several images at once
+        outcomes = self.vision_batcher.run(self.router, requests, max_tokens=1000, temperature=0.7, cancel=cancel)
+        if cancel is not None:
+            cancel.check()
+        for _, outcome in outcomes:
+            if not isinstance(outcome, Exception):
+                self.layout.record(outcome.usage)
+        if all(isinstance(outcome, Exception) for _, outcome in outcomes):
+            return self._error_response(outcomes[0][1], user_message, file_analysis_results)
+        if len(outcomes) == 1:
+            return outcomes[0][1].choices[0].message.content
+        
+        sections = []
+        for batch, outcome in outcomes:
+            if isinstance(outcome, Exception):
+                sections.append(f"**{batch.label}**\n\nCould not be analyzed: {self._describe_error(outcome)}")
+            else:
+                sections.append(f"**{batch.label}**\n\n{outcome.choices[0].message.content}")
+        return "\n\n".join(sections)
+    
+    def _relevant_excerpts(self, result, question, k=3):
+        """Passages of a long document that best match the question"""
+        index = result.index
+        # Short documents are already in the prompt prefix in full
+        if index is None or result.text is None or result.text.characters <= 600:
+            return ""
+        
+        # Chunks already in the prompt prefix need not be repeated
+        in_prefix = self.layout.prefix_chunk_ids(result)
+        excerpts = [
+            excerpt for excerpt in index.search(question, k=k + len(in_prefix))
+            if excerpt[1] not in in_prefix
+        ][:k]
+        if not excerpts:
+            return ""
+        
+        section = f"Relevant excerpts from {result.filename}:\n"
+        for _, chunk_id, chunk in sorted(excerpts, key=lambda item: item[1]):
+            section += f"[chunk {chunk_id + 1}/{len(index)}] {chunk}\n"
+        return section
+    
+    def _request_token(self, cancel=None):
+        """The caller's CancelToken, or a new one, bounded by the total timeout"""
+        cancel = cancel or CancelToken()
+        if self.total_timeout:
+            cancel.set_deadline(self.total_timeout)
+        return cancel
+    
+    def _admit(self, session, message_lists, max_tokens, cancel):
+        """Upstream slot for a request, queued fairly against other sessions' requests"""
+        cost = sum(estimate_tokens(messages) for messages in message_lists) + max_tokens
+        return self.admission.slot(session or 'anonymous', cost, cancel)
+    
+    def _decomposed_messages(self, user_message, file_analysis_results, chat_history, session, cancel):
+        """Run the subqueries of a compound question; returns the synthesis messages
+        
+        Raises the first subquery's error if none of them could be answered.
+        """
+        subqueries = self.decomposer.plan(user_message, file_analysis_results)
+        message_lists = [subquery.messages() for subquery in subqueries]
+        with self._admit(session, message_lists, self.decomposer.max_tokens * len(subqueries), cancel):
+            outcomes = self.decomposer.run(self.router, subqueries, cancel)
+        if all(isinstance(outcome, Exception) for _, outcome in outcomes):
+            raise outcomes[0][1]
+        return self.decomposer.synthesis_messages(user_message, outcomes, self.layout, chat_history)
+    
+    def _stream_text(self, kind, messages, cancel, intent='qa', temperature=0.7):
+        """Yield the answer of a streamed completion piece by piece
+        
+        Limits come from the generation policy for ``intent``. Cancelling
+        the token closes the HTTP stream, so the provider stops generating;
+        so does closing this generator before the end.
+        """
+        plan = self.generation.plan(intent)
+        max_tokens = plan['max_tokens']
+        try:
+            stream = self.router.create(
+                kind,
+                cancel=cancel,
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+                **plan
+            )
+        except RequestCancelled as e:
+            self.cancellations.record(e.reason, 0, max_tokens, cancel.cancelled_at)
+            raise
+        
+        unregister = cancel.on_cancel(lambda: abort_stream(stream))
+        streamed = 0
+        completion_tokens = None
+        finish_reason = None
+        reason = None
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    self.layout.record(chunk.usage)
+                    completion_tokens = chunk.usage.completion_tokens
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                if chunk.choices and chunk.choices[0].delta.content:
+                    streamed += 1  # about one token per chunk
+                    yield chunk.choices[0].delta.content
+            # A stream closed mid-way may just end
+            cancel.check()
+            self.generation.observe(intent, completion_tokens or streamed, finish_reason == 'length', max_tokens)
+        except GeneratorExit:
+            # The consumer went away (Streamlit rerun, closed tab, dropped client)
+            reason = cancel.reason or 'abandoned'
+            raise
+        except Exception:
+            if not cancel.cancelled:
+                raise
+            reason = cancel.reason
+            raise RequestCancelled(reason) from None
+        finally:
+            unregister()
+            if reason is not None:
+                stream.close()
+                self.cancellations.record(reason, streamed, max_tokens, cancel.cancelled_at)
+    
+    def _cancelled_note(self, reason):
+        """What to show after an answer cut off by its CancelToken"""
+        if reason == 'timeout':
+            return f"**Timeout**: No complete answer within {self.total_timeout:g} seconds. Please try again."
+        if reason == 'busy':
+            return "**Busy**: Too many requests are waiting right now. Please try again in a few seconds."
+        return "_(stopped)_"
+    
+    def get_response(self, user_message, file_analysis_results=None, chat_history=None, cancel=None, session=None):
+        """Get response from OpenAI API with optional file context
+        
+        ``cancel`` is an optional CancelToken to stop the request early; it
+        is also cancelled once AI_TOTAL_TIMEOUT has passed, or with reason
+        'busy' when admission control sheds the request. ``session``
+        identifies the user for fair sharing of upstream capacity.
+        """
+        trace = self.recorder.begin('get', user_message, file_analysis_results, chat_history, session)
+        scope = cache_scope(file_analysis_results, chat_history)
+        cached = self.semantic_cache.get(user_message, scope)
+        if cached is not None:
+            trace.finish('cached', cached)
+            return cached
+        
+        cancel = self._request_token(cancel)
+        pieces = []
+        outcome, answer = 'ok', None
+        try:
+            requests = self._vision_requests(user_message, file_analysis_results, chat_history)
+            if requests:
+                trace.kind, trace.max_tokens = 'vision-batch', 1000 * len(requests)
+                with self._admit(session, [messages for _, messages in requests], 1000 * len(requests), cancel):
+                    answer = self._batched_vision(requests, user_message, file_analysis_results, cancel)
+                    return answer
             
-            # Prepare current user message
-            if has_images:
-                # Use vision model with images
-                content_parts = [{"type": "text", "text": user_message}]
-                
-                # Add images to the message
-                if file_analysis_results:
-                    for result in file_analysis_results:
-                        if (result.get('file_type', '').startswith('image/') and 
-                            result.get('base64_data')):
-                            
-                            image_url = f"data:{result['file_type']};base64,{result['base64_data']}"
-                            content_parts.append({
-                                "type": "image_url",
-                                "image_url": {"url": image_url}
-                            })
-                
-                messages.append({
-                    "role": "user",
-                    "content": content_parts
-                })
-                
-                # Generate response with vision model
-                response = self.client.chat.completions.create(
-                    model=self.vision_model,
-                    messages=messages,
-                    max_tokens=1000,
-                    temperature=0.7
-                )
-                
+            decomposed = self.decomposer.applies(user_message, file_analysis_results)
+            if decomposed:
+                kind = 'text'
+                messages = self._decomposed_messages(user_message, file_analysis_results, chat_history, session, cancel)
             else:
-                # Use text model
-                user_content = user_message
-                
-                # Add file analysis context if available
-                if file_analysis_results:
-                    user_content += "\n\nFile Analysis Context:\n"
-                    for result in file_analysis_results:
-                        user_content += f"\nFile: {result['filename']}\n"
-                        user_content += f"Type: {result['file_type']}\n"
-                        user_content += f"Analysis: {result['analysis']}\n"
-                
-                messages.append({
-                    "role": "user",
-                    "content": user_content
-                })
-                
-                # Generate response with text model
-                response = self.client.chat.completions.create(
-                    model=self.text_model,
-                    messages=messages,
-                    max_tokens=1000,
-                    temperature=0.7
-                )
+                kind, messages = self._build_messages(user_message, file_analysis_results, chat_history)
+            intent = self.generation.classify(user_message, has_images=kind == 'vision')
+            trace.kind, trace.intent = 'decomposed' if decomposed else kind, intent
+            trace.max_tokens = self.generation.plan(intent)['max_tokens']
             
-            return response.choices[0].message.content
+            # Streamed even here, so a cancelled request stops generating at once
+            # (vision requests only go to vision-capable providers)
+            with self._admit(session, [messages], self.generation.plan(intent)['max_tokens'], cancel):
+                for piece in self._stream_text(kind, messages, cancel, intent):
+                    trace.first_piece()
+                    pieces.append(piece)
+            
+            answer = "".join(pieces)
+            self.semantic_cache.put(user_message, scope, answer)
+            return answer
             
+        except RequestCancelled as e:
+            outcome = e.reason or 'cancelled'
+            partial = "".join(pieces)
+            answer = f"{partial}\n\n{self._cancelled_note(e.reason)}" if partial else self._cancelled_note(e.reason)
+            return answer
         except Exception as e:
-            error_msg = f"Failed to get response from OpenAI API: {str(e)}"
-            if "api_key" in str(e).lower():
-                error_msg += "\n\nPlease check that your OPENAI_API_KEY environment variable is set correctly."
-            elif "rate limit" in str(e).lower():
-                error_msg += "\n\nRate limit exceeded. Please wait a moment before trying again."
-            elif "connection" in str(e).lower():
-                error_msg += "\n\nConnection error. Please check your internet connection."
+            outcome = 'error'
+            answer = self._error_response(e, user_message, file_analysis_results)
+            return answer
+        finally:
+            cancel.finish()
+            trace.finish(outcome, answer, len(pieces))
+    
+    def stream_response(self, user_message, file_analysis_results=None, chat_history=None, cancel=None, session=None):
+        """Like get_response, but yields the answer in chunks as it is generated
+        
+        Closing the generator early closes the HTTP stream as well.
+        """
+        trace = self.recorder.begin('stream', user_message, file_analysis_results, chat_history, session)
+        scope = cache_scope(file_analysis_results, chat_history)
+        cached = self.semantic_cache.get(user_message, scope)
+        if cached is not None:
+            trace.finish('cached', cached)
+            yield cached
+            return
+        
+        cancel = self._request_token(cancel)
+        pieces = []
+        # A generator closed by its consumer ends without an exception of its own
+        outcome, answer = 'abandoned', None
+        try:
+            requests = self._vision_requests(user_message, file_analysis_results, chat_history)
+            if requests and len(requests) > 1:
+                trace.kind, trace.max_tokens = 'vision-batch', 1000 * len(requests)
+                # Split batches run concurrently; the merged answer arrives at once
+                with self._admit(session, [messages for _, messages in requests], 1000 * len(requests), cancel):
+                    answer = self._batched_vision(requests, user_message, file_analysis_results, cancel)
+                outcome = 'ok'
+                trace.first_piece()
+                yield answer
+                return
+            decomposed = not requests and self.decomposer.applies(user_message, file_analysis_results)
+            if requests:
+                kind, messages = 'vision', requests[0][1]
+            elif decomposed:
+                # Nothing streams until the subqueries are answered
+                kind = 'text'
+                messages = self._decomposed_messages(user_message, file_analysis_results, chat_history, session, cancel)
+            else:
+                kind, messages = self._build_messages(user_message, file_analysis_results, chat_history)
+            intent = self.generation.classify(user_message, has_images=kind == 'vision')
+            trace.kind, trace.intent = 'decomposed' if decomposed else kind, intent
+            trace.max_tokens = self.generation.plan(intent)['max_tokens']
             
-            return error_msg
+            # The slot is held while the answer streams, and freed when the generator is closed
+            with self._admit(session, [messages], self.generation.plan(intent)['max_tokens'], cancel):
+                for piece in self._stream_text(kind, messages, cancel, intent):
+                    trace.first_piece()
+                    pieces.append(piece)
+                    yield piece
+            # Only answers that streamed to the end are reused
+            answer = "".join(pieces)
+            outcome = 'ok'
+            self.semantic_cache.put(user_message, scope, answer)
+                    
+        except RequestCancelled as e:
+            outcome = e.reason or 'cancelled'
+            yield ("\n\n" if pieces else "") + self._cancelled_note(e.reason)
+        except Exception as e:
+            outcome = 'error'
+            answer = self._error_response(e, user_message, file_analysis_results)
+            yield answer
+        finally:
+            cancel.finish()
+            trace.finish(outcome, answer if answer is not None else "".join(pieces), len(pieces))
     
-    def summarize_text(self, text, max_length=200):
-        """Summarize long text content"""
+    def _error_response(self, e, user_message, file_analysis_results=None):
+        """Pick the user-facing message for a failed request"""
+        if isinstance(e, ProviderError):
+            # Every provider failed; only apologise for quota when all are out of it
+            if e.quota_exhausted:
+                return self._handle_quota_exceeded(user_message, file_analysis_results)
+            return self._describe_error(e.errors[-1][2] if e.errors else e)
+        if "quota" in str(e).lower():
+            return self._handle_quota_exceeded(user_message, file_analysis_results)
+        return self._describe_error(e)
+    
+    def _describe_error(self, e):
+        """Turn an API failure into a user-facing message"""
+        error_str = str(e).lower()
+        
+        if "api_key" in error_str:
+            return "**API Key Error**: Please verify your OpenAI API key is correct and active."
+        elif "rate limit" in error_str:
+            return "**Rate Limit**: Too many requests. Please wait a moment before trying again."
+        elif "connection" in error_str:
+            return "**Connection Error**: Please check your internet connection and try again."
+        else:
+            return f"**API Error**: {str(e)}\n\nPlease check your OpenAI account status and try again."
+    
+    def _handle_quota_exceeded(self, user_message, file_analysis_results=None):
+        """Handle quota exceeded scenario with helpful response"""
+        response = "**OpenAI API Quota Exceeded**\n\n"
+        response += "Your OpenAI API usage limit has been reached. Here's what you can do:\n\n"
+        response += "**Immediate Solutions:**\n"
+        response += "• Check your OpenAI billing dashboard at https://platform.openai.com/account/billing\n"
+        response += "• Add payment method or increase usage limits\n"
+        response += "• Wait for your monthly quota to reset\n\n"
+        
+        response += "**Your Question Analysis:**\n"
+        response += f"You asked: *{user_message[:200]}{'...' if len(user_message) > 200 else ''}*\n\n"
+        
+        if file_analysis_results:
+            response += "**File Analysis Completed:**\n"
+            for i, result in enumerate(file_analysis_results, 1):
+                response += f"{i}. **{result.filename}** ({result.file_type})\n"
+                response += f"   {result.digest()}\n\n"
+        
+        response += "**Alternative Options:**\n"
+        response += "• Use a different OpenAI account with available quota\n"
+        response += "• Try other AI services like Anthropic Claude or Google Gemini\n"
+        response += "• Wait for quota reset and return later\n\n"
+        
+        response += "**Tip**: Monitor your usage at https://platform.openai.com/account/usage to avoid quota issues."
+        
+        return response
+
+    def _observe(self, intent, response, plan):
+        """Feed a finished (non-streamed) answer's length to the generation policy"""
+        usage = getattr(response, 'usage', None)
+        if usage is not None and response.choices:
+            truncated = response.choices[0].finish_reason == 'length'
+            self.generation.observe(intent, usage.completion_tokens, truncated, plan['max_tokens'])
+
+    def summarize_text(self, text, max_length=200, cancel=None, session=None):
+        """Summarize long text content
+        
+        Admitted and bounded by AI_TOTAL_TIMEOUT like a chat request;
+        ``session`` is whose share of upstream capacity it counts against.
+        """
+        cancel = self._request_token(cancel)
         try:
             prompt = f"Please provide a concise summary of the following text in about {max_length} words:\n\n{text}"
+            messages = [{"role": "user", "content": prompt}]
             
-            response = self.client.chat.completions.create(
-                model=self.text_model,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_length * 2,  # Allow some buffer
-                temperature=0.5
-            )
+            # Room for the requested length, or more if summaries usually run longer
+            plan = self.generation.plan('summary', target_words=max_length)
+            with self._admit(session, [messages], plan['max_tokens'], cancel):
+                response = self.router.create(
+                    'text',
+                    cancel=cancel,
+                    messages=messages,
+                    temperature=0.5,
+                    **plan
+                )
             
+            self._observe('summary', response, plan)
             return response.choices[0].message.content
             
         except Exception as e:
             return f"Error summarizing text: {str(e)}"
+        finally:
+            cancel.finish()
     
-    def analyze_image_with_context(self, base64_image, context=""):
-        """Analyze image with additional context"""
+    def analyze_image_with_context(self, base64_image, context="", cancel=None, session=None):
+        """Analyze image with additional context (admitted like summarize_text)"""
+        cancel = self._request_token(cancel)
         try:
             prompt = "Analyze this image in detail. "
             if context:
                 prompt += f"Additional context: {context}"
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                        }
+                    ]
+                }
+            ]
             
-            response = self.client.chat.completions.create(
-                model=self.vision_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
+            plan = self.generation.plan('image')
+            with self._admit(session, [messages], plan['max_tokens'], cancel):
+                response = self.router.create(
+                    'vision',
+                    cancel=cancel,
+                    messages=messages,
+                    temperature=0.7,
+                    **plan
+                )
             
+            self._observe('image', response, plan)
             return response.choices[0].message.content
             
         except Exception as e:
-            return f"Error analyzing image: {str(e)}"
\ No newline at end of file
+            return f"Error analyzing image: {str(e)}"
+        finally:
+            cancel.finish()
@@ -0,0 +1,193 @@
+"""
+Background analysis of uploaded files.
+
+Uploads are submitted as soon as they appear and analyzed on a worker pool
+while the user is still typing; removing the upload cancels its job. Jobs
+are keyed by content hash, so the same file uploaded twice (or seen again
+on a rerun) is analyzed once. Finished results go to an AttachmentStore:
+the most recent stay in memory, and older ones are read back from its
+compressed copies on disk when asked for again.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from utils.attachment_store import AttachmentStore
+from utils.upload_store import UploadBuffer
+
+
+def file_key(filename, file_bytes):
+    """Stable cache key for an upload: content hash plus name"""
+    if isinstance(file_bytes, UploadBuffer):
+        digest = file_bytes.sha256()
+    else:
+        digest = hashlib.sha256(file_bytes).hexdigest()
+    return f"{digest[:32]}:{filename}"
+
+
+class AnalysisJob:
+    """Bookkeeping for one queued analysis"""
+
+    def __init__(self, key, filename, size, upload=None):
+        self.key = key
+        self.filename = filename
+        self.size = size
+        self.upload = upload
+        self.future = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.error = None  # set by the worker before ``finished``
+        self.cancelled = threading.Event()
+
+    @property
+    def status(self):
+        """Never blocks, so it is safe to read under the queue's lock"""
+        if self.cancelled.is_set() or (self.future and self.future.cancelled()):
+            return 'cancelled'
+        if self.finished is not None:
+            return 'failed' if self.error is not None else 'done'
+        if self.started is not None:
+            return 'running'
+        return 'queued'
+
+
+class AnalysisQueue:
+    """Worker pool running FileProcessor analyses in the background"""
+
+    def __init__(self, file_processor, workers=None, cache_size=None, store=None):
+        self.file_processor = file_processor
+        self.workers = workers or int(os.getenv("ANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.cache_size = cache_size or int(os.getenv("ANALYSIS_CACHE_SIZE", "128"))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analysis")
+        self._jobs = {}
+        self._refs = {}
+        # Errors of failed jobs, until the file is submitted again
+        self._failed = OrderedDict()
+        # Results in memory up to cache_size, on disk beyond
+        self.store = store or AttachmentStore(max_items=self.cache_size)
+        self._lock = threading.Lock()
+
+    def submit(self, filename, file_bytes, key=None):
+        """Queue an analysis unless one is cached or already pending; returns its key
+
+        ``file_bytes`` may be an UploadBuffer, which the queue closes once
+        it is no longer needed.
+        """
+        key = key or file_key(filename, file_bytes)
+        upload = file_bytes if isinstance(file_bytes, UploadBuffer) else None
+        with self._lock:
+            self._refs[key] = self._refs.get(key, 0) + 1
+            job = self._jobs.get(key)
+            if (job is not None and job.status in ('queued', 'running', 'done')) or key in self.store:
+                if upload is not None:
+                    upload.close()
+                return key
+
+            self._failed.pop(key, None)
+            job = AnalysisJob(key, filename, len(file_bytes), upload)
+            job.future = self._executor.submit(self._run, job, filename, file_bytes)
+            self._jobs[key] = job
+        return key
+
+    def _run(self, job, filename, file_bytes):
+        """Worker body: analyze the file and move the result into the cache
+
+        The job leaves ``_jobs`` whether it succeeded or failed; a failure
+        is remembered in ``_failed`` so status() and result() report it.
+        """
+        result = None
+        try:
+            if job.cancelled.is_set():
+                raise CancelledError()
+            job.started = time.monotonic()
+            result = self.file_processor.process_bytes(filename, file_bytes, cancelled=job.cancelled)
+            return result
+        except Exception as e:
+            job.error = e
+            raise
+        finally:
+            job.finished = time.monotonic()
+            if job.upload is not None:
+                job.upload.close()
+            with self._lock:
+                current = self._jobs.get(job.key) is job
+                if current:
+                    del self._jobs[job.key]
+                if job.cancelled.is_set():
+                    pass
+                elif job.error is None:
+                    self.store.put(job.key, result)
+                    self._failed.pop(job.key, None)
+                elif current:
+                    # Not if the file was already submitted again
+                    self._failed[job.key] = job.error
+                    while len(self._failed) > self.cache_size:
+                        self._failed.popitem(last=False)
+
+    def status(self, key):
+        """'done', 'queued', 'running', 'failed', 'cancelled' or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(key)
+            failed = key in self._failed
+        if job is not None:
+            return job.status
+        if failed:
+            return 'failed'
+        return 'done' if key in self.store else None
+
+    def result(self, key, timeout=None):
+        """Analysis result for ``key``, waiting for a pending job if needed
+        
+        Results no longer in memory are read back from disk; KeyError if
+        the key is unknown or its result was evicted.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            error = self._failed.get(key)
+        if job is not None:
+            return job.future.result(timeout=timeout)
+        if error is not None:
+            raise error
+        result = self.store.get(key)
+        if result is None:
+            raise KeyError(key)
+        return result
+
+    def release(self, key):
+        """Drop one interest in ``key``; cancels the job once nobody wants it
+
+        Finished results stay in the store, so re-adding the same file is free.
+        """
+        with self._lock:
+            refs = self._refs.get(key, 0) - 1
+            if refs > 0:
+                self._refs[key] = refs
+                return False
+            self._refs.pop(key, None)
+        return self.cancel(key)
+
+    def cancel(self, key):
+        """Drop a pending job; a running one stops at its next stage boundary"""
+        with self._lock:
+            job = self._jobs.pop(key, None)
+        if job is None:
+            return False
+        job.cancelled.set()
+        if job.future.cancel() and job.upload is not None:
+            # Never started, so the worker will not close it
+            job.upload.close()
+        return True
+
+    def stats(self):
+        """Counts of cached results and pending jobs by status"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {'cached': self.store.stats()['hot_items'], 'workers': self.workers, **counts}
@@ -0,0 +1,276 @@
+"""
+Typed result of analyzing one uploaded file.
+
+FileProcessor used to return a dict whose 'analysis' field was a long
+Markdown report with emoji headers, sent verbatim to the model on every
+turn, next to a base64 copy of the prepared image and the full extracted
+text (which the retrieval index holds once more). AnalysisResult keeps
+the facts as fields, the text and the image behind small handles, and
+renders the report only when the UI or API asks for it (``markdown``);
+the prompt gets ``digest()``, one line of the same facts.
+"""
+
+import base64
+import io
+import re
+
+WORD_RE = re.compile(r"\S+")
+
+# Characters of extracted text kept for previews; the index holds the rest
+PREVIEW_CHARS = 600
+
+# Bumped when fields change, so cached results of an older layout are not reused
+RESULT_VERSION = 2
+
+
+def count_words(text):
+    """Whitespace-separated word count without building a list of words"""
+    return sum(1 for _ in WORD_RE.finditer(text))
+
+
+def count_lines(text):
+    """Line count matching len(text.splitlines()) for \\n-terminated text"""
+    if not text:
+        return 0
+    return text.count("\n") + (0 if text.endswith("\n") else 1)
+
+
+class ExtractedText:
+    """Counts and opening of a document's text
+
+    The full text is only needed to build the TextIndex, whose chunks
+    already hold it, so the handle keeps what the report and the prompt
+    use instead of a second copy.
+    """
+
+    __slots__ = ('characters', 'words', 'lines', 'head')
+
+    def __init__(self, characters, words, lines, head):
+        self.characters = characters
+        self.words = words
+        self.lines = lines
+        self.head = head
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(len(text), count_words(text), count_lines(text), text[:PREVIEW_CHARS])
+
+    def preview(self, limit=PREVIEW_CHARS):
+        return self.head[:limit] + "..." if self.characters > limit else self.head
+
+
+class PreparedImage:
+    """Image bytes as they will be sent to the vision model
+
+    Held as bytes and base64-encoded per request rather than kept as a
+    string a third larger.
+    """
+
+    __slots__ = ('mime_type', 'data', 'width', 'height')
+
+    def __init__(self, mime_type, data, width, height):
+        self.mime_type = mime_type
+        self.data = data
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_bytes(cls, mime_type, data):
+        """Copy ``data`` (which may be a view into the upload) and read its dimensions"""
+        data = bytes(data)
+        try:
+            from PIL import Image
+
+            # Only the header is parsed
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+        except Exception:
+            width = height = None
+        return cls(mime_type, data, width, height)
+
+    def base64(self):
+        return base64.b64encode(self.data).decode('ascii')
+
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.base64()}"
+
+    def open(self):
+        """Decoded PIL image"""
+        from PIL import Image
+
+        return Image.open(io.BytesIO(self.data))
+
+
+class AnalysisResult:
+    """Metadata, text and image of one analyzed file"""
+
+    __slots__ = (
+        'filename', 'file_type', 'size', 'content_hash', 'kind', 'error',
+        # images
+        'width', 'height', 'image_format', 'color_mode', 'frames', 'rich_colors',
+        # documents
+        'pages', 'pages_read', 'unreadable_pages', 'encoding',
+        # Markdown sections from OCR, frame sampling and full-document extraction
+        'notes',
+        'text', 'profile', 'structure', 'image', 'index',
+    )
+
+    def __init__(self, filename, file_type, size, content_hash=None, kind='unsupported'):
+        self.filename = filename
+        self.file_type = file_type
+        self.size = size
+        self.content_hash = content_hash
+        self.kind = kind  # 'image', 'pdf', 'text' or 'unsupported'
+        self.error = None
+        self.width = self.height = None
+        self.image_format = self.color_mode = None
+        self.frames = 1
+        self.rich_colors = False
+        self.pages = self.pages_read = None
+        self.unreadable_pages = ()
+        self.encoding = None
+        self.notes = []
+        self.text = None   # ExtractedText
+        self.profile = None  # TextProfile
+        self.structure = None  # LogSummary or SourceOutline
+        self.image = None  # PreparedImage
+        self.index = None  # TextIndex
+
+    def __repr__(self):
+        return f"AnalysisResult({self.filename!r}, {self.file_type!r}, {self.size})"
+
+    @property
+    def is_image(self):
+        return self.image is not None and self.file_type.startswith('image/')
+
+    def without_index(self):
+        """Shallow copy without the index, which is cached separately"""
+        copy = object.__new__(AnalysisResult)
+        for name in self.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.index = None
+        return copy
+
+    # Prompt
+
+    def digest(self):
+        """Compact description for the prompt, e.g. 'pdf; 40 pages, 5 read; 3,120 words'"""
+        if self.error:
+            return f"{self.kind}; error: {self.error}"
+        if self.kind == 'unsupported':
+            return "unsupported file type"
+        parts = [self.kind]
+        if self.kind == 'image':
+            size = f"{self.width}x{self.height}" if self.width else "unreadable"
+            parts.append(" ".join(filter(None, (size, self.image_format, self.color_mode))))
+            if self.frames > 1:
+                parts.append(f"{self.frames} frames, sent as a contact sheet")
+        if self.pages is not None:
+            read = f", {self.pages_read} read" if self.pages_read is not None and self.pages_read < self.pages else ""
+            parts.append(f"{self.pages} pages{read}")
+        if self.unreadable_pages:
+            parts.append("unreadable pages " + ",".join(map(str, self.unreadable_pages[:10])))
+        if self.encoding:
+            parts.append(self.encoding)
+        if self.text is not None:
+            parts.append(f"{self.text.words:,} words, {self.text.lines:,} lines")
+        if self.structure is not None:
+            parts.append(self.structure.digest())
+        elif self.profile is not None and self.kind != 'image':
+            parts.append(self.profile.digest())
+        if self.text is None and self.kind != 'image':
+            parts.append("no readable text")
+        return "; ".join(filter(None, parts))
+
+    # UI
+
+    @property
+    def markdown(self):
+        """The analysis report for the UI, rendered on each access"""
+        if self.error:
+            return self.error
+        if self.kind == 'image':
+            report = self._image_markdown()
+        elif self.kind == 'pdf':
+            report = self._pdf_markdown()
+        elif self.kind == 'text':
+            report = self._text_markdown()
+        else:
+            report = f"Unsupported file type: {self.file_type}"
+        if self.structure is not None:
+            report += self.structure.markdown()
+        elif self.profile is not None and self.kind != 'image':
+            report += self.profile.markdown()
+        return report + "".join(self.notes)
+
+    def _image_markdown(self):
+        total_pixels = self.width * self.height if self.width and self.height else None
+        if total_pixels is None:
+            size_category = None
+        elif total_pixels < 100000:
+            size_category = "Small (Thumbnail/Icon)"
+        elif total_pixels < 1000000:
+            size_category = "Medium (Web/Screen)"
+        else:
+            size_category = "Large (High-resolution)"
+        report = "🖼️ **Image Analysis Report**\n\n"
+        report += "**Technical Specifications:**\n"
+        if total_pixels is None:
+            report += "• Dimensions: unavailable\n"
+        else:
+            report += f"• Dimensions: {self.width} × {self.height} pixels\n"
+        report += f"• Format: {self.image_format}\n"
+        report += f"• Color Mode: {self.color_mode}\n"
+        report += f"• File Size: {self.size / 1024:.1f} KB\n"
+        if self.frames > 1:
+            report += f"• Frames: {self.frames} (animated)\n"
+        report += "\n"
+        if self.rich_colors:
+            report += "• Color Information: Rich color palette detected\n"
+        if total_pixels is not None:
+            report += f"• Size Category: {size_category}\n"
+            report += f"• Total Pixels: {total_pixels:,}\n"
+        report += "\n"
+        report += "**AI Vision Analysis Ready** ✅\n"
+        report += "This image is prepared for detailed AI visual analysis."
+        if self.text is not None:
+            report += f"\n\n**Detected Text (OCR):**\n```\n{self.text.preview(500)}\n```"
+        return report
+
+    def _pdf_markdown(self):
+        report = "📄 **PDF Document Analysis**\n\n"
+        report += "**Document Structure:**\n"
+        report += f"• Total Pages: {self.pages}\n"
+        report += f"• File Size: {self.size / 1024:.1f} KB\n\n"
+        if self.text is None:
+            return report + "**Content Status:** No readable text found (may contain images or scanned content)"
+        report += "**Content Analysis:**\n"
+        report += f"• Characters: {self.text.characters:,}\n"
+        report += f"• Words: {self.text.words:,}\n"
+        report += f"• Pages Processed: {self.pages_read}\n"
+        if self.index is not None:
+            report += f"• Indexed Passages: {len(self.index):,}\n"
+        if self.unreadable_pages:
+            failed = ", ".join(map(str, self.unreadable_pages[:10]))
+            more = f" and {len(self.unreadable_pages) - 10} more" if len(self.unreadable_pages) > 10 else ""
+            report += f"• Unreadable Pages: {failed}{more}\n"
+        if self.pages_read is not None and self.pages > self.pages_read:
+            report += f"• Note: only the first {self.pages_read} pages were read\n"
+        report += f"\n**Content Preview:**\n```\n{self.text.preview()}\n```\n\n"
+        return report + "**Text Extraction: Successful** ✅"
+
+    def _text_markdown(self):
+        text = self.text
+        report = "📝 **Text Document Analysis**\n\n"
+        report += "**File Properties:**\n"
+        report += f"• Encoding: {self.encoding}\n"
+        report += f"• File Size: {self.size / 1024:.1f} KB\n"
+        if text is None:
+            return report + "\n**Content Status:** Text unavailable (no readable text was extracted)"
+        report += f"• Text Length: {text.characters:,} characters\n\n"
+        report += "**Content Statistics:**\n"
+        report += f"• Words: {text.words:,}\n"
+        report += f"• Lines: {text.lines:,}\n"
+        report += f"• Average words per line: {text.words / max(text.lines, 1):.1f}\n\n"
+        report += f"**Content Preview:**\n```\n{text.preview(500)}\n```\n\n"
+        return report + "**Text Processing: Complete** ✅"
@@ -0,0 +1,313 @@
+"""
+Tiered storage for analyzed attachments.
+
+Analysis results hold the prepared image and the retrieval index, the bulk
+of a session's memory, and used to stay in RAM (or vanish with the LRU
+that held them). An AttachmentStore keeps them in three tiers:
+
+* hot: an in-memory LRU bounded by item count (set by the owner) and by
+  approximate bytes (``ATTACHMENT_HOT_MB``);
+* warm: every result is also written, on a background thread, to a
+  compressed file under ``ATTACHMENT_DIR`` (default ``uploads/attachments``,
+  next to the spilled uploads), with zstd when the ``zstandard`` package is
+  installed and zlib otherwise. Falling out of the hot tier only drops the
+  in-memory copy, and ``get`` rehydrates it from disk;
+* cold: a sweep deletes warm files not read for ``ATTACHMENT_MAX_AGE_HOURS``
+  and then the least recently read ones beyond ``ATTACHMENT_DISK_MB``.
+  Those are gone and ``get`` returns None.
+
+Warm files are pickles written by this process; keep the directory private
+to the app. ``referenced_attachments`` finds files of earlier turns that a
+new question names again, so the chat can bring them back into the prompt.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.analysis_result import RESULT_VERSION
+
+MAGIC = b"AT1"
+ZSTD = b"z"
+ZLIB = b"d"
+SUFFIX = ".att"
+
+
+def footprint(result):
+    """Approximate bytes an analysis result holds in memory"""
+    size = 2048
+    image = getattr(result, 'image', None)
+    if image is not None:
+        size += len(image.data)
+    index = getattr(result, 'index', None)
+    if index is not None:
+        # Chunk text plus about as much again for postings and lengths
+        size += 2 * sum(len(chunk) for chunk in index.chunks)
+    return size
+
+
+class Codec:
+    """zstd when available, else zlib; reads either"""
+
+    def __init__(self, level=3):
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        self.zstandard = zstandard
+        self.level = level
+
+    @property
+    def name(self):
+        return "zstd" if self.zstandard else "zlib"
+
+    def compress(self, payload):
+        if self.zstandard:
+            return MAGIC + ZSTD + self.zstandard.ZstdCompressor(level=self.level).compress(payload)
+        return MAGIC + ZLIB + zlib.compress(payload, min(self.level, 9))
+
+    def decompress(self, data):
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not an attachment file")
+        codec, body = data[len(MAGIC):len(MAGIC) + 1], data[len(MAGIC) + 1:]
+        if codec == ZSTD:
+            if not self.zstandard:
+                raise ValueError("zstd-compressed attachment but zstandard is not installed")
+            return self.zstandard.ZstdDecompressor().decompress(body)
+        if codec == ZLIB:
+            return zlib.decompress(body)
+        raise ValueError(f"unknown codec {codec!r}")
+
+
+class AttachmentStore:
+    """Hot LRU in memory, warm compressed files on disk, cold eviction by age and size"""
+
+    def __init__(self, directory=None, max_items=None, max_hot_bytes=None, max_disk_bytes=None,
+                 max_age=None, sweep_interval=60.0, level=None):
+        mb = 1024 * 1024
+        self.directory = directory or os.getenv("ATTACHMENT_DIR") or os.path.join(
+            os.getenv("UPLOAD_DIR", "uploads"), "attachments")
+        self.max_items = max_items or 128
+        self.max_hot_bytes = int(max_hot_bytes or float(os.getenv("ATTACHMENT_HOT_MB", "256")) * mb)
+        self.max_disk_bytes = int(max_disk_bytes or float(os.getenv("ATTACHMENT_DISK_MB", "2048")) * mb)
+        self.max_age = float(max_age or float(os.getenv("ATTACHMENT_MAX_AGE_HOURS", "168")) * 3600)
+        self.sweep_interval = sweep_interval
+        self.codec = Codec(int(level or os.getenv("ATTACHMENT_COMPRESSION_LEVEL", "3")))
+        self._hot = OrderedDict()  # key -> (result, footprint)
+        self._hot_bytes = 0
+        # Written on the writer thread; readable from here until the file exists
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="attachment-writer")
+        self._last_sweep = 0.0
+        self.counts = {'hot_hits': 0, 'warm_hits': 0, 'misses': 0, 'demoted': 0, 'written': 0,
+                       'write_errors': 0, 'evicted': 0, 'written_bytes': 0}
+
+    def _path(self, key):
+        # Results of an older layout are not read back after an upgrade; the sweep removes them
+        name = hashlib.sha256(f"v{RESULT_VERSION}:{key}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name[:2], name + SUFFIX)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    # Hot tier
+
+    def _promote(self, key, result):
+        """Insert into the hot LRU and demote the least recently used beyond the limits"""
+        size = footprint(result)
+        with self._lock:
+            previous = self._hot.pop(key, None)
+            if previous is not None:
+                self._hot_bytes -= previous[1]
+            self._hot[key] = (result, size)
+            self._hot_bytes += size
+            # The newest item stays even if it alone is over the byte budget
+            while len(self._hot) > 1 and (len(self._hot) > self.max_items or self._hot_bytes > self.max_hot_bytes):
+                _, (_, dropped) = self._hot.popitem(last=False)
+                self._hot_bytes -= dropped
+                self.counts['demoted'] += 1
+
+    def put(self, key, result):
+        """Store ``result``: hot at once, written to the warm tier in the background"""
+        self._promote(key, result)
+        with self._lock:
+            self._pending[key] = result
+        self._writer.submit(self._write, key, result)
+
+    def get(self, key):
+        """The result for ``key`` from memory or disk, or None if unknown or evicted"""
+        with self._lock:
+            entry = self._hot.get(key)
+            if entry is not None:
+                self._hot.move_to_end(key)
+                self.counts['hot_hits'] += 1
+                return entry[0]
+            pending = self._pending.get(key)
+        if pending is not None:
+            self._promote(key, pending)
+            self._count('hot_hits')
+            return pending
+        result = self._read(key)
+        if result is None:
+            self._count('misses')
+            return None
+        self._promote(key, result)
+        self._count('warm_hits')
+        return result
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._hot or key in self._pending:
+                return True
+        return os.path.exists(self._path(key))
+
+    def discard(self, key):
+        """Forget ``key`` in every tier"""
+        with self._lock:
+            entry = self._hot.pop(key, None)
+            if entry is not None:
+                self._hot_bytes -= entry[1]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    # Warm tier
+
+    def _write(self, key, result):
+        path = self._path(key)
+        try:
+            data = self.codec.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, path)
+            self._count('written')
+            self._count('written_bytes', len(data))
+        except Exception:
+            # The hot copy still serves; it just will not survive demotion
+            self._count('write_errors')
+        finally:
+            with self._lock:
+                if self._pending.get(key) is result:
+                    del self._pending[key]
+        if time.monotonic() - self._last_sweep > self.sweep_interval:
+            self.sweep()
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            result = pickle.loads(self.codec.decompress(data))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or unreadable: treat as evicted
+            self.discard(key)
+            return None
+        try:
+            # Reading counts as use for the age and size policies
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def flush(self):
+        """Wait for pending writes (tests, benchmarks and shutdown)"""
+        self._writer.submit(lambda: None).result()
+
+    # Cold tier
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(SUFFIX):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    def sweep(self):
+        """Delete warm files past the age limit, then the least recently read beyond the size limit"""
+        self._last_sweep = time.monotonic()
+        now = time.time()
+        kept = []
+        evicted = 0
+        for path, mtime, size in self._files():
+            if now - mtime > self.max_age:
+                evicted += self._remove(path)
+            else:
+                kept.append((mtime, size, path))
+        total = sum(size for _, size, _ in kept)
+        for mtime, size, path in sorted(kept):
+            if total <= self.max_disk_bytes:
+                break
+            evicted += self._remove(path)
+            total -= size
+        self._count('evicted', evicted)
+        return evicted
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            hot_items, hot_bytes, pending = len(self._hot), self._hot_bytes, len(self._pending)
+        lookups = counts['hot_hits'] + counts['warm_hits'] + counts['misses']
+        return {
+            'hot_items': hot_items,
+            'hot_mb': round(hot_bytes / (1024 * 1024), 1),
+            'pending_writes': pending,
+            'codec': self.codec.name,
+            'hot_hit_rate': round(counts['hot_hits'] / lookups, 3) if lookups else None,
+            **counts,
+        }
+
+
+def _mentions(prompt, name):
+    """Whether ``prompt`` names the file, by full name or by a distinctive stem
+
+    Stems count only when they cannot be an ordinary word ("q3-report",
+    "invoice_2024", "architecture"), so "the data" does not pull in data.csv.
+    """
+    text = prompt.lower()
+    name = name.lower()
+    if name and name in text:
+        return True
+    stem = os.path.splitext(name)[0]
+    distinctive = len(stem) >= 8 or (len(stem) >= 3 and re.search(r"[\d_\-]", stem))
+    return bool(distinctive) and re.search(rf"(?<!\w){re.escape(stem)}(?!\w)", text) is not None
+
+
+def referenced_attachments(prompt, messages, exclude=(), key='key'):
+    """File entries of earlier turns whose name the prompt mentions, newest first, one per store key
+
+    ``key`` names the entry field holding the store key.
+    """
+    found = []
+    seen = set(exclude)
+    for message in reversed(messages):
+        for entry in message.get('files') or ():
+            key_value = entry.get(key)
+            if key_value and key_value not in seen and _mentions(prompt, entry.get('name', '')):
+                seen.add(key_value)
+                found.append(entry)
+    return found
@@ -0,0 +1,187 @@
+"""
+Cancellation of in-flight model requests.
+
+A CancelToken travels with one request from the UI or API down to the
+provider call. Cancelling it (the user pressed "Stop generating", cleared
+the chat or closed the tab, the API client disconnected, or the total
+timeout ran out) runs the callbacks registered on it, which close the
+HTTP stream, so the provider stops generating and the waiting worker
+thread is released right away. CancellationStats counts what was cut off.
+"""
+
+import heapq
+import itertools
+import socket
+import threading
+import time
+
+
+class RequestCancelled(Exception):
+    """Raised when a request is abandoned through its CancelToken"""
+
+    def __init__(self, reason="cancelled"):
+        self.reason = reason
+        super().__init__(f"Request cancelled ({reason})")
+
+
+class CancelToken:
+    """Thread-safe, one-shot cancellation signal with an optional deadline"""
+
+    def __init__(self, timeout=None):
+        self.reason = None
+        self.cancelled_at = None
+        self.deadline = None
+        self.finished = False
+        self._event = threading.Event()
+        self._callbacks = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        if timeout:
+            self.set_deadline(timeout)
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """Cancel once and run the callbacks; returns False if already cancelled or finished"""
+        with self._lock:
+            if self._event.is_set() or self.finished:
+                return False
+            self.reason = reason
+            self.cancelled_at = time.monotonic()
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # Closing an already closed stream and the like
+                pass
+        return True
+
+    def finish(self):
+        """Mark the request complete; later cancels and the deadline are ignored"""
+        with self._lock:
+            self.finished = True
+            self._callbacks.clear()
+
+    def on_cancel(self, callback):
+        """Run ``callback`` on cancellation (now, if already cancelled); returns an unregister function"""
+        with self._lock:
+            if not self._event.is_set():
+                key = next(self._ids)
+                self._callbacks[key] = callback
+                return lambda: self._callbacks.pop(key, None)
+        callback()
+        return lambda: None
+
+    def set_deadline(self, seconds):
+        """Cancel with reason 'timeout' after ``seconds``, unless an earlier deadline is set"""
+        deadline = time.monotonic() + seconds
+        with self._lock:
+            if self.deadline is not None and self.deadline <= deadline:
+                return
+            self.deadline = deadline
+        _deadlines.schedule(self, deadline)
+
+    def check(self):
+        """Raise RequestCancelled if the token was cancelled"""
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class _DeadlineWatcher:
+    """One background thread that cancels tokens whose deadline has passed"""
+
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, token, deadline):
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._order), token))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-deadlines", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                deadline, _, token = self._heap[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                    continue
+                heapq.heappop(self._heap)
+            # A later set_deadline may have moved it earlier; never later
+            if not token.finished and token.deadline == deadline:
+                token.cancel("timeout")
+
+
+_deadlines = _DeadlineWatcher()
+
+
+def abort_stream(stream):
+    """Stop a streamed HTTP response from another thread
+
+    Closing the response does not wake a thread blocked reading its socket,
+    so the socket is shut down instead; the reader then sees the stream end
+    and closes it. Only HTTP/1.1 connections carry a single response: an
+    HTTP/2 connection multiplexes other requests' streams, so there (and
+    without a socket to reach) just this response is closed.
+    """
+    response = getattr(stream, 'response', None)
+    if response is None or response.http_version not in ("HTTP/1.1", "HTTP/1.0"):
+        stream.close()
+        return
+    network = response.extensions.get('network_stream')
+    sock = network.get_extra_info('socket') if network is not None else None
+    if sock is None:
+        stream.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class CancellationStats:
+    """Counts of cut-off requests and the tokens they did not spend"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reasons = {}
+        self.tokens_streamed = 0  # generated before the cut, then thrown away or shown partially
+        self.tokens_avoided = 0   # max_tokens budget left unspent (an upper bound)
+        self.release_ms = []      # cancel -> worker thread free
+
+    def record(self, reason, streamed, max_tokens, cancelled_at=None):
+        with self._lock:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+            self.tokens_streamed += streamed
+            self.tokens_avoided += max(max_tokens - streamed, 0)
+            if cancelled_at is not None:
+                self.release_ms.append((time.monotonic() - cancelled_at) * 1000)
+                del self.release_ms[:-1000]
+
+    def stats(self):
+        with self._lock:
+            release = sorted(self.release_ms)
+            return {
+                'cancelled': sum(self.reasons.values()),
+                'reasons': dict(self.reasons),
+                'tokens_streamed': self.tokens_streamed,
+                'tokens_avoided': self.tokens_avoided,
+                'release_ms_p50': round(release[len(release) // 2], 1) if release else None,
+                'release_ms_max': round(release[-1], 1) if release else None,
+            }
@@ -0,0 +1,125 @@
+"""
+Conversation memory with incremental background compaction.
+
+The raw messages are kept as they are; alongside them a ConversationMemory
+holds a running summary of everything but the most recent turns. After
+each reply the MemoryCompactor folds the turns that just fell out of the
+recent window into the summary on a background thread, using
+``AIClient.summarize_text``. Prompts are assembled from the summary plus
+every turn not yet folded into it, so nothing falls between the two and
+their size stays roughly constant however long the session gets. If
+summarizing keeps failing, only the last ``MEMORY_MAX_MESSAGES`` of the
+uncompacted turns are sent.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SUMMARY_ERROR_PREFIX = "Error summarizing text"
+
+
+class ConversationMemory:
+    """Running summary of a conversation's older turns"""
+
+    def __init__(self, max_messages=None):
+        self.max_messages = int(max_messages or os.getenv("MEMORY_MAX_MESSAGES", "40"))
+        self.summary = ""
+        self.covers = 0  # number of leading raw messages folded into the summary
+        self.compactions = 0
+        self.updated = None
+        self.pending = False
+        self.lock = threading.Lock()
+
+    def history(self, messages):
+        """Chat history for the prompt: the summary, then the uncompacted turns"""
+        with self.lock:
+            summary, covers = self.summary, self.covers
+        history = []
+        if summary:
+            history.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation ({covers} messages):\n{summary}"
+            })
+        return history + list(messages[covers:])[-self.max_messages:]
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'summary': self.summary,
+                'covers': self.covers,
+                'compactions': self.compactions,
+                'updated': self.updated,
+                'pending': self.pending,
+            }
+
+
+class MemoryCompactor:
+    """Folds older turns into a ConversationMemory's summary in the background"""
+
+    def __init__(self, ai_client, recent_messages=None, batch_messages=None, summary_words=None, workers=None):
+        self.ai_client = ai_client
+        # Turns kept verbatim; older ones are summarized in batches of batch_messages
+        self.recent_messages = int(recent_messages or os.getenv("MEMORY_RECENT_MESSAGES", "5"))
+        self.batch_messages = int(batch_messages or os.getenv("MEMORY_COMPACT_MESSAGES", "4"))
+        self.summary_words = int(summary_words or os.getenv("MEMORY_SUMMARY_WORDS", "150"))
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(workers or os.getenv("MEMORY_WORKERS", "2")),
+            thread_name_prefix="memory"
+        )
+        self.failures = 0
+
+    def after_reply(self, memory, messages, session=None):
+        """Schedule compaction once enough turns have left the recent window
+
+        Returns the future, or None if nothing needed doing. At most one
+        compaction per conversation runs at a time; turns that arrive
+        meanwhile are picked up after the next reply. The summarizing call
+        counts against ``session``'s share of upstream capacity.
+        """
+        with memory.lock:
+            target = len(messages) - self.recent_messages
+            if memory.pending or target - memory.covers < self.batch_messages:
+                return None
+            memory.pending = True
+            start = memory.covers
+            summary = memory.summary
+            turns = list(messages[start:target])
+        return self._executor.submit(self._compact, memory, summary, turns, start, target, session)
+
+    def _compact(self, memory, summary, turns, start, target, session=None):
+        """Worker body: summarize the old summary plus the new turns"""
+        try:
+            text = ""
+            if summary:
+                text += f"Summary of the conversation so far:\n{summary}\n\n"
+            text += "New messages:\n"
+            for message in turns:
+                content = str(message.get('content', ''))
+                # Long answers only need their gist
+                if len(content) > 2000:
+                    content = content[:2000] + " ..."
+                text += f"{message['role'].capitalize()}: {content}\n"
+            text += (
+                "\nKeep facts, decisions, names, numbers and open questions "
+                "the user may refer back to."
+            )
+
+            new_summary = self.ai_client.summarize_text(text, max_length=self.summary_words, session=session)
+            if not new_summary or new_summary.startswith(SUMMARY_ERROR_PREFIX):
+                self.failures += 1
+                return False
+
+            with memory.lock:
+                # The conversation may have been cleared meanwhile
+                if memory.covers != start:
+                    return False
+                memory.summary = new_summary.strip()
+                memory.covers = target
+                memory.compactions += 1
+                memory.updated = time.time()
+            return True
+        finally:
+            with memory.lock:
+                memory.pending = False
@@ -1,22 +1,53 @@
-import base64
+"""
+File analysis for uploaded images, PDFs and text.
+
+Parsers (python-magic, chardet, Pillow, PyPDF2) are imported on first use
+so that importing this module stays cheap and free of Streamlit.
+"""
+
 import io
-import magic
-import chardet
-from PIL import Image
-import PyPDF2
-import streamlit as st
+import os
+from concurrent.futures import CancelledError
+
+from utils.analysis_result import RESULT_VERSION, AnalysisResult, PreparedImage
+from utils.frames import FrameSampler
+from utils.log_analyzer import LogAnalyzer, looks_like_log
+from utils.ocr import OcrEngine
+from utils.shared_cache import get_shared_cache
+from utils.source_outline import SourceOutliner, source_language
+from utils.text_index import TextIndex
+from utils.text_profile import TextProfiler, profile_text
+from utils.upload_store import UploadBuffer
+
 
 class FileProcessor:
     """Handles processing of different file types for analysis"""
     
-    def __init__(self):
+    def __init__(self, full_document_pdf=None, cache=None):
         self.supported_image_types = ['image/jpeg', 'image/png', 'image/gif', 'image/bmp']
         self.supported_text_types = ['text/plain']
         self.supported_pdf_types = ['application/pdf']
+        # Vision models downscale anything larger, so there is no point sending it
+        self.max_image_side = 2048
+        self.max_image_bytes = 4 * 1024 * 1024
+        # Opt-in: extract every PDF page on a process pool instead of the first 5
+        if full_document_pdf is None:
+            full_document_pdf = os.getenv("PDF_FULL_DOCUMENT", "0") == "1"
+        self.full_document_pdf = full_document_pdf
+        # Local OCR for scanned PDFs; images only on request (the vision model sees them)
+        self.ocr = OcrEngine()
+        self.ocr_images = os.getenv("OCR_IMAGES", "0") == "1"
+        # Animations are sent as a contact sheet of their scene changes
+        self.frames = FrameSampler(max_side=self.max_image_side)
+        # Results and indexes are shared with other workers and replicas
+        self.cache = cache or get_shared_cache()
+        # Logs and source files above this are indexed by their digest, not in full
+        self.max_stream_index_bytes = int(float(os.getenv("TEXT_INDEX_MAX_MB", "4")) * 1024 * 1024)
     
     def detect_file_type(self, file_bytes):
         """Detect file type using python-magic"""
         try:
+            import magic
             mime_type = magic.from_buffer(file_bytes, mime=True)
             return mime_type
         except:
@@ -32,155 +63,326 @@ class FileProcessor:
     
     def process_file(self, uploaded_file):
         """Process uploaded file and return analysis results"""
-        # Read file bytes
-        file_bytes = uploaded_file.read()
-        uploaded_file.seek(0)  # Reset file pointer
+        # Work on the upload's own buffer instead of reading a copy
+        upload = UploadBuffer.from_upload(uploaded_file)
+        try:
+            return self.process_bytes(uploaded_file.name, upload)
+        finally:
+            upload.close()
+    
+    def process_bytes(self, filename, file_bytes, cancelled=None):
+        """Analyze raw file contents; used by entry points without an upload object
+        
+        ``file_bytes`` may be bytes, a memoryview or an UploadBuffer; it is
+        never copied as a whole. Runs in stages (type detection, extraction,
+        image preparation, index building). ``cancelled`` is an optional
+        threading.Event checked between stages so speculative work on a
+        removed upload stops early. Returns an AnalysisResult.
+        """
+        upload = UploadBuffer.wrap(filename, file_bytes)
         
-        # Detect file type
-        mime_type = self.detect_file_type(file_bytes)
+        # Same content and settings: reuse a result from any worker or replica
+        variant = self._cache_variant(upload)
+        cached = self._cached_result(filename, variant)
+        if cached is not None:
+            return cached
         
-        analysis_result = {
-            'filename': uploaded_file.name,
-            'file_type': mime_type,
-            'size': len(file_bytes),
-            'analysis': '',
-            'base64_data': None
-        }
+        # Detect file type from the header
+        mime_type = self.detect_file_type(upload.head())
+        
+        result = AnalysisResult(filename, mime_type, upload.size, upload.sha256())
+        text = None
         
         try:
+            self._check_cancelled(cancelled)
+            
             if mime_type in self.supported_image_types:
-                analysis_result['analysis'] = self._process_image(file_bytes)
-                analysis_result['base64_data'] = base64.b64encode(file_bytes).decode('utf-8')
+                result.kind = 'image'
+                self._process_image(upload, result)
+                self._check_cancelled(cancelled)
+                
+                if self.ocr_images and self.ocr.available:
+                    text = self.ocr.ocr_image(upload.view()) or None
+                    self._check_cancelled(cancelled)
+                
+                sample = self._sample_frames(upload, cancelled)
+                if sample is not None:
+                    result.notes.append(sample.summary())
+                    result.image = PreparedImage.from_bytes(sample.mime_type, sample.image_bytes)
+                else:
+                    result.image = PreparedImage.from_bytes(*self._prepare_image(upload, mime_type))
+                
+            elif mime_type in self.supported_pdf_types and self.full_document_pdf:
+                result.kind = 'pdf'
+                text, result.index = self._process_pdf_full(upload, result, cancelled)
                 
             elif mime_type in self.supported_pdf_types:
-                analysis_result['analysis'] = self._process_pdf(file_bytes)
+                result.kind = 'pdf'
+                text = self._process_pdf(upload, result)
                 
             elif mime_type in self.supported_text_types or 'text' in mime_type:
-                analysis_result['analysis'] = self._process_text(file_bytes)
-                
-            else:
-                analysis_result['analysis'] = f"Unsupported file type: {mime_type}"
+                result.kind = 'text'
+                text = self._process_text(upload, result, cancelled)
+            
+            # Scanned PDFs have no text layer: fall back to local OCR
+            if result.kind == 'pdf' and not text and not result.error and self.ocr.pdf_available:
+                self._check_cancelled(cancelled)
+                text, ocr_summary = self.ocr.ocr_pdf(upload, cancelled=cancelled)
+                result.notes.append(ocr_summary)
+            
+            if text:
+                # Counts, keywords, language and structure in one pass over the text
+                if result.text is None:
+                    self._check_cancelled(cancelled)
+                    result.text, result.profile = profile_text(text)
+                # Build a retrieval index so later questions can pull relevant passages
+                if result.index is None:
+                    self._check_cancelled(cancelled)
+                    result.index = TextIndex.from_text(text)
                 
+        except CancelledError:
+            raise
         except Exception as e:
-            analysis_result['analysis'] = f"Error processing file: {str(e)}"
+            result.error = f"Error processing file: {str(e)}"
+            return result
         
-        return analysis_result
+        self._store_result(variant, result)
+        return result
+    
+    def _cache_variant(self, upload):
+        """Content hash plus the settings that change the result"""
+        settings = f"{int(self.full_document_pdf)}{int(self.ocr.enabled)}{int(self.ocr_images)}"
+        # The extension decides how source code is outlined
+        extension = os.path.splitext(upload.name)[1].lower()
+        return f"{upload.sha256()}:{settings}:{self.max_image_side}:{extension}:v{RESULT_VERSION}"
+    
+    def _cached_result(self, filename, variant):
+        """Shared-cache result for ``variant`` under this filename, or None"""
+        result = self.cache.get(f"analysis:{variant}")
+        if not isinstance(result, AnalysisResult):
+            # Missing, or a dict cached by an older version
+            return None
+        result.filename = filename
+        if result.text is not None:
+            result.index = self.cache.get(f"index:{variant}")
+            if result.index is None:
+                # The text itself is not cached; analyze again
+                return None
+        return result
+    
+    def _store_result(self, variant, result):
+        """Publish a result; the index is stored separately as it is the bulk of it"""
+        self.cache.set(f"analysis:{variant}", result.without_index())
+        if result.index is not None:
+            self.cache.set(f"index:{variant}", result.index)
+    
+    def _check_cancelled(self, cancelled):
+        """Abort the pipeline if the upload was removed meanwhile"""
+        if cancelled is not None and cancelled.is_set():
+            raise CancelledError()
     
-    def _process_image(self, file_bytes):
-        """Process image files and extract basic information"""
+    def _sample_frames(self, upload, cancelled=None):
+        """Contact sheet for an animated image, or None for stills and on failure"""
         try:
-            image = Image.open(io.BytesIO(file_bytes))
+            return self.frames.sample(upload, cancelled)
+        except CancelledError:
+            raise
+        except Exception:
+            return None
+    
+    def _prepare_image(self, upload, mime_type):
+        """Downscale oversized images before they are sent to the vision model"""
+        try:
+            import io
+            from PIL import Image
             
-            # Basic image analysis
-            analysis = f"🖼️ **Image Analysis Report**\n\n"
-            analysis += f"**Technical Specifications:**\n"
-            analysis += f"• Dimensions: {image.width} × {image.height} pixels\n"
-            analysis += f"• Format: {image.format}\n"
-            analysis += f"• Color Mode: {image.mode}\n"
-            analysis += f"• File Size: {len(file_bytes) / 1024:.1f} KB\n\n"
+            image = Image.open(upload.stream())
             
-            # Color analysis
-            if image.mode in ['RGB', 'RGBA']:
-                colors = image.getcolors(maxcolors=256*256*256)
-                if colors:
-                    analysis += f"• Color Information: Rich color palette detected\n"
-            
-            # Size categories
-            total_pixels = image.width * image.height
-            if total_pixels < 100000:
-                size_cat = "Small (Thumbnail/Icon)"
-            elif total_pixels < 1000000:
-                size_cat = "Medium (Web/Screen)"
+            # Animations that could not be sampled are forwarded untouched
+            if getattr(image, 'is_animated', False):
+                return mime_type, upload.view()
+            
+            if max(image.size) <= self.max_image_side and upload.size <= self.max_image_bytes:
+                return mime_type, upload.view()
+            
+            image.thumbnail((self.max_image_side, self.max_image_side))
+            output = io.BytesIO()
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image.save(output, format='PNG', optimize=True)
+                prepared = ('image/png', output.getvalue())
             else:
-                size_cat = "Large (High-resolution)"
+                image.convert('RGB').save(output, format='JPEG', quality=85)
+                prepared = ('image/jpeg', output.getvalue())
             
-            analysis += f"• Size Category: {size_cat}\n"
-            analysis += f"• Total Pixels: {total_pixels:,}\n\n"
-            analysis += "**AI Vision Analysis Ready** ✅\n"
-            analysis += "This image is prepared for detailed AI visual analysis."
+            # Keep the original if re-encoding did not help
+            return prepared if len(prepared[1]) < upload.size else (mime_type, upload.view())
             
-            return analysis
+        except Exception:
+            return mime_type, upload.view()
+    
+    def _process_image(self, upload, result):
+        """Read the image's basic properties into ``result``"""
+        try:
+            from PIL import Image
+            
+            image = Image.open(upload.stream())
+            result.width, result.height = image.size
+            result.image_format = image.format
+            result.color_mode = image.mode
+            result.frames = getattr(image, 'n_frames', 1)
+            
+            # Color analysis
+            if image.mode in ['RGB', 'RGBA']:
+                result.rich_colors = bool(image.getcolors(maxcolors=256*256*256))
             
         except Exception as e:
-            return f"Error analyzing image: {str(e)}"
+            result.error = f"Error analyzing image: {str(e)}"
     
-    def _process_pdf(self, file_bytes):
-        """Process PDF files and extract text content"""
+    def _process_pdf(self, upload, result):
+        """Read page count and the first pages' text; returns the text or None"""
         try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+            import PyPDF2
             
-            # Basic PDF info
-            num_pages = len(pdf_reader.pages)
-            analysis = f"📄 **PDF Document Analysis**\n\n"
-            analysis += f"**Document Structure:**\n"
-            analysis += f"• Total Pages: {num_pages}\n"
-            analysis += f"• File Size: {len(file_bytes) / 1024:.1f} KB\n\n"
+            pdf_reader = PyPDF2.PdfReader(upload.stream())
+            result.pages = len(pdf_reader.pages)
             
             # Extract text from first few pages
             extracted_text = ""
-            pages_to_process = min(5, num_pages)
+            result.pages_read = min(5, result.pages)
+            failed_pages = []
             
-            for page_num in range(pages_to_process):
+            for page_num in range(result.pages_read):
                 try:
                     page = pdf_reader.pages[page_num]
                     page_text = page.extract_text()
                     extracted_text += page_text + "\n"
-                except:
-                    continue
+                except Exception:
+                    failed_pages.append(page_num + 1)
+            result.unreadable_pages = tuple(failed_pages)
             
-            if extracted_text.strip():
-                word_count = len(extracted_text.split())
-                char_count = len(extracted_text)
-                
-                analysis += f"**Content Analysis:**\n"
-                analysis += f"• Characters: {char_count:,}\n"
-                analysis += f"• Words: {word_count:,}\n"
-                analysis += f"• Pages Processed: {pages_to_process}\n\n"
-                
-                # Content preview
-                preview = extracted_text[:600] + "..." if len(extracted_text) > 600 else extracted_text
-                analysis += f"**Content Preview:**\n```\n{preview}\n```\n\n"
-                analysis += "**Text Extraction: Successful** ✅"
-            else:
-                analysis += "**Content Status:** No readable text found (may contain images or scanned content)"
-            
-            return analysis
+            return extracted_text if extracted_text.strip() else None
             
         except Exception as e:
-            return f"Error analyzing PDF: {str(e)}"
+            result.error = f"Error analyzing PDF: {str(e)}"
+            return None
     
-    def _process_text(self, file_bytes):
-        """Process text files and analyze content"""
+    def _process_pdf_full(self, upload, result, cancelled=None):
+        """Extract every PDF page in parallel; returns (text or None, index or None)"""
         try:
-            # Detect encoding
-            encoding_info = chardet.detect(file_bytes)
-            encoding = encoding_info.get('encoding', 'utf-8')
+            from utils import pdf_engine
             
-            # Decode text
-            text_content = file_bytes.decode(encoding, errors='ignore')
+            # Workers open the document by path rather than receiving its bytes
+            path = upload.path()
+            num_pages = pdf_engine.count_pages(path)
+            extraction = pdf_engine.PdfExtraction(num_pages)
+            page_texts = []
+            profiler = TextProfiler()
             
-            # Comprehensive text analysis
-            word_count = len(text_content.split())
-            line_count = len(text_content.splitlines())
-            char_count = len(text_content)
+            def pieces():
+                pages = pdf_engine.iter_pages(path, num_pages, cancelled=cancelled)
+                for text in extraction.page_texts(pages):
+                    page_texts.append(text)
+                    profiler.feed(text)
+                    yield text
             
-            analysis = f"📝 **Text Document Analysis**\n\n"
-            analysis += f"**File Properties:**\n"
-            analysis += f"• Encoding: {encoding}\n"
-            analysis += f"• File Size: {len(file_bytes) / 1024:.1f} KB\n"
-            analysis += f"• Text Length: {char_count:,} characters\n\n"
+            # Chunking, indexing and profiling consume pages as they arrive
+            index = TextIndex.from_pieces(pieces())
+            self._check_cancelled(cancelled)
             
-            analysis += f"**Content Statistics:**\n"
-            analysis += f"• Words: {word_count:,}\n"
-            analysis += f"• Lines: {line_count:,}\n"
-            analysis += f"• Average words per line: {word_count/line_count:.1f}\n\n"
+            extracted_text = "".join(page_texts)
+            result.pages = result.pages_read = num_pages
+            result.unreadable_pages = tuple(page for page, _ in extraction.failures)
             
-            # Content preview
-            preview = text_content[:500] + "..." if len(text_content) > 500 else text_content
-            analysis += f"**Content Preview:**\n```\n{preview}\n```\n\n"
-            analysis += "**Text Processing: Complete** ✅"
+            note = "\n\n**Full-Document Extraction:**\n"
+            note += f"• Pages Extracted: {extraction.pages_extracted} of {num_pages}\n"
+            note += f"• Extraction Time: {extraction.elapsed:.2f}s on {pdf_engine.default_workers()} worker process(es)\n"
+            slowest = ", ".join(f"p{page} ({seconds:.2f}s)" for page, seconds in extraction.slowest())
+            if slowest:
+                note += f"• Slowest Pages: {slowest}\n"
+            result.notes.append(note)
             
-            return analysis
+            if extracted_text.strip():
+                result.text, result.profile = profiler.finish()
+                return extracted_text, index
+            return None, None
             
+        except CancelledError:
+            raise
         except Exception as e:
-            return f"Error analyzing text file: {str(e)}"
+            result.error = f"Error analyzing PDF: {str(e)}"
+            return None, None
+    
+    def _process_text(self, upload, result, cancelled=None):
+        """Decode a text file; returns the text, or None if it was streamed into the result
+        
+        Logs and source code are read line by line into a LogAnalyzer or
+        SourceOutliner, with the profile and index built in the same pass,
+        so the whole file is never decoded into one string.
+        """
+        try:
+            import chardet
+            
+            # Detect encoding from a sample rather than the whole file
+            sample = upload.head(64 * 1024)
+            encoding_info = chardet.detect(sample)
+            result.encoding = encoding_info.get('encoding') or 'utf-8'
+            
+            sample_lines = str(sample, result.encoding, errors='ignore').splitlines()[:200]
+            if looks_like_log(sample_lines):
+                analyzer = LogAnalyzer()
+            else:
+                language = source_language(upload.name, sample_lines)
+                analyzer = SourceOutliner(language) if language else None
+            if analyzer is not None:
+                self._stream_text(upload, result, analyzer, cancelled)
+                return None
+            
+            # Decode straight from the buffer without an intermediate bytes copy
+            return str(upload.view(), result.encoding, errors='ignore')
+            
+        except CancelledError:
+            raise
+        except Exception as e:
+            result.error = f"Error analyzing text file: {str(e)}"
+            return None
+    
+    def _stream_text(self, upload, result, analyzer, cancelled=None, block_size=1024 * 1024):
+        """Decode a text file in blocks, feeding ``analyzer`` whole lines while profiling and indexing
+        
+        Only files up to TEXT_INDEX_MAX_MB are indexed in full. Every chunk of
+        a bigger one would stay in memory and in the caches, so its index
+        holds the analyzer's excerpts instead: log templates with example
+        lines and error bursts, or the source outline.
+        """
+        profiler = TextProfiler()
+        
+        def pieces():
+            stream = upload.stream()
+            if isinstance(stream, io.RawIOBase):
+                stream = io.BufferedReader(stream)
+            partial = ""
+            with io.TextIOWrapper(stream, encoding=result.encoding, errors='ignore', newline='') as reader:
+                for block in iter(lambda: reader.read(block_size), ""):
+                    self._check_cancelled(cancelled)
+                    profiler.feed(block)
+                    lines = (partial + block).split("\n")
+                    partial = lines.pop()
+                    analyzer.feed_lines(lines)
+                    yield block
+            if partial:
+                analyzer.feed(partial)
+        
+        if upload.size <= self.max_stream_index_bytes:
+            index = TextIndex.from_pieces(pieces())
+            result.structure = analyzer.finish()
+        else:
+            for _ in pieces():
+                pass
+            result.structure = analyzer.finish()
+            index = TextIndex.from_text(result.structure.excerpts())
+            covered = "log templates and error bursts" if isinstance(analyzer, LogAnalyzer) else "outline"
+            result.notes.append(f"\n\n**Search Index:** {covered} only; the file is over "
+                                f"{self.max_stream_index_bytes / (1024 * 1024):g} MB\n")
+        if profiler.characters:
+            result.text, result.profile = profiler.finish()
+            result.index = index
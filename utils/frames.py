@@ -0,0 +1,193 @@
+"""
+Frame sampling for animated and multi-frame images.
+
+Instead of forwarding a whole GIF to the vision model, every frame is
+downscaled to a small grayscale thumbnail and compared with the last kept
+frame; frames where the picture changes enough count as scene changes.
+A bounded number of them is composed into one labelled contact sheet,
+which is cached on disk by content hash.
+"""
+
+import io
+import json
+import math
+import os
+import time
+from concurrent.futures import CancelledError
+
+# Side of the grayscale thumbnails used for change detection
+PROBE_SIDE = 48
+
+
+class FrameSample:
+    """Contact sheet and the frames it shows"""
+
+    def __init__(self, mime_type, image_bytes, frames, total_frames, duration, elapsed=0.0, cached=False):
+        self.mime_type = mime_type
+        self.image_bytes = image_bytes
+        self.frames = frames  # [(0-based frame index, start time in seconds)]
+        self.total_frames = total_frames
+        self.duration = duration
+        self.elapsed = elapsed
+        self.cached = cached
+
+    def summary(self):
+        """Markdown section for the analysis report"""
+        text = "\n\n**Animation Sampling:**\n"
+        text += f"• Frames: {self.total_frames} ({self.duration:.1f}s)\n"
+        text += f"• Sampled Scenes: {len(self.frames)} — "
+        text += ", ".join(f"#{index + 1} @ {start:.1f}s" for index, start in self.frames) + "\n"
+        text += "• Sent As: one contact sheet, frames in reading order\n"
+        text += f"• Sampling Time: {self.elapsed:.2f}s" + (" (cached)\n" if self.cached else "\n")
+        return text
+
+
+def compose_grid(images, labels=None, max_side=2048, tile_side=512, background=(32, 32, 32)):
+    """Tile PIL images into one labelled grid, at most ``max_side`` pixels wide"""
+    from PIL import Image, ImageDraw
+
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    tile = min(tile_side, max_side // columns, max_side // rows)
+    sheet = Image.new('RGB', (columns * tile, rows * tile), background)
+    draw = ImageDraw.Draw(sheet)
+
+    for position, image in enumerate(images):
+        thumb = image.convert('RGB')
+        thumb.thumbnail((tile, tile))
+        x = (position % columns) * tile + (tile - thumb.width) // 2
+        y = (position // columns) * tile + (tile - thumb.height) // 2
+        sheet.paste(thumb, (x, y))
+        if labels:
+            left, top = (position % columns) * tile, (position // columns) * tile
+            box = draw.textbbox((left + 4, top + 4), labels[position])
+            draw.rectangle((box[0] - 3, box[1] - 3, box[2] + 3, box[3] + 3), fill=(0, 0, 0))
+            draw.text((left + 4, top + 4), labels[position], fill=(255, 255, 255))
+    return sheet
+
+
+def scene_changes(image, max_frames, threshold, max_scan, cancelled=None, min_frames=3):
+    """Pick up to ``max_frames`` frame indices where the picture changes most
+
+    Returns (indices, start times, frames scanned, total duration). The
+    first frame is always kept; later frames are kept when their mean
+    absolute difference from the last kept frame is at least ``threshold``
+    (0-1). If there are more candidates than ``max_frames``, the biggest
+    changes win. Animations with fewer scene changes than ``min_frames``
+    (e.g. motion on a static background) are topped up with evenly spaced
+    frames so the motion is still visible.
+    """
+    import numpy as np
+    from PIL import Image
+
+    total = getattr(image, 'n_frames', 1)
+    scanned = min(total, max_scan)
+    # Skip frames evenly when the animation is longer than the scan budget
+    step = total / scanned
+
+    starts = []
+    clock = 0.0
+    candidates = []  # (change score, frame index)
+    last = None
+    for position in range(scanned):
+        if cancelled is not None and cancelled.is_set():
+            raise CancelledError()
+        index = int(position * step)
+        image.seek(index)
+        starts.append((index, clock))
+        clock += (image.info.get('duration') or 100) / 1000 * step
+
+        probe = image.convert('L').resize((PROBE_SIDE, PROBE_SIDE), Image.BILINEAR)
+        pixels = np.asarray(probe, dtype=np.float32)
+        if last is None:
+            candidates.append((float('inf'), index))
+            last = pixels
+            continue
+        change = float(np.abs(pixels - last).mean()) / 255.0
+        if change >= threshold:
+            candidates.append((change, index))
+            last = pixels
+
+    kept = {index for _, index in sorted(candidates, reverse=True)[:max_frames]}
+    wanted = min(min_frames, max_frames, scanned)
+    for position in range(wanted):
+        if len(kept) >= wanted:
+            break
+        kept.add(starts[position * scanned // wanted][0])
+    kept = sorted(kept)
+    start_of = dict(starts)
+    return kept, [start_of[index] for index in kept], scanned, clock
+
+
+class FrameSampler:
+    """Samples animations into contact sheets, with an on-disk cache"""
+
+    def __init__(self, max_frames=None, threshold=None, max_scan=None, max_side=2048, cache_dir=None):
+        self.max_frames = int(max_frames or os.getenv("FRAME_MAX", "9"))
+        self.threshold = float(threshold or os.getenv("FRAME_CHANGE_THRESHOLD", "0.08"))
+        self.max_scan = int(max_scan or os.getenv("FRAME_MAX_SCAN", "500"))
+        self.max_side = max_side
+        self.cache_dir = cache_dir or os.getenv("FRAME_CACHE_DIR") or os.path.join(
+            os.getenv("UPLOAD_DIR", "uploads"), "frame_cache")
+
+    def _cache_key(self, upload):
+        return f"{upload.sha256()[:32]}-{self.max_frames}-{self.threshold}-{self.max_side}"
+
+    def _cache_get(self, key):
+        try:
+            with open(os.path.join(self.cache_dir, key + ".json"), encoding='utf-8') as handle:
+                meta = json.load(handle)
+            with open(os.path.join(self.cache_dir, key + ".jpg"), 'rb') as handle:
+                image_bytes = handle.read()
+        except (OSError, ValueError):
+            return None
+        return FrameSample('image/jpeg', image_bytes, [tuple(frame) for frame in meta['frames']],
+                           meta['total_frames'], meta['duration'], cached=True)
+
+    def _cache_put(self, key, sample):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            meta = {'frames': sample.frames, 'total_frames': sample.total_frames, 'duration': sample.duration}
+            # Image first, then metadata, each written then renamed, so a
+            # readable .json always has its .jpg
+            for suffix, payload in ((".jpg", sample.image_bytes), (".json", json.dumps(meta).encode('utf-8'))):
+                path = os.path.join(self.cache_dir, key + suffix)
+                with open(path + ".tmp", 'wb') as handle:
+                    handle.write(payload)
+                os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def sample(self, upload, cancelled=None):
+        """FrameSample for an animated UploadBuffer, or None for a still image"""
+        from PIL import Image
+
+        image = Image.open(upload.stream())
+        if getattr(image, 'n_frames', 1) < 2:
+            return None
+
+        start = time.perf_counter()
+        key = self._cache_key(upload)
+        cached = self._cache_get(key)
+        if cached is not None:
+            cached.elapsed = time.perf_counter() - start
+            return cached
+
+        indices, starts, _, duration = scene_changes(
+            image, self.max_frames, self.threshold, self.max_scan, cancelled
+        )
+        frames = []
+        for index in indices:
+            image.seek(index)
+            frames.append(image.convert('RGB'))
+        labels = [f"#{index + 1}  {at:.1f}s" for index, at in zip(indices, starts)]
+        sheet = compose_grid(frames, labels, max_side=self.max_side)
+
+        output = io.BytesIO()
+        sheet.save(output, format='JPEG', quality=80)
+        sample = FrameSample(
+            'image/jpeg', output.getvalue(), list(zip(indices, starts)), image.n_frames, duration,
+            elapsed=time.perf_counter() - start
+        )
+        self._cache_put(key, sample)
+        return sample
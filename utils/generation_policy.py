@@ -0,0 +1,156 @@
+"""
+Per-intent generation limits that adapt to observed answer lengths.
+
+A fixed ``max_tokens=1000`` lets rambling answers run long and reserves
+rate-limit budget (providers count prompt + max_tokens against the
+tokens-per-minute limit) that short answers never use. Each request is
+classified into an intent (short Q&A, summary, code, writing, image
+description) with its own token limit and stop sequences. Once enough
+answers of an intent have been seen, its limit follows their 95th
+percentile length plus headroom; answers cut off by the limit count as
+longer than they were, so a limit that truncates too often grows again.
+
+Defaults can be tuned with ``GENERATION_POLICY``, a JSON object such as
+``{"qa": {"max_tokens": 300}, "code": {"stop": []}}``; set
+``GENERATION_ADAPTIVE=0`` to use the configured limits as they are.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import deque
+
+# Lines where a model starts writing the next chat turn itself (common with local models)
+TURN_STOPS = ["\nUser:", "\nHuman:"]
+
+TOKENS_PER_WORD = 1.35
+
+INTENT_PATTERNS = (
+    ('code', re.compile(
+        r"```|\b(code|function|script|class|method|bug|debug|stack ?trace|traceback|compile|regex|sql|"
+        r"python|javascript|typescript|java|rust|golang|c\+\+|html|css|api|implement|refactor)\b"
+    )),
+    ('summary', re.compile(r"\b(summar\w*|tl;?dr|overview|key points|gist|recap|outline|main points)\b")),
+    ('writing', re.compile(
+        r"\b(write|draft|compose|essay|article|story|blog|poem|letter|cover letter|report|"
+        r"in detail|detailed|step[- ]by[- ]step|comprehensive|elaborate)\b"
+    )),
+)
+
+
+def classify_intent(prompt, has_images=False):
+    """Intent of a request: 'code', 'summary', 'writing', 'image' or 'qa'"""
+    text = (prompt or "").lower()
+    for intent, pattern in INTENT_PATTERNS:
+        if pattern.search(text):
+            return intent
+    return 'image' if has_images else 'qa'
+
+
+class IntentPolicy:
+    """Limits for one intent plus a window of observed completion lengths"""
+
+    def __init__(self, max_tokens, floor, ceiling, stop=None, adaptive=True, window=200):
+        self.max_tokens = max_tokens  # configured limit, used until enough samples are in
+        self.floor = floor
+        self.ceiling = ceiling
+        self.stop = list(TURN_STOPS if stop is None else stop)
+        self.adaptive = adaptive
+        self.lengths = deque(maxlen=window)
+        self.requests = 0
+        self.truncated = 0
+
+    def percentile(self, fraction):
+        ordered = sorted(self.lengths)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+
+    def limit(self, min_samples, headroom):
+        """Current max_tokens"""
+        if not self.adaptive or len(self.lengths) < min_samples:
+            return self.max_tokens
+        return max(self.floor, min(self.ceiling, math.ceil(self.percentile(0.95) * headroom)))
+
+
+DEFAULT_INTENTS = {
+    # intent: (max_tokens, floor, ceiling)
+    'qa': (400, 64, 1000),
+    'summary': (500, 96, 1000),
+    'code': (1500, 256, 4000),
+    'writing': (1200, 256, 3000),
+    'image': (500, 96, 1000),
+}
+
+
+class GenerationPolicy:
+    """Chooses max_tokens and stop sequences per intent and learns from usage"""
+
+    def __init__(self, overrides=None, adaptive=None, min_samples=None, headroom=None):
+        if overrides is None:
+            overrides = json.loads(os.getenv("GENERATION_POLICY") or "{}")
+        if adaptive is None:
+            adaptive = os.getenv("GENERATION_ADAPTIVE", "1") == "1"
+        self.min_samples = int(min_samples or os.getenv("GENERATION_MIN_SAMPLES", "20"))
+        self.headroom = float(headroom or os.getenv("GENERATION_HEADROOM", "1.25"))
+        self._lock = threading.Lock()
+        self.intents = {}
+        for intent, (max_tokens, floor, ceiling) in DEFAULT_INTENTS.items():
+            settings = overrides.get(intent, {})
+            self.intents[intent] = IntentPolicy(
+                max_tokens=int(settings.get('max_tokens', max_tokens)),
+                floor=int(settings.get('floor', floor)),
+                ceiling=int(settings.get('ceiling', max(ceiling, settings.get('max_tokens', 0)))),
+                stop=settings.get('stop'),
+                adaptive=settings.get('adaptive', adaptive),
+            )
+
+    def classify(self, prompt, has_images=False):
+        return classify_intent(prompt, has_images)
+
+    def plan(self, intent, target_words=None):
+        """Request parameters for ``intent``: max_tokens and, if any, stop
+
+        ``target_words`` is the answer length the prompt asks for (as in
+        summarize_text); the limit then leaves room for that many words.
+        """
+        policy = self.intents[intent]
+        with self._lock:
+            max_tokens = policy.limit(self.min_samples, self.headroom)
+        if target_words:
+            max_tokens = max(max_tokens, math.ceil(target_words * TOKENS_PER_WORD * self.headroom))
+        plan = {'max_tokens': max_tokens}
+        if policy.stop:
+            # The API accepts at most four stop sequences
+            plan['stop'] = policy.stop[:4]
+        return plan
+
+    def observe(self, intent, completion_tokens, truncated=False, max_tokens=None):
+        """Record the length of a finished answer"""
+        if intent not in self.intents or completion_tokens is None:
+            return
+        policy = self.intents[intent]
+        with self._lock:
+            policy.requests += 1
+            if truncated:
+                policy.truncated += 1
+                # The answer wanted to be longer than the limit; assume half as much again
+                completion_tokens = math.ceil(max(completion_tokens, max_tokens or 0) * 1.5)
+            policy.lengths.append(completion_tokens)
+
+    def stats(self):
+        """Current limit and observed lengths per intent"""
+        with self._lock:
+            return {
+                intent: {
+                    'max_tokens': policy.limit(self.min_samples, self.headroom),
+                    'adaptive': policy.adaptive,
+                    'stop': policy.stop,
+                    'requests': policy.requests,
+                    'samples': len(policy.lengths),
+                    'p50_tokens': policy.percentile(0.5),
+                    'p95_tokens': policy.percentile(0.95),
+                    'truncated_rate': round(policy.truncated / policy.requests, 3) if policy.requests else 0.0,
+                }
+                for intent, policy in self.intents.items()
+            }
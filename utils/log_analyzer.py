@@ -0,0 +1,358 @@
+"""
+Streaming summary of log files.
+
+Lines are clustered into templates the way Drain does it: the message
+(after the timestamp and level) is split into tokens, tokens containing
+digits are masked as ``<*>``, and a fixed-depth tree keyed by token count
+and the first tokens leads to a short list of templates. The line joins the
+template most similar to it (positions that differ become ``<*>``), or
+starts a new one. Next to the templates the analyzer keeps the time range,
+counts per level and minutes with unusually many errors (bursts).
+
+Memory stays bounded however long the log is: at most ``LOG_MAX_TEMPLATES``
+templates, a fixed-size cache of masked messages, and only the top error
+bursts. Stack-trace continuation lines are counted against the line they
+belong to instead of being templated.
+"""
+
+import datetime
+import heapq
+import os
+import re
+from collections import Counter
+
+WILDCARD = "<*>"
+
+TIME_RE = re.compile(
+    r"(?P<iso>(?P<date>\d{4}-\d{2}-\d{2})[T ](?P<h>\d{2}):(?P<m>\d{2}):(?P<s>\d{2}))"
+    r"|\[(?P<clf>(?P<cday>\d{2})/(?P<cmon>[A-Z][a-z]{2})/(?P<cyear>\d{4}):(?P<ch>\d{2}):(?P<cm>\d{2}):(?P<cs>\d{2}))"
+    r"|^(?P<syslog>(?P<smon>[A-Z][a-z]{2}) +(?P<sday>\d{1,2}) (?P<sh>\d{2}):(?P<sm>\d{2}):(?P<ss>\d{2}))"
+)
+# Upper or lower case only: "Error" is more often a word in the message than a level
+LEVEL_RE = re.compile(
+    r"\b(TRACE|DEBUG|INFO|NOTICE|WARN|WARNING|ERROR|ERR|SEVERE|CRITICAL|FATAL|PANIC"
+    r"|trace|debug|info|notice|warn|warning|error|err|severe|critical|fatal|panic)\b"
+)
+LEVELS = {
+    'TRACE': 'TRACE', 'DEBUG': 'DEBUG', 'INFO': 'INFO', 'NOTICE': 'INFO', 'WARN': 'WARNING',
+    'WARNING': 'WARNING', 'ERROR': 'ERROR', 'ERR': 'ERROR', 'SEVERE': 'ERROR', 'CRITICAL': 'CRITICAL',
+    'FATAL': 'CRITICAL', 'PANIC': 'CRITICAL',
+}
+ERROR_LEVELS = frozenset(('ERROR', 'CRITICAL'))
+# Tokens with digits (ids, numbers, addresses, times) are variables
+MASK_RE = re.compile(r"(?<!\S)[^\s\d]*\d\S*")
+CONTINUATION_RE = re.compile(r"[ \t]|at |Traceback|Caused by|\.\.\. \d+ more|File \"")
+MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+# Where the timestamp and level of a line are looked for
+HEADER_CHARS = 120
+# Tokens of a message that are templated; the rest is dropped
+MAX_TOKENS = 48
+# Minutes of errors seen before bursts are looked for
+BURST_WARMUP = 5
+
+
+def looks_like_log(lines):
+    """Whether most non-blank sample lines start with a timestamp or a level"""
+    lines = [line for line in lines if line.strip()]
+    if len(lines) < 5:
+        return False
+    stamped = sum(1 for line in lines
+                  if TIME_RE.search(line, 0, 48) or LEVEL_RE.match(line.lstrip("[ ")))
+    return stamped >= 0.5 * len(lines)
+
+
+class LogTemplate:
+    __slots__ = ('tokens', 'count', 'errors', 'example')
+
+    def __init__(self, tokens, example):
+        self.tokens = tokens
+        self.count = 0
+        self.errors = 0
+        self.example = example[:200]
+
+    @property
+    def text(self):
+        return " ".join(self.tokens)
+
+    def similarity(self, tokens):
+        """(matching tokens / length, wildcards), Drain's simSeq"""
+        same = wildcards = 0
+        for mine, theirs in zip(self.tokens, tokens):
+            if mine == WILDCARD:
+                wildcards += 1
+            elif mine == theirs:
+                same += 1
+        return same / len(tokens), wildcards
+
+    def merge(self, tokens):
+        if any(mine != theirs and mine != WILDCARD for mine, theirs in zip(self.tokens, tokens)):
+            self.tokens = tuple(mine if mine == theirs else WILDCARD for mine, theirs in zip(self.tokens, tokens))
+
+
+class LogSummary:
+    """What a log contains: time range, levels, templates and error bursts"""
+
+    __slots__ = ('lines', 'timestamped', 'continuation', 'first', 'last', 'levels',
+                 'templates', 'template_count', 'unmatched', 'bursts')
+
+    def __init__(self):
+        self.lines = self.timestamped = self.continuation = 0
+        self.first = self.last = None  # display strings
+        self.levels = {}
+        self.templates = []  # (template, count, errors, example), most frequent first
+        self.template_count = 0
+        self.unmatched = 0
+        self.bursts = []  # (start, end, errors), most errors first
+
+    def digest(self):
+        """One line for the prompt"""
+        parts = [f"log of {self.lines:,} lines"]
+        if self.first:
+            parts.append(f"{self.first} to {self.last}")
+        if self.levels:
+            parts.append(", ".join(f"{level} {count:,}" for level, count in self.levels.items()))
+        if self.templates:
+            top = " | ".join(f"\"{template[:70]}\" x{count:,}" for template, count, _, _ in self.templates[:5])
+            parts.append(f"{self.template_count:,} templates, top: {top}")
+        errors = [(template, errors) for template, _, errors, _ in self.templates if errors]
+        if errors:
+            errors.sort(key=lambda item: -item[1])
+            parts.append("top errors: " + " | ".join(f"\"{template[:70]}\" x{count:,}"
+                                                      for template, count in errors[:3]))
+        if self.bursts:
+            parts.append("error bursts: " + ", ".join(f"{start} to {end} ({errors:,} errors)"
+                                                       for start, end, errors in self.bursts[:3]))
+        return "; ".join(parts)
+
+    def excerpts(self):
+        """Text to search instead of a log too big to index: templates with example lines, and bursts"""
+        lines = [f"{template} (x{count}, {errors} errors)\n{example}"
+                 for template, count, errors, example in self.templates]
+        lines += [f"Error burst {start} to {end}: {errors} errors" for start, end, errors in self.bursts]
+        return "\n\n".join(lines)
+
+    def markdown(self):
+        """Report section for the UI"""
+        section = "\n\n**Log Analysis:**\n"
+        section += f"• Lines: {self.lines:,} ({self.timestamped:,} timestamped, "
+        section += f"{self.continuation:,} continuation)\n"
+        if self.first:
+            section += f"• Time Range: {self.first} to {self.last}\n"
+        if self.levels:
+            section += "• Levels: " + ", ".join(f"{level} {count:,}" for level, count in self.levels.items()) + "\n"
+        section += f"• Templates: {self.template_count:,}"
+        if self.unmatched:
+            section += f" ({self.unmatched:,} lines over the template limit)"
+        section += "\n"
+        for start, end, errors in self.bursts:
+            section += f"• Error Burst: {start} to {end}, {errors:,} errors\n"
+        if self.templates:
+            section += "\n| Count | Errors | Template |\n|---:|---:|---|\n"
+            for template, count, errors, _ in self.templates[:15]:
+                escaped = template[:120].replace("|", "\\|")
+                section += f"| {count:,} | {errors:,} | `{escaped}` |\n"
+        return section
+
+
+class LogAnalyzer:
+    """Feed lines one at a time (or in lists); finish() returns a LogSummary"""
+
+    def __init__(self, depth=2, similarity=None, max_children=100, max_templates=None,
+                 cache_size=50000, top_bursts=5):
+        self.depth = depth
+        self.similarity = float(similarity or os.getenv("LOG_TEMPLATE_SIMILARITY", "0.5"))
+        self.max_children = max_children
+        self.max_templates = int(max_templates or os.getenv("LOG_MAX_TEMPLATES", "2000"))
+        self.cache_size = cache_size
+        self.top_bursts = top_bursts
+        self.summary = LogSummary()
+        self.levels = Counter()
+        self._leaves = {}       # (token count, first tokens...) -> [LogTemplate]
+        self._fanout = Counter()  # tree node -> children
+        self._nodes = set()
+        self._cache = {}        # masked message -> LogTemplate
+        self._templates = []
+        self._dates = {}
+        self._minutes_seen = {}  # timestamp up to the minute -> minute number
+        self._year = None       # syslog lines carry no year
+        self.first = self.last = None
+        # Error-burst detection over minutes
+        self._minute = None
+        self._minute_errors = 0
+        self._baseline = 0.0
+        self._minutes = 0
+        self._burst = None      # [start minute, end minute, errors]
+        self._bursts = []       # heap of (errors, start, end)
+
+    def feed_lines(self, lines):
+        for line in lines:
+            self.feed(line)
+
+    def feed(self, line):
+        summary = self.summary
+        summary.lines += 1
+        line = line.rstrip("\r\n")
+        if not line or line.isspace():
+            return
+        match = TIME_RE.search(line, 0, 48)
+        level_match = LEVEL_RE.search(line, 0, HEADER_CHARS)
+        if match is None and level_match is None and CONTINUATION_RE.match(line):
+            summary.continuation += 1
+            return
+
+        level = LEVELS[level_match.group(1).upper()] if level_match else None
+        if level:
+            self.levels[level] += 1
+        error = level in ERROR_LEVELS
+        if match is not None:
+            stamp = match.group(0)
+            # Every format ends in ":ss"; the rest changes once a minute
+            minute = self._minutes_seen.get(stamp[:-3])
+            if minute is None:
+                seconds = self._seconds(match)
+                minute = None if seconds is None else seconds // 60
+                if len(self._minutes_seen) >= 10000:
+                    self._minutes_seen.clear()
+                self._minutes_seen[stamp[:-3]] = minute
+            if minute is not None:
+                summary.timestamped += 1
+                seconds = minute * 60 + int(stamp[-2:])
+                if self.first is None or seconds < self.first[0]:
+                    self.first = (seconds, stamp)
+                if self.last is None or seconds >= self.last[0]:
+                    self.last = (seconds, stamp)
+                self._count_minute(minute, error)
+
+        # Template the message after the header
+        start = max(match.end() if match else 0, level_match.end() if level_match else 0)
+        template = self._template(line[start:].lstrip(" \t]:-|"))
+        if template is None:
+            summary.unmatched += 1
+            return
+        template.count += 1
+        if error:
+            template.errors += 1
+
+    def _seconds(self, match):
+        """Seconds since year 1 of a timestamp match, None if it does not parse"""
+        group = match.group
+        try:
+            if match.lastgroup == 'iso':
+                date = group('date')
+                ordinal = self._dates.get(date)
+                if ordinal is None:
+                    ordinal = self._dates[date] = datetime.date.fromisoformat(date).toordinal()
+                hours, minutes, seconds = group('h', 'm', 's')
+            elif match.lastgroup == 'clf':
+                ordinal = datetime.date(int(group('cyear')), MONTHS[group('cmon')], int(group('cday'))).toordinal()
+                hours, minutes, seconds = group('ch', 'cm', 'cs')
+            else:
+                if self._year is None:
+                    self._year = datetime.date.today().year
+                ordinal = datetime.date(self._year, MONTHS[group('smon')], int(group('sday'))).toordinal()
+                hours, minutes, seconds = group('sh', 'sm', 'ss')
+        except (KeyError, ValueError):
+            return None
+        return ordinal * 86400 + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+    def _template(self, message):
+        key = MASK_RE.sub(WILDCARD, message)
+        template = self._cache.get(key)
+        if template is not None:
+            # Already merged with this exact masked message
+            return template
+        tokens = tuple(key.split()[:MAX_TOKENS]) or (WILDCARD,)
+
+        # Descend the fixed-depth tree: token count, then the first tokens
+        node = (len(tokens),)
+        for token in tokens[:self.depth]:
+            child = node + (token,)
+            if child not in self._nodes:
+                if WILDCARD in token or self._fanout[node] >= self.max_children:
+                    child = node + (WILDCARD,)
+                if child not in self._nodes:
+                    self._nodes.add(child)
+                    self._fanout[node] += 1
+            node = child
+        leaf = self._leaves.setdefault(node, [])
+
+        best, best_score = None, (-1.0, -1)
+        for candidate in leaf:
+            score = candidate.similarity(tokens)
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is not None and (best_score[0] >= self.similarity or len(self._templates) >= self.max_templates):
+            best.merge(tokens)
+            template = best
+        elif len(self._templates) < self.max_templates:
+            template = LogTemplate(tokens, message)
+            leaf.append(template)
+            self._templates.append(template)
+        else:
+            return None
+
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[key] = template
+        return template
+
+    def _count_minute(self, minute, error):
+        if self._minute is None:
+            self._minute = minute
+        if minute > self._minute:
+            self._close_minute()
+            self._minute = minute
+        if error:
+            self._minute_errors += 1
+
+    def _close_minute(self):
+        errors = self._minute_errors
+        self._minute_errors = 0
+        self._minutes += 1
+        # A burst is a minute with five times the usual errors, once there is a usual
+        if self._minutes > BURST_WARMUP and errors >= max(10, 5 * self._baseline):
+            if self._burst is not None and self._burst[1] == self._minute - 1:
+                self._burst[1] = self._minute
+                self._burst[2] += errors
+            else:
+                self._end_burst()
+                self._burst = [self._minute, self._minute, errors]
+            return
+        self._end_burst()
+        # Errors per minute outside bursts: a running mean at first, then exponentially weighted
+        self._baseline += max(0.05, 1 / self._minutes) * (errors - self._baseline)
+
+    def _end_burst(self):
+        if self._burst is not None:
+            start, end, errors = self._burst
+            item = (errors, start, end)
+            if len(self._bursts) < self.top_bursts:
+                heapq.heappush(self._bursts, item)
+            else:
+                heapq.heappushpop(self._bursts, item)
+            self._burst = None
+
+    def finish(self):
+        summary = self.summary
+        if self._minute is not None:
+            self._close_minute()
+            self._end_burst()
+        if self.first is not None:
+            summary.first, summary.last = self.first[1], self.last[1]
+        order = ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE')
+        summary.levels = {level: self.levels[level] for level in order if self.levels[level]}
+        templates = sorted(self._templates, key=lambda template: -template.count)
+        summary.template_count = len(templates)
+        summary.templates = [(template.text, template.count, template.errors, template.example)
+                             for template in templates[:50]]
+        summary.bursts = [(_minute_text(start), _minute_text(end + 1), errors)
+                          for errors, start, end in sorted(self._bursts, reverse=True)]
+        return summary
+
+
+def _minute_text(minute):
+    seconds = minute * 60
+    day = datetime.date.fromordinal(seconds // 86400)
+    return f"{day.isoformat()} {seconds % 86400 // 3600:02d}:{seconds % 3600 // 60:02d}"
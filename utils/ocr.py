@@ -0,0 +1,190 @@
+"""
+Local OCR for scanned PDFs and text in images.
+
+Uses the ``pdftoppm`` (poppler) and ``tesseract`` command line tools, so
+no API round-trips are needed. PDF pages are rasterized at a bounded DPI
+and recognized on the shared process pool from ``utils.pdf_engine``, with
+a page budget per document. Recognized text is cached on disk by a hash
+of the page's content, so the same scan is never OCR'd twice.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import CancelledError
+
+MAX_DPI = 300
+
+
+def ocr_pdf_page(path, page_number, dpi, language, timeout):
+    """Worker: rasterize one 0-based PDF page and OCR it"""
+    # One tesseract thread per worker; parallelism comes from the pool
+    env = dict(os.environ, OMP_THREAD_LIMIT="1")
+    with tempfile.TemporaryDirectory() as workdir:
+        prefix = os.path.join(workdir, "page")
+        subprocess.run(
+            ["pdftoppm", "-f", str(page_number + 1), "-l", str(page_number + 1),
+             "-r", str(dpi), "-gray", "-png", "-singlefile", path, prefix],
+            check=True, capture_output=True, timeout=timeout
+        )
+        output = subprocess.run(
+            ["tesseract", prefix + ".png", "stdout", "-l", language],
+            check=True, capture_output=True, timeout=timeout, env=env
+        )
+    return output.stdout.decode('utf-8', errors='ignore')
+
+
+def page_fingerprint(page):
+    """Hash of a PyPDF2 page's content stream and embedded images"""
+    digest = hashlib.sha256()
+    try:
+        contents = page.get_contents()
+        if contents is not None:
+            digest.update(contents.get_data())
+        resources = page.get('/Resources') or {}
+        xobjects = resources.get('/XObject') or {}
+        for name in sorted(xobjects):
+            xobject = xobjects[name].get_object()
+            # Raw (still encoded) stream bytes are enough to identify the image
+            digest.update(getattr(xobject, '_data', b'') or b'')
+    except Exception:
+        return None
+    return digest.hexdigest()
+
+
+class OcrEngine:
+    """OCR with a page budget and an on-disk result cache"""
+
+    def __init__(self, dpi=None, max_pages=None, language=None, cache_dir=None, timeout=120):
+        self.dpi = min(int(dpi or os.getenv("OCR_DPI", "200")), MAX_DPI)
+        self.max_pages = int(max_pages or os.getenv("OCR_MAX_PAGES", "20"))
+        self.language = language or os.getenv("OCR_LANGUAGE", "eng")
+        self.cache_dir = cache_dir or os.getenv("OCR_CACHE_DIR") or os.path.join(
+            os.getenv("UPLOAD_DIR", "uploads"), "ocr_cache")
+        self.timeout = timeout
+        self.enabled = os.getenv("OCR_ENABLED", "1") == "1"
+
+    @property
+    def available(self):
+        """Whether OCR is enabled and the tesseract binary is installed"""
+        return self.enabled and shutil.which("tesseract") is not None
+
+    @property
+    def pdf_available(self):
+        """Whether scanned PDFs can be OCR'd (also needs pdftoppm)"""
+        return self.available and shutil.which("pdftoppm") is not None
+
+    def _cache_path(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}-{self.dpi}-{self.language}.txt")
+
+    def _cache_get(self, fingerprint):
+        if not fingerprint:
+            return None
+        try:
+            with open(self._cache_path(fingerprint), encoding='utf-8') as handle:
+                return handle.read()
+        except OSError:
+            return None
+
+    def _cache_put(self, fingerprint, text):
+        if not fingerprint:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._cache_path(fingerprint)
+            # Write then rename so readers never see a partial file
+            with open(path + ".tmp", 'w', encoding='utf-8') as handle:
+                handle.write(text)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def ocr_pdf(self, upload, cancelled=None):
+        """OCR the first ``max_pages`` pages of an UploadBuffer; returns (text or None, Markdown summary)"""
+        import PyPDF2
+
+        from utils import pdf_engine
+
+        start = time.perf_counter()
+        reader = PyPDF2.PdfReader(upload.stream())
+        num_pages = len(reader.pages)
+        budget = min(num_pages, self.max_pages)
+        fingerprints = [page_fingerprint(reader.pages[n]) for n in range(budget)]
+
+        texts = {}
+        cached = 0
+        failures = []
+        for page_number, fingerprint in enumerate(fingerprints):
+            text = self._cache_get(fingerprint)
+            if text is not None:
+                texts[page_number] = text
+                cached += 1
+
+        pending = [n for n in range(budget) if n not in texts]
+        if pending:
+            # Workers rasterize from the upload's file rather than receiving its bytes
+            path = upload.path()
+            pool = pdf_engine.get_pool()
+            futures = {
+                n: pool.submit(ocr_pdf_page, path, n, self.dpi, self.language, self.timeout)
+                for n in pending
+            }
+            for page_number, future in futures.items():
+                try:
+                    # Short waits, so a cancelled upload stops without waiting out the page
+                    while True:
+                        if cancelled is not None and cancelled.is_set():
+                            for remaining in futures.values():
+                                remaining.cancel()
+                            raise CancelledError()
+                        try:
+                            texts[page_number] = future.result(timeout=0.2)
+                            break
+                        except TimeoutError:
+                            continue
+                    self._cache_put(fingerprints[page_number], texts[page_number])
+                except CancelledError:
+                    raise
+                except Exception as e:
+                    failures.append((page_number + 1, str(e)))
+
+        pages = [texts[n] for n in sorted(texts) if texts[n].strip()]
+        text = "\n".join(pages)
+
+        summary = "\n\n**OCR Fallback:**\n"
+        summary += f"• Pages Recognized: {len(pages)} of {num_pages}"
+        summary += f" (limit {self.max_pages})\n" if num_pages > budget else "\n"
+        summary += f"• From Cache: {cached}\n"
+        summary += f"• Resolution: {self.dpi} DPI\n"
+        summary += f"• OCR Time: {time.perf_counter() - start:.2f}s\n"
+        if failures:
+            summary += f"• Failed Pages: {', '.join(str(page) for page, _ in failures)}\n"
+        if text.strip():
+            preview = text[:600] + "..." if len(text) > 600 else text
+            summary += f"\n**OCR Text Preview:**\n```\n{preview}\n```\n"
+        return (text if text.strip() else None), summary
+
+    def ocr_image(self, file_bytes):
+        """Text found in an image, or None"""
+        fingerprint = hashlib.sha256(file_bytes).hexdigest()
+        cached = self._cache_get(fingerprint)
+        if cached is not None:
+            return cached or None
+
+        env = dict(os.environ, OMP_THREAD_LIMIT="1")
+        try:
+            output = subprocess.run(
+                ["tesseract", "stdin", "stdout", "-l", self.language],
+                input=file_bytes, check=True, capture_output=True,
+                timeout=self.timeout, env=env
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+        text = output.stdout.decode('utf-8', errors='ignore').strip()
+        self._cache_put(fingerprint, text)
+        return text or None
+
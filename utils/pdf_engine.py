@@ -0,0 +1,148 @@
+"""
+Parallel per-page PDF text extraction.
+
+Pages are split into contiguous batches and extracted on a process pool.
+Each worker opens the PDF by path, so only the path and page numbers
+cross the process boundary, never the document bytes. Results come back
+in page order as soon as the batches finish, so downstream chunking can
+start before the last page is done.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PageResult:
+    """Text and timing for one extracted page"""
+
+    __slots__ = ('page_number', 'text', 'elapsed', 'error')
+
+    def __init__(self, page_number, text, elapsed, error=None):
+        self.page_number = page_number
+        self.text = text
+        self.elapsed = elapsed
+        self.error = error
+
+
+def default_workers():
+    """Worker count from PDF_WORKERS, else the number of CPUs"""
+    return int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+
+
+def get_pool(workers=None):
+    """Process pool shared by all extractions in this process
+
+    Uses the spawn start method: the app runs many threads, and forking a
+    threaded process can deadlock the child.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers or default_workers(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def count_pages(path):
+    """Number of pages in the PDF at ``path``"""
+    import PyPDF2
+
+    with open(path, 'rb') as handle:
+        return len(PyPDF2.PdfReader(handle).pages)
+
+
+def extract_batch(path, page_numbers):
+    """Worker: extract the given 0-based pages from the PDF at ``path``"""
+    import PyPDF2
+
+    results = []
+    with open(path, 'rb') as handle:
+        reader = PyPDF2.PdfReader(handle)
+        for page_number in page_numbers:
+            start = time.perf_counter()
+            try:
+                text = reader.pages[page_number].extract_text() or ""
+                error = None
+            except Exception as e:
+                text = ""
+                error = f"{type(e).__name__}: {e}"
+            results.append((page_number, text, time.perf_counter() - start, error))
+    return results
+
+
+def iter_pages(path, num_pages=None, workers=None, batch_size=None, cancelled=None, executor=None):
+    """Yield a PageResult for every page of the PDF, in page order
+
+    ``cancelled`` is an optional threading.Event; when set, outstanding
+    batches are cancelled and iteration stops.
+    """
+    if num_pages is None:
+        num_pages = count_pages(path)
+    if num_pages == 0:
+        return
+
+    workers = workers or default_workers()
+    # A few batches per worker keeps the pool busy without tiny tasks
+    batch_size = batch_size or max(1, min(16, -(-num_pages // (workers * 4))))
+    executor = executor or get_pool(workers)
+
+    futures = [
+        executor.submit(extract_batch, path, list(range(first, min(first + batch_size, num_pages))))
+        for first in range(0, num_pages, batch_size)
+    ]
+
+    try:
+        for future in futures:
+            while True:
+                if cancelled is not None and cancelled.is_set():
+                    return
+                try:
+                    batch = future.result(timeout=0.2)
+                    break
+                except TimeoutError:
+                    continue
+            for page_number, text, elapsed, error in batch:
+                yield PageResult(page_number, text, elapsed, error)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+class PdfExtraction:
+    """Summary of a full-document extraction"""
+
+    def __init__(self, num_pages):
+        self.num_pages = num_pages
+        self.pages_extracted = 0
+        self.failures = []  # (1-based page number, error)
+        self.page_times = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, page):
+        """Record one page's outcome"""
+        self.page_times.append((page.page_number + 1, page.elapsed))
+        if page.error:
+            self.failures.append((page.page_number + 1, page.error))
+        else:
+            self.pages_extracted += 1
+        self.elapsed = time.perf_counter() - self.started
+
+    def slowest(self, n=3):
+        """The ``n`` slowest pages as (page number, seconds)"""
+        return sorted(self.page_times, key=lambda item: -item[1])[:n]
+
+    def page_texts(self, pages):
+        """Pass-through generator that records each page and yields its text"""
+        for page in pages:
+            self.add(page)
+            if page.text:
+                yield page.text + "\n"
@@ -0,0 +1,110 @@
+"""
+Prompt layout that keeps the stable part of every request in front.
+
+Providers cache the longest previously seen prompt prefix (OpenAI from
+1024 tokens on), but only if it is byte-for-byte identical. The layout
+puts the system prompt and the attached documents first, ordered by
+content hash so upload order and rephrasing do not matter, and only then
+the conversation summary, the sliding chat history and the question with
+its per-question excerpts. Cached-token counts reported by the provider are tracked per layout.
+"""
+
+import os
+import threading
+
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant. You can analyze files and have "
+    "conversations with users. When files are provided, incorporate their "
+    "analysis into your responses. Be helpful, accurate, and engaging."
+)
+
+
+class PromptLayout:
+    """Builds messages as [static prefix] + [history] + [question]"""
+
+    def __init__(self, system_prompt=SYSTEM_PROMPT, history_turns=None, prefix_chunks=None):
+        self.system_prompt = system_prompt
+        # None sends every turn given: ConversationMemory already leaves out only
+        # what its summary covers, and trimming here would lose the turns between
+        self.history_turns = history_turns
+        # Leading chunks of each document in the prefix; enough to pass the
+        # provider's minimum cacheable length on a typical document
+        self.prefix_chunks = int(prefix_chunks if prefix_chunks is not None
+                                 else os.getenv("PROMPT_PREFIX_CHUNKS", "4"))
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def documents(self, file_analysis_results):
+        """Attached files in content-hash order, duplicates removed"""
+        unique = {}
+        for result in file_analysis_results or []:
+            key = result.content_hash or f"{result.filename}:{result.size}"
+            unique.setdefault(key, result)
+        return [unique[key] for key in sorted(unique)]
+
+    def prefix_chunk_ids(self, result):
+        """Chunk ids of ``result`` already included in the prefix"""
+        index = result.index
+        return set(range(min(self.prefix_chunks, len(index)))) if index is not None else set()
+
+    def document_block(self, result):
+        """Static description of one file; identical on every turn"""
+        key = (result.content_hash or "")[:12]
+        block = f'<document id="{key}" name="{result.filename}" type="{result.file_type}">\n'
+        block += f"Summary: {result.digest()}\n"
+        index = result.index
+        chunk_ids = sorted(self.prefix_chunk_ids(result))
+        if chunk_ids:
+            block += "Opening passages:\n"
+            for chunk_id in chunk_ids:
+                block += f"[chunk {chunk_id + 1}/{len(index)}] {index.chunks[chunk_id]}\n"
+        elif result.text is not None:
+            block += f"Preview: {result.text.preview()}\n"
+        return block + "</document>"
+
+    def prefix(self, file_analysis_results=None):
+        """System message holding the instructions and every attached document"""
+        content = self.system_prompt
+        documents = self.documents(file_analysis_results)
+        if documents:
+            content += "\n\nAttached files:\n" + "\n".join(self.document_block(r) for r in documents)
+        return [{"role": "system", "content": content}]
+
+    def history(self, chat_history=None):
+        """The latest conversation summary, if any, and the turns (the last history_turns if set)"""
+        chat_history = chat_history or []
+        summaries = [message for message in chat_history if message['role'] == 'system'][-1:]
+        turns = [message for message in chat_history if message['role'] in ('user', 'assistant')]
+        if self.history_turns is not None:
+            turns = turns[-self.history_turns:]
+        return [
+            {"role": message['role'], "content": message['content']}
+            for message in summaries + turns
+        ]
+
+    def messages(self, file_analysis_results=None, chat_history=None):
+        """Prefix and history; the caller appends the question"""
+        return self.prefix(file_analysis_results) + self.history(chat_history)
+
+    def record(self, usage):
+        """Count prompt and cached tokens from a response's ``usage``"""
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', None) or 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.cached_tokens += cached
+
+    def stats(self):
+        """Prompt tokens sent and how many of them the provider had cached"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'cached_ratio': round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            }
@@ -0,0 +1,390 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.cancellation import RequestCancelled
+from utils.transport import http_pool
+
+# Error kinds that make it worth trying the next provider
+FAILOVER_KINDS = ('quota', 'rate_limit', 'timeout', 'connection', 'server', 'auth')
+
+# How long a provider is skipped after each kind of failure (seconds)
+COOLDOWNS = {
+    'quota': 300.0,
+    'rate_limit': 20.0,
+    'auth': 600.0,
+    'timeout': 5.0,
+    'connection': 5.0,
+    'server': 5.0,
+}
+
+
+def classify_error(error):
+    """Map an exception raised by an OpenAI-compatible client to an error kind"""
+    status = getattr(error, 'status_code', None)
+    text = str(error).lower()
+    name = type(error).__name__.lower()
+
+    if 'quota' in text or 'insufficient_quota' in text:
+        return 'quota'
+    if status == 429 or 'rate limit' in text or 'rate_limit' in text:
+        return 'rate_limit'
+    if 'timeout' in name or 'timed out' in text or 'timeout' in text:
+        return 'timeout'
+    if status in (401, 403) or 'api_key' in text or 'authentication' in name:
+        return 'auth'
+    if 'connection' in name or 'connection' in text:
+        return 'connection'
+    if status is not None and status >= 500:
+        return 'server'
+    return 'fatal'
+
+
+def _set_done(future):
+    try:
+        future.set_result(None)
+    except InvalidStateError:
+        pass
+
+
+def _discard(future):
+    """Drop an attempt whose result is no longer wanted"""
+    if not future.cancel():
+        future.add_done_callback(_close_response)
+
+
+def _close_response(future):
+    """Done-callback closing a response nobody will read, which frees its connection"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), 'close', None)
+    if close is not None:
+        close()
+
+
+class ProviderError(Exception):
+    """Raised when no provider could complete a request"""
+
+    def __init__(self, errors):
+        self.errors = errors  # list of (provider name, kind, exception)
+        details = "; ".join(f"{name} ({kind}): {error}" for name, kind, error in errors)
+        super().__init__(details or "No AI provider is available")
+
+    @property
+    def quota_exhausted(self):
+        """True when every provider that was tried is out of quota"""
+        return bool(self.errors) and all(kind == 'quota' for _, kind, _ in self.errors)
+
+
+class ProviderHealth:
+    """Moving latency averages and failure bookkeeping for one provider"""
+
+    def __init__(self, alpha=0.2, initial_latency=2.0):
+        self.alpha = alpha
+        self.latency = initial_latency
+        self.deviation = initial_latency / 2
+        self.samples = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def record_success(self, elapsed):
+        """Fold a successful request latency into the moving averages"""
+        with self._lock:
+            if self.samples == 0:
+                self.latency = elapsed
+                self.deviation = elapsed / 2
+            else:
+                self.deviation += self.alpha * (abs(elapsed - self.latency) - self.deviation)
+                self.latency += self.alpha * (elapsed - self.latency)
+            self.samples += 1
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.cooldown_until = 0.0
+
+    def record_failure(self, kind, elapsed=None):
+        """Record a failed request and put the provider on cooldown"""
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = kind
+            if elapsed is not None and kind == 'timeout':
+                # A timeout is at least as slow as the time we waited
+                self.latency += self.alpha * (max(elapsed, self.latency) - self.latency)
+            base = COOLDOWNS.get(kind, 0.0)
+            if kind in ('timeout', 'connection', 'server'):
+                base *= 2 ** min(self.consecutive_failures - 1, 6)
+            self.cooldown_until = time.monotonic() + base
+
+    def available(self, now=None):
+        """Whether the provider is outside its failure cooldown"""
+        return (now or time.monotonic()) >= self.cooldown_until
+
+    def score(self):
+        """Ranking key: expected latency, penalised by recent failures"""
+        if self.samples == 0 and self.consecutive_failures == 0:
+            # Optimistic until measured, so every provider gets sampled
+            return 0.0
+        return self.latency + self.deviation + self.consecutive_failures * self.latency
+
+    def hedge_delay(self):
+        """Roughly the p95 latency; a request slower than this gets hedged"""
+        return self.latency + 2 * self.deviation
+
+    def snapshot(self):
+        """Plain dict of the health figures for display"""
+        return {
+            'latency_avg': round(self.latency, 3),
+            'latency_dev': round(self.deviation, 3),
+            'successes': self.successes,
+            'failures': self.failures,
+            'available': self.available(),
+            'last_error': self.last_error,
+        }
+
+
+class Provider:
+    """One OpenAI-compatible chat completions endpoint"""
+
+    def __init__(self, name, api_key=None, base_url=None, text_model="gpt-4o",
+                 vision_model=None, supports_vision=True, timeout=60.0, priority=0,
+                 connect_timeout=None):
+        self.name = name
+        self.base_url = base_url
+        self.text_model = text_model
+        self.vision_model = vision_model or text_model
+        self.supports_vision = supports_vision
+        # Read timeout: the longest wait for the next bytes, e.g. between streamed tokens
+        self.timeout = timeout
+        self.connect_timeout = float(connect_timeout or os.getenv("AI_CONNECT_TIMEOUT", "5"))
+        self.priority = priority
+        self.health = ProviderHealth()
+
+        import httpx
+        from openai import OpenAI
+
+        # Connections are pooled per endpoint and process, and kept warm between turns
+        self.http = http_pool(base_url, timeout, self.connect_timeout)
+        # Local servers usually ignore the key but the client insists on one
+        self.client = OpenAI(
+            api_key=api_key or "not-needed",
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=self.connect_timeout),
+            http_client=self.http.client,
+            max_retries=0,  # retries are handled by failover
+        )
+
+    def supports(self, kind):
+        """Whether this provider can serve a request of the given kind"""
+        return kind != 'vision' or self.supports_vision
+
+    def model_for(self, kind):
+        """Model name to use for a 'text' or 'vision' request"""
+        return self.vision_model if kind == 'vision' else self.text_model
+
+    def create(self, kind, **kwargs):
+        """Run a chat completion on this provider"""
+        return self.client.chat.completions.create(model=self.model_for(kind), **kwargs)
+
+
+def load_providers():
+    """Build the provider list from the environment
+
+    ``AI_PROVIDERS`` may hold a JSON list of provider definitions, e.g.
+    ``[{"name": "local", "base_url": "http://localhost:8080/v1",
+    "text_model": "llama-3", "vision": false}]``. Keys can be given inline
+    with ``api_key`` or by variable name with ``api_key_env``. Without it
+    the OpenAI account from ``OPENAI_API_KEY`` is used, plus a local server
+    when ``LOCAL_LLM_BASE_URL`` is set.
+    """
+    providers = []
+    raw = os.getenv("AI_PROVIDERS")
+
+    if raw:
+        for index, spec in enumerate(json.loads(raw)):
+            api_key = spec.get('api_key')
+            if not api_key and spec.get('api_key_env'):
+                api_key = os.getenv(spec['api_key_env'])
+            providers.append(Provider(
+                name=spec.get('name', f"provider-{index + 1}"),
+                api_key=api_key,
+                base_url=spec.get('base_url'),
+                text_model=spec.get('text_model', "gpt-4o"),
+                vision_model=spec.get('vision_model'),
+                supports_vision=spec.get('vision', True),
+                timeout=float(spec.get('timeout', 60)),
+                connect_timeout=spec.get('connect_timeout'),
+                priority=int(spec.get('priority', index)),
+            ))
+        return providers
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key:
+        providers.append(Provider(
+            name="openai",
+            api_key=api_key,
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            text_model="gpt-4o",
+            vision_model="gpt-4o",
+            timeout=float(os.getenv("AI_READ_TIMEOUT", "60")),
+            priority=0,
+        ))
+
+    local_url = os.getenv("LOCAL_LLM_BASE_URL")
+    if local_url:
+        providers.append(Provider(
+            name="local",
+            base_url=local_url,
+            text_model=os.getenv("LOCAL_LLM_MODEL", "local-model"),
+            supports_vision=os.getenv("LOCAL_LLM_VISION", "0") == "1",
+            timeout=float(os.getenv("LOCAL_LLM_TIMEOUT", "120")),
+            priority=1,
+        ))
+
+    return providers
+
+
+class ProviderRouter:
+    """Routes chat completions across providers with failover and hedging
+
+    Providers are ranked by their moving latency average. A request goes to
+    the fastest healthy provider; if it has not answered within that
+    provider's hedge delay (about its p95 latency) the same request is also
+    sent to the runner-up and whichever answers first wins. Quota, rate
+    limit, timeout and connection failures move on to the next provider.
+    """
+
+    def __init__(self, providers, hedging=True, min_hedge_delay=0.5, max_workers=8):
+        if not providers:
+            raise ValueError("No AI providers configured. Set OPENAI_API_KEY or AI_PROVIDERS.")
+        self.providers = list(providers)
+        self.hedging = hedging and len(self.providers) > 1
+        self.min_hedge_delay = min_hedge_delay
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider")
+
+    def ranked(self, kind):
+        """Providers able to serve ``kind``, best first; cooled-down ones last"""
+        now = time.monotonic()
+        capable = [p for p in self.providers if p.supports(kind)]
+        return sorted(
+            capable,
+            key=lambda p: (not p.health.available(now), p.health.score(), p.priority)
+        )
+
+    def create(self, kind, cancel=None, **kwargs):
+        """Run a chat completion, failing over and hedging as needed
+
+        With a CancelToken the call raises RequestCancelled as soon as the
+        token is cancelled, even while a provider is still connecting;
+        responses that arrive after that are closed.
+        """
+        candidates = self.ranked(kind)
+        if not candidates:
+            raise ProviderError([])
+        if cancel is not None:
+            cancel.check()
+            return self._create_hedged(candidates, kind, kwargs, cancel,
+                                       hedge=self.hedging and len(candidates) > 1)
+        if self.hedging and len(candidates) > 1:
+            return self._create_hedged(candidates, kind, kwargs)
+        return self._create_sequential(candidates, kind, kwargs)
+
+    def _attempt(self, provider, kind, kwargs):
+        """Call one provider and update its health"""
+        start = time.monotonic()
+        try:
+            response = provider.create(kind, **kwargs)
+        except Exception as e:
+            error_kind = classify_error(e)
+            provider.health.record_failure(error_kind, time.monotonic() - start)
+            raise
+        provider.health.record_success(time.monotonic() - start)
+        return response
+
+    def _create_sequential(self, candidates, kind, kwargs):
+        """Try providers one after another until one succeeds"""
+        errors = []
+        for provider in candidates:
+            try:
+                return self._attempt(provider, kind, kwargs)
+            except Exception as e:
+                error_kind = classify_error(e)
+                errors.append((provider.name, error_kind, e))
+                if error_kind not in FAILOVER_KINDS:
+                    break
+        raise ProviderError(errors)
+
+    def _create_hedged(self, candidates, kind, kwargs, cancel=None, hedge=True):
+        """Race providers, starting the next one when the current is slow or fails"""
+        errors = []
+        pending = {}
+        queue = list(candidates)
+
+        def launch():
+            provider = queue.pop(0)
+            pending[self._executor.submit(self._attempt, provider, kind, kwargs)] = provider
+            return provider
+
+        # Completes when the token is cancelled, so it can be waited on with the attempts
+        stopped = Future()
+        unregister = cancel.on_cancel(lambda: _set_done(stopped)) if cancel is not None else None
+
+        current = launch()
+        hedged = False
+        try:
+            while pending:
+                delay = max(current.health.hedge_delay(), self.min_hedge_delay) if queue and hedge else None
+                done, _ = wait([*pending, stopped], timeout=delay, return_when=FIRST_COMPLETED)
+
+                if stopped.done():
+                    for future in pending:
+                        _discard(future)
+                    raise RequestCancelled(cancel.reason)
+
+                if not done:
+                    # Primary is slower than usual: hedge with the next provider
+                    self.hedged_requests += 1
+                    hedged = True
+                    current = launch()
+                    continue
+
+                for future in done:
+                    provider = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        error_kind = classify_error(e)
+                        errors.append((provider.name, error_kind, e))
+                        if error_kind not in FAILOVER_KINDS:
+                            queue.clear()
+                        continue
+                    if hedged and provider is not candidates[0]:
+                        self.hedge_wins += 1
+                    # Losing streams would otherwise stay open until garbage collected
+                    for other in pending:
+                        _discard(other)
+                    return response
+
+                if not pending and queue:
+                    current = launch()
+        finally:
+            if unregister is not None:
+                unregister()
+
+        raise ProviderError(errors)
+
+    def stats(self):
+        """Health snapshot of every provider plus hedging counters"""
+        return {
+            'providers': {p.name: p.health.snapshot() for p in self.providers},
+            'connections': {p.name: p.http.stats.snapshot() for p in self.providers},
+            'hedged_requests': self.hedged_requests,
+            'hedge_wins': self.hedge_wins,
+        }
@@ -0,0 +1,234 @@
+"""
+Compound questions over several documents, answered in parallel parts.
+
+"Compare these five contracts on termination, liability and pricing" used
+to go out as one prompt with every document's opening passages plus a few
+excerpts picked for the whole question, so most aspects of most documents
+were never in front of the model, and it had to sift one long prompt. The
+QueryDecomposer splits such a question into subqueries, one per document
+and, when the question lists aspects, one per document and aspect (up to
+``QUERY_MAX_SUBQUERIES``). Each subquery retrieves its own chunks from its
+document and gets a short answer from a small call; up to
+``QUERY_MAX_CONCURRENCY`` run at once. A final synthesis call then sees
+only the question and the labelled findings, and streams as usual.
+
+Planning is rule based, so no extra round trip is spent on it: a question
+qualifies when at least two indexed documents are attached and it
+compares or asks across them ("compare", "each", "differences",
+"versus", ...) or lists two or more aspects ("on A, B and C"). Findings
+are cached in the shared cache by document content, subquery and the
+chunks used (``QUERY_CACHE_TTL``), so asking again with one more aspect
+or one more document only runs the new subqueries.
+``QUERY_DECOMPOSITION=0`` turns the mode off.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cancellation import RequestCancelled
+
+COMPOUND_RE = re.compile(
+    r"\b(compare|comparison|contrast|versus|vs\.?|differ\w*|difference\w*|similarit\w*|each|every|all of|"
+    r"across|respectively|side by side|which of)\b"
+)
+# "on termination, liability and pricing", "in terms of cost and risk"
+ASPECTS_RE = re.compile(r"\b(?:on|in terms of|regarding|about|for|by|across|covering)\s+(?P<list>[^?.;:!]+)")
+SEPARATOR_RE = re.compile(r"\s*(?:,|;|\band\b|\bor\b|&|/)\s*")
+LEADING_RE = re.compile(r"^(?:the|their|its|both|each|all)\s+")
+MAX_ASPECT_WORDS = 4
+
+SUBQUERY_PROMPT = (
+    "You answer one part of a larger question about several documents. Use only the "
+    "excerpts given. Answer in at most a few sentences and quote figures, dates and "
+    "clause numbers exactly. If the excerpts do not cover it, say \"Not covered\"."
+)
+SYNTHESIS_NOTE = (
+    "The findings below were extracted from the attached documents, one part at a time. "
+    "Answer the question from them; say where a document does not cover something."
+)
+
+
+def question_aspects(question):
+    """Aspects a question lists ("on A, B and C"), or [] if it lists fewer than two"""
+    best = []
+    for match in ASPECTS_RE.finditer(question.lower()):
+        items = [LEADING_RE.sub("", item.strip()) for item in SEPARATOR_RE.split(match.group('list'))]
+        items = [item for item in items if item]
+        if len(items) >= 2 and all(len(item.split()) <= MAX_ASPECT_WORDS for item in items) and len(items) > len(best):
+            best = items
+    return list(dict.fromkeys(best))
+
+
+class SubQuery:
+    """One document, optionally one aspect, and the chunks retrieved for them"""
+
+    __slots__ = ('document', 'aspect', 'question', 'excerpts', 'key')
+
+    def __init__(self, document, aspect, question, excerpts):
+        self.document = document
+        self.aspect = aspect
+        self.question = question
+        self.excerpts = excerpts  # [(chunk id or None, text)]
+        digest = hashlib.sha256()
+        digest.update(f"{document.content_hash or document.filename}\0{question}\0".encode('utf-8'))
+        digest.update(",".join(str(chunk_id) for chunk_id, _ in excerpts).encode('utf-8'))
+        self.key = f"subquery:{digest.hexdigest()[:32]}"
+
+    @property
+    def label(self):
+        return f"{self.document.filename} / {self.aspect}" if self.aspect else self.document.filename
+
+    def messages(self):
+        passages = "\n".join(
+            f"[chunk {chunk_id + 1}] {text}" if chunk_id is not None else text
+            for chunk_id, text in self.excerpts
+        )
+        return [
+            {"role": "system", "content": SUBQUERY_PROMPT},
+            {"role": "user", "content": (
+                f'Document "{self.document.filename}" ({self.document.digest()})\n'
+                f"Excerpts:\n{passages}\n\nQuestion: {self.question}"
+            )},
+        ]
+
+
+class QueryDecomposer:
+    """Plans subqueries for compound questions and runs them concurrently"""
+
+    def __init__(self, cache=None, enabled=None, max_subqueries=None, max_concurrency=None, chunks=None,
+                 max_tokens=None, ttl=None):
+        if enabled is None:
+            enabled = os.getenv("QUERY_DECOMPOSITION", "1") == "1"
+        self.enabled = enabled
+        self.cache = cache
+        self.max_subqueries = int(max_subqueries or os.getenv("QUERY_MAX_SUBQUERIES", "24"))
+        self.max_concurrency = int(max_concurrency or os.getenv("QUERY_MAX_CONCURRENCY", "6"))
+        self.chunks = int(chunks or os.getenv("QUERY_SUBQUERY_CHUNKS", "4"))
+        self.max_tokens = int(max_tokens or os.getenv("QUERY_SUBQUERY_TOKENS", "300"))
+        self.ttl = float(ttl if ttl is not None else os.getenv("QUERY_CACHE_TTL", "86400"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="subquery")
+        self._lock = threading.Lock()
+        self.counts = {'questions': 0, 'subqueries': 0, 'cache_hits': 0, 'failed': 0}
+
+    def documents(self, file_analysis_results):
+        """Indexed text documents, duplicates removed, in upload order"""
+        unique = {}
+        for result in file_analysis_results or []:
+            if result.index is not None and len(result.index) and not result.is_image:
+                unique.setdefault(result.content_hash or f"{result.filename}:{result.size}", result)
+        return list(unique.values())
+
+    def applies(self, question, file_analysis_results):
+        """Whether ``question`` over these attachments is worth splitting"""
+        if not self.enabled or any(result.is_image for result in file_analysis_results or []):
+            return False
+        if len(self.documents(file_analysis_results)) < 2:
+            return False
+        text = question.lower()
+        return COMPOUND_RE.search(text) is not None or len(question_aspects(question)) >= 2
+
+    def plan(self, question, file_analysis_results):
+        """Subqueries per document, and per aspect while that stays within max_subqueries"""
+        documents = self.documents(file_analysis_results)
+        aspects = question_aspects(question)
+        if not aspects or len(documents) * len(aspects) > self.max_subqueries:
+            aspects = [None]
+        documents = documents[:self.max_subqueries]
+        subqueries = []
+        for document in documents:
+            for aspect in aspects:
+                if aspect:
+                    # Independent of the rest of the question, so other questions naming
+                    # the aspect reuse the cached finding
+                    focused = f"What does this document say about {aspect}?"
+                    query = aspect
+                else:
+                    focused = f"{question}\n(Answer for this document only.)"
+                    query = question
+                subqueries.append(SubQuery(document, aspect, focused, self._excerpts(document, query)))
+        return subqueries
+
+    def _excerpts(self, document, query):
+        """Best-matching chunks in document order, or the opening when nothing matches"""
+        index = document.index
+        hits = index.search(query, k=self.chunks)
+        if not hits:
+            return [(chunk_id, index.chunks[chunk_id]) for chunk_id in range(min(self.chunks, len(index)))]
+        return [(chunk_id, chunk) for _, chunk_id, chunk in sorted(hits, key=lambda hit: hit[1])]
+
+    def run(self, router, subqueries, cancel=None):
+        """Answer every subquery, cached ones without a call
+
+        Returns (subquery, answer or exception) pairs in plan order; raises
+        RequestCancelled if ``cancel`` fired meanwhile.
+        """
+        outcomes = [None] * len(subqueries)
+        futures = []
+        for position, subquery in enumerate(subqueries):
+            cached = self.cache.get(subquery.key) if self.cache is not None and self.ttl else None
+            if cached is not None:
+                outcomes[position] = (subquery, cached)
+                self._count('cache_hits')
+            else:
+                futures.append((position, subquery, self._executor.submit(self._answer, router, subquery, cancel)))
+        for position, subquery, future in futures:
+            try:
+                answer = future.result()
+                if self.cache is not None and self.ttl:
+                    self.cache.set(subquery.key, answer, ttl=self.ttl)
+                outcomes[position] = (subquery, answer)
+            except Exception as e:
+                if not isinstance(e, RequestCancelled):
+                    self._count('failed')
+                outcomes[position] = (subquery, e)
+        if cancel is not None:
+            cancel.check()
+        with self._lock:
+            self.counts['questions'] += 1
+            self.counts['subqueries'] += len(subqueries)
+        return outcomes
+
+    def _answer(self, router, subquery, cancel):
+        if cancel is not None and cancel.cancelled:
+            raise RequestCancelled(cancel.reason)
+        response = router.create(
+            'text',
+            cancel=cancel,
+            messages=subquery.messages(),
+            max_tokens=self.max_tokens,
+            temperature=0.2,
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    def synthesis_messages(self, question, outcomes, layout, chat_history=None):
+        """System prompt, history and the question with the labelled findings
+
+        The documents themselves are left out: the findings carry what the
+        answer needs, which keeps this prompt small.
+        """
+        sections = []
+        for subquery, outcome in outcomes:
+            answer = outcome if isinstance(outcome, str) else "(could not be answered)"
+            sections.append(f"### {subquery.label}\n{answer}")
+        content = f"{question}\n\n{SYNTHESIS_NOTE}\n\n" + "\n\n".join(sections)
+        return (
+            [{"role": "system", "content": layout.system_prompt}]
+            + layout.history(chat_history)
+            + [{"role": "user", "content": content}]
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            'enabled': self.enabled,
+            **counts,
+            'mean_subqueries': round(counts['subqueries'] / counts['questions'], 1) if counts['questions'] else None,
+        }
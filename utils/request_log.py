@@ -0,0 +1,186 @@
+"""
+Privacy-scrubbed log of the requests AIClient serves, for replaying load.
+
+Off unless ``REQUEST_LOG`` names a file. Each question (from the UI or the
+API) then appends one JSON line describing its shape and timing, never its
+text:
+
+    {"ts": 1792406488.125, "m": "stream", "s": "5f0c2a91d3", "q": "b71e09c4aa",
+     "qc": 84, "h": 4, "hc": 1630, "f": [{"id": "0d9e41f2", "k": "pdf",
+     "t": "application/pdf", "b": 482113, "c": 51200, "p": 12}],
+     "k": "text", "i": "summary", "mt": 600, "o": "ok", "ms": 2140.5,
+     "ft": 312.0, "ac": 1880, "n": 402}
+
+* ``ts`` start time, ``m`` ``get`` or ``stream``;
+* ``s``, ``q``, ``id``: keyed hashes (HMAC with ``REQUEST_LOG_SALT``) of
+  the session, the normalized question and each file's content hash, so
+  a replay can repeat the same question, user or file without knowing it;
+* ``qc`` question characters, ``h``/``hc`` history messages and characters;
+* ``f`` attachments: kind, MIME type, bytes, text characters, pages,
+  image size and frames, only the fields that apply;
+* ``k`` request kind (``text``, ``vision``, ``vision-batch``), ``i``
+  intent, ``mt`` max_tokens;
+* ``o`` outcome (``ok``, ``cached``, ``error`` or the cancel reason:
+  ``timeout``, ``busy``, ``cancelled``, ``abandoned``), ``ms`` total and
+  ``ft`` time to the first piece in ms, ``ac`` answer characters and
+  ``n`` pieces streamed (about one token each).
+
+Without a salt a random one is drawn per process, so hashes only match
+within one run; set ``REQUEST_LOG_SALT`` to a secret to link repeats
+across restarts and replicas. ``REQUEST_LOG_SAMPLE`` records a fraction of
+requests; the file is rotated to ``<path>.1`` past ``REQUEST_LOG_MAX_MB``.
+Lines are written with a single ``O_APPEND`` write, so several workers can
+share one file. ``tools/replay_requests.py`` plays a log back.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import random
+import secrets
+import threading
+import time
+
+WHITESPACE = str.maketrans({"\n": " ", "\t": " ", "\r": " "})
+
+
+def normalize_question(text):
+    """Lowercased, whitespace-collapsed question, so trivially different repeats hash alike"""
+    return " ".join(text.translate(WHITESPACE).lower().split())
+
+
+def describe_attachment(result, key):
+    """Shape of one AnalysisResult: kind, type, sizes; ``key`` hashes its content id"""
+    fields = {
+        'id': key(result.content_hash or f"{result.filename}:{result.size}", 8),
+        'k': result.kind,
+        't': result.file_type,
+        'b': result.size,
+    }
+    if result.text is not None:
+        fields['c'] = result.text.characters
+    if result.pages is not None:
+        fields['p'] = result.pages
+    if result.is_image:
+        fields['w'] = result.width
+        fields['h'] = result.height
+        if result.frames > 1:
+            fields['n'] = result.frames
+    return fields
+
+
+class RequestTrace:
+    """Shape and timing of one request, written on finish"""
+
+    __slots__ = ('recorder', 'fields', 'started', 'first', 'kind', 'intent', 'max_tokens')
+
+    def __init__(self, recorder, fields):
+        self.recorder = recorder
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.first = None
+        self.kind = None
+        self.intent = None
+        self.max_tokens = None
+
+    def first_piece(self):
+        if self.first is None:
+            self.first = time.perf_counter()
+
+    def finish(self, outcome, answer='', pieces=0):
+        fields = self.fields
+        now = time.perf_counter()
+        fields['k'] = self.kind
+        fields['i'] = self.intent
+        fields['mt'] = self.max_tokens
+        fields['o'] = outcome
+        fields['ms'] = round((now - self.started) * 1000, 1)
+        if self.first is not None:
+            fields['ft'] = round((self.first - self.started) * 1000, 1)
+        fields['ac'] = len(answer or '')
+        fields['n'] = pieces
+        self.recorder.write({key: value for key, value in fields.items() if value is not None})
+
+
+class _NoTrace:
+    """Stands in for RequestTrace when nothing is recorded"""
+
+    __slots__ = ('kind', 'intent', 'max_tokens')
+
+    def first_piece(self):
+        pass
+
+    def finish(self, outcome, answer='', pieces=0):
+        pass
+
+
+class RequestRecorder:
+    """Appends one scrubbed line per request to REQUEST_LOG"""
+
+    def __init__(self, path=None, sample=None, salt=None, max_bytes=None):
+        self.path = path if path is not None else os.getenv("REQUEST_LOG", "")
+        self.sample = float(sample if sample is not None else os.getenv("REQUEST_LOG_SAMPLE", "1"))
+        salt = salt or os.getenv("REQUEST_LOG_SALT") or secrets.token_hex(16)
+        self.salt = salt.encode('utf-8')
+        self.max_bytes = int(max_bytes or float(os.getenv("REQUEST_LOG_MAX_MB", "100")) * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.recorded = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path) and self.sample > 0
+
+    def key(self, value, length=10):
+        return hmac.new(self.salt, value.encode('utf-8'), hashlib.sha256).hexdigest()[:length]
+
+    def begin(self, mode, user_message, file_analysis_results=None, chat_history=None, session=None):
+        """A trace for one request, or a no-op stand-in when not recording this one"""
+        if not self.enabled or (self.sample < 1 and random.random() >= self.sample):
+            return _NoTrace()
+        history = [message for message in chat_history or [] if isinstance(message.get('content'), str)]
+        return RequestTrace(self, {
+            'ts': round(time.time(), 3),
+            'm': mode,
+            's': self.key(session) if session else None,
+            'q': self.key(normalize_question(user_message)),
+            'qc': len(user_message),
+            'h': len(history),
+            'hc': sum(len(message['content']) for message in history),
+            'f': [describe_attachment(result, self.key) for result in file_analysis_results or []] or None,
+        })
+
+    def write(self, fields):
+        line = (json.dumps(fields, separators=(',', ':')) + "\n").encode('utf-8')
+        with self.lock:
+            try:
+                if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+                self.recorded += 1
+            except OSError:
+                # Recording must never fail a request
+                self.failed += 1
+
+    def stats(self):
+        return {'enabled': self.enabled, 'recorded': self.recorded, 'failed': self.failed}
+
+
+def read_log(path):
+    """Records of a request log in time order, skipping lines that do not parse"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'ts' in record:
+                records.append(record)
+    records.sort(key=lambda record: record['ts'])
+    return records
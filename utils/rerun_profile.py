@@ -0,0 +1,47 @@
+"""
+Timing of Streamlit script runs and fragment reruns.
+
+Enabled with ``APP_PROFILE=1``. The app keeps one RerunProfile per session
+and wraps the whole script and each fragment body in ``section(name)``.
+A fragment rerun only records its own section, so the samples show what
+each kind of interaction costs; ``python -m tools.profile_reruns`` reports
+them.
+"""
+
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class RerunProfile:
+    """Recent durations (ms) per named section"""
+
+    def __init__(self, keep=200):
+        self.keep = keep
+        self.samples = {}
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            # st.rerun() and st.stop() end a run with an exception; still count it
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name, milliseconds):
+        self.samples.setdefault(name, deque(maxlen=self.keep)).append(milliseconds)
+
+    def clear(self):
+        self.samples.clear()
+
+    def summary(self):
+        """Run count, mean and last duration per section"""
+        return {
+            name: {
+                'runs': len(values),
+                'mean_ms': round(sum(values) / len(values), 2),
+                'last_ms': round(values[-1], 2),
+            }
+            for name, values in self.samples.items() if values
+        }
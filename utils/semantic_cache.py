@@ -0,0 +1,315 @@
+"""
+Semantic response cache for near-duplicate questions.
+
+Prompts are normalized and embedded on the CPU, with a sentence-transformers
+model when one is installed and otherwise with hashed word and character
+n-grams in NumPy. A question is answered from the cache when a previous
+question with the same attached files (by content hash) and the same recent
+history is similar enough, so "summarize this PDF" and "give me a summary
+of the pdf" share one model call. With a shared cache tier, each scope's
+recent entries are also published there, so replicas learn from each
+other's answers.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from utils.text_index import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Politeness and filler words that do not change what is being asked
+FILLER = frozenset("""
+please could would give tell show let just quick quickly some kindly
+hey hi hello thanks thank also
+""".split())
+
+# Words that change what is asked; kept through normalization, and two prompts
+# must use the same ones (like the same numbers) to share an answer
+NEGATIONS = frozenset("not no never without except nor neither none".split())
+QUESTION_WORDS = frozenset("what which who whom whose why how when where".split())
+QUALIFIERS = frozenset("""
+detail detailed brief briefly short shorter long longer more less fewer only all every each
+exactly first last top bottom most least before after step example examples
+""".split())
+MARKERS = NEGATIONS | QUESTION_WORDS | QUALIFIERS
+IGNORED = (STOPWORDS - MARKERS) | FILLER
+CONTRACTION_RE = re.compile(r"n't\b|'s\b")
+
+SUFFIXES = ("ization", "isation", "izing", "ising", "ations", "ation", "ize", "ise",
+            "ies", "ing", "ary", "ar", "ed", "es", "s")
+
+
+def _stem(word):
+    """Crude suffix stripping so 'summarize' and 'summary' share a stem"""
+    for _ in range(2):
+        for suffix in SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+                word = word[:-len(suffix)]
+                break
+        else:
+            break
+    return word
+
+
+def _words(text):
+    """Lowercased words with "n't" spelled out and "'s" dropped"""
+    text = CONTRACTION_RE.sub(lambda match: " not" if match.group(0) == "n't" else "", text.lower())
+    return [word for word in WORD_RE.findall(text) if len(word) > 1 or word.isdigit()]
+
+
+def normalize_prompt(text):
+    """Lowercased, stemmed content words of a prompt, negations and question words included"""
+    return [_stem(word) for word in _words(text) if word not in IGNORED]
+
+
+def prompt_markers(text):
+    """Negations, question words and qualifiers in a prompt (stemmed)"""
+    return frozenset(_stem(word) for word in _words(text) if word in MARKERS)
+
+
+class HashingEmbedder:
+    """Dependency-free embedding: hashed word and character trigram features"""
+
+    name = "hashing"
+
+    def __init__(self, dimensions=2048):
+        self.dimensions = dimensions
+
+    def _features(self, words):
+        for word in words:
+            yield "w:" + word, 1.0
+            padded = f"<{word}>"
+            for start in range(len(padded) - 2):
+                yield "c:" + padded[start:start + 3], 0.3
+
+    def embed(self, text):
+        import numpy as np
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature, weight in self._features(normalize_prompt(text)):
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], 'little') % self.dimensions
+            # A sign bit keeps colliding features from always adding up
+            vector[bucket] += weight if digest[4] & 1 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class ModelEmbedder:
+    """sentence-transformers model on the CPU"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+
+    def embed(self, text):
+        text = " ".join(normalize_prompt(text)) or text
+        return self.model.encode(text, normalize_embeddings=True)
+
+
+def load_embedder(model_name=None):
+    """The configured model if sentence-transformers is installed, else hashing"""
+    model_name = model_name if model_name is not None else os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+    if model_name and model_name != "hashing":
+        try:
+            return ModelEmbedder(model_name)
+        except Exception:
+            pass
+    return HashingEmbedder()
+
+
+def cache_scope(file_analysis_results=None, chat_history=None, history_turns=None):
+    """Scope key: content hashes of the attached files plus the history sent and summary
+
+    Answers are only shared between prompts that see the same documents and
+    the same conversation so far.
+    """
+    digest = hashlib.sha256()
+    hashes = sorted(
+        result.content_hash or f"{result.filename}:{result.size}"
+        for result in (file_analysis_results or [])
+    )
+    digest.update("\n".join(hashes).encode('utf-8'))
+    chat_history = chat_history or []
+    summaries = [message for message in chat_history if message.get('role') == 'system'][-1:]
+    turns = [message for message in chat_history if message.get('role') in ('user', 'assistant')]
+    if history_turns is not None:
+        turns = turns[-history_turns:]
+    for message in summaries + turns:
+        digest.update(f"\0{message['role']}\0{message['content']}".encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+class CacheEntry:
+    __slots__ = ('prompt', 'numbers', 'vector', 'response', 'created', 'hits')
+
+    def __init__(self, prompt, numbers, vector, response, created=None):
+        self.prompt = prompt
+        self.numbers = numbers
+        self.vector = vector
+        self.response = response
+        self.created = created or time.time()
+        self.hits = 0
+
+
+class SemanticCache:
+    """Similarity-matched response cache with size and age limits"""
+
+    def __init__(self, embedder=None, threshold=None, max_entries=None, ttl=None, enabled=None, shared=None):
+        if enabled is None:
+            enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+        self.enabled = enabled
+        self._embedder = embedder
+        self._threshold = threshold
+        self.max_entries = int(max_entries or os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+        self.ttl = float(ttl or os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+        # Only worth it when other processes can see the entries
+        self.shared = shared if shared is not None and shared.shared else None
+        self.shared_per_scope = 50
+        self._entries = OrderedDict()  # (scope, id) -> CacheEntry, least recently used first
+        self._matrices = {}  # scope -> (ids, stacked vectors), rebuilt when the scope changes
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.near_misses = 0
+        self.hit_similarities = []
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = load_embedder()
+        return self._embedder
+
+    @property
+    def threshold(self):
+        if self._threshold is None:
+            # Hashed n-grams give lower scores for paraphrases than a real model
+            default = "0.85" if isinstance(self.embedder, HashingEmbedder) else "0.9"
+            self._threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", default))
+        return self._threshold
+
+    def _numbers(self, prompt):
+        # "page 3" and "page 4" embed alike but are different questions, and so
+        # are "why ..." and "how ...", or "... enforceable" and "... not enforceable"
+        return frozenset(re.findall(r"\d+", prompt)) | prompt_markers(prompt)
+
+    def _matrix(self, scope):
+        import numpy as np
+
+        cached = self._matrices.get(scope)
+        if cached is None:
+            ids = [key[1] for key in self._entries if key[0] == scope]
+            if not ids:
+                return ids, None
+            cached = self._matrices[scope] = (ids, np.stack([self._entries[(scope, i)].vector for i in ids]))
+        return cached
+
+    def get(self, prompt, scope):
+        """Cached response for a similar prompt in ``scope``, or None"""
+        if not self.enabled or not prompt.strip():
+            return None
+        vector = self.embedder.embed(prompt)
+        numbers = self._numbers(prompt)
+        remote = self._shared_entries(scope)
+        with self._lock:
+            self._expire()
+            self._merge(scope, remote)
+            ids, vectors = self._matrix(scope)
+            if vectors is None:
+                self.misses += 1
+                return None
+            similarities = vectors @ vector
+            best = int(similarities.argmax())
+            similarity = float(similarities[best])
+            key = (scope, ids[best])
+            entry = self._entries[key]
+            if similarity < self.threshold or entry.numbers != numbers:
+                self.misses += 1
+                if similarity >= self.threshold - 0.1:
+                    self.near_misses += 1
+                    logger.info("semantic cache near miss (%.3f): %r vs %r", similarity, prompt, entry.prompt)
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.hit_similarities.append(similarity)
+            del self.hit_similarities[:-1000]
+        logger.info("semantic cache hit (%.3f): %r answered from %r", similarity, prompt, entry.prompt)
+        return entry.response
+
+    def put(self, prompt, scope, response):
+        """Remember ``response`` for ``prompt`` in ``scope``"""
+        if not self.enabled or not prompt.strip() or not response:
+            return
+        entry = CacheEntry(prompt, self._numbers(prompt), self.embedder.embed(prompt), response)
+        with self._lock:
+            self._add(scope, entry)
+        if self.shared is not None:
+            # Read-modify-write; a concurrent writer may drop an entry, which only costs a miss
+            remote = self._shared_entries(scope)
+            remote.append((entry.prompt, entry.numbers, entry.vector, entry.response, entry.created))
+            self.shared.set(self._shared_key(scope), remote[-self.shared_per_scope:], ttl=self.ttl)
+
+    def _add(self, scope, entry):
+        self._entries[(scope, self._next_id)] = entry
+        self._next_id += 1
+        self._matrices.pop(scope, None)
+        while len(self._entries) > self.max_entries:
+            (old_scope, _), _ = self._entries.popitem(last=False)
+            self._matrices.pop(old_scope, None)
+
+    def _shared_key(self, scope):
+        # Vectors from different embedders are not comparable
+        return f"response:v2:{self.embedder.name}:{scope}"
+
+    def _shared_entries(self, scope):
+        """Entries other replicas published for ``scope``"""
+        if self.shared is None:
+            return []
+        return self.shared.get(self._shared_key(scope)) or []
+
+    def _merge(self, scope, remote):
+        """Add published entries this process has not seen yet"""
+        if not remote:
+            return
+        known = {(entry.prompt, entry.created) for key, entry in self._entries.items() if key[0] == scope}
+        cutoff = time.time() - self.ttl
+        for prompt, numbers, vector, response, created in remote:
+            if (prompt, created) not in known and created >= cutoff:
+                self._add(scope, CacheEntry(prompt, numbers, vector, response, created))
+
+    def _expire(self):
+        """Drop entries older than the TTL (oldest are first unless recently hit)"""
+        cutoff = time.time() - self.ttl
+        expired = [key for key, entry in self._entries.items() if entry.created < cutoff]
+        for key in expired:
+            del self._entries[key]
+            self._matrices.pop(key[0], None)
+
+    def stats(self):
+        """Hit counts and similarity of recent hits"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            similarities = list(self.hit_similarities)
+            return {
+                'enabled': self.enabled,
+                'embedder': getattr(self._embedder, 'name', None),
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'near_misses': self.near_misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'min_hit_similarity': round(min(similarities), 3) if similarities else None,
+                'mean_hit_similarity': round(sum(similarities) / len(similarities), 3) if similarities else None,
+            }
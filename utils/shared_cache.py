@@ -0,0 +1,316 @@
+"""
+Cache tier shared between processes and replicas.
+
+``st.cache_resource`` and the in-memory caches are per process, so every
+replica behind a load balancer would analyze the same files and answer the
+same questions again. A SharedCache stores values in one of:
+
+* ``redis``  - one or more Redis-compatible servers (``CACHE_REDIS_URLS``);
+  keys are spread over several servers with rendezvous hashing, so a key
+  always lands on the same server and adding one only moves its share
+* ``file``   - a directory (``CACHE_DIR``), for tests and single-host setups
+* ``memory`` - an in-process LRU bounded by item count and bytes, the
+  fallback when nothing is configured
+
+Values are pickled and zlib-compressed above a small size. Unpickling
+runs code, so the ``redis`` and ``file`` backends are only used with
+``CACHE_SECRET`` set: entries are signed with it and unsigned or forged
+ones are refused. Without it, or without the ``redis`` package, the cache
+falls back to ``memory`` with a warning. Backend errors count as misses and
+never fail a request.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED = 0x01
+SIGNED = 0x02
+SIGNATURE_BYTES = 16
+COMPRESS_ABOVE = 1024
+
+
+class CacheSerializer:
+    """Compact binary encoding: flags byte, optional signature, pickle payload"""
+
+    def __init__(self, secret=None, level=1):
+        self.secret = (secret or "").encode('utf-8') or None
+        self.level = level
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+    def dumps(self, value):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        flags = 0
+        if len(payload) > COMPRESS_ABOVE:
+            compressed = zlib.compress(payload, self.level)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= COMPRESSED
+        if self.secret:
+            return bytes([flags | SIGNED]) + self._sign(payload) + payload
+        return bytes([flags]) + payload
+
+    def loads(self, data):
+        flags, payload = data[0], memoryview(data)[1:]
+        if self.secret:
+            if not flags & SIGNED:
+                raise ValueError("unsigned cache entry")
+            signature, payload = bytes(payload[:SIGNATURE_BYTES]), payload[SIGNATURE_BYTES:]
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                raise ValueError("bad cache entry signature")
+        elif flags & SIGNED:
+            payload = payload[SIGNATURE_BYTES:]
+        if flags & COMPRESSED:
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+
+class MemoryBackend:
+    """In-process LRU with expiry, bounded by ``max_items`` and ``max_bytes`` of stored data"""
+
+    shared = False
+
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = int(max_items or os.getenv("CACHE_MEMORY_ITEMS", "512"))
+        self.max_bytes = int(max_bytes or float(os.getenv("CACHE_MEMORY_MB", "256")) * 1024 * 1024)
+        self._items = OrderedDict()  # key -> (expires, data)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] and item[0] < time.time():
+                del self._items[key]
+                self._bytes -= len(item[1])
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, data, ttl=None):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            if len(data) > self.max_bytes:
+                # Would evict everything else and still not fit
+                return
+            self._items[key] = (time.time() + ttl if ttl else 0, data)
+            self._bytes += len(data)
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self._bytes -= len(item[1])
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+class FileBackend:
+    """One file per key in a directory; expiry is stored in the file header"""
+
+    shared = True
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv("CACHE_DIR") or os.path.join(
+            os.getenv("UPLOAD_DIR", "uploads"), "shared_cache")
+
+    def _path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name[:2], name)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as handle:
+                data = handle.read()
+        except OSError:
+            return None
+        (expires,) = struct.unpack_from("<d", data)
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return data[8:]
+
+    def set(self, key, data, ttl=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as handle:
+            handle.write(struct.pack("<d", time.time() + ttl if ttl else 0.0))
+            handle.write(data)
+        os.replace(temp, path)
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+
+class RedisBackend:
+    """One Redis-compatible server (requires the ``redis`` package)"""
+
+    shared = True
+
+    def __init__(self, url, timeout=0.5):
+        import redis
+
+        self.url = url
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, data, ttl=None):
+        self.client.set(key, data, ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+class ShardedBackend:
+    """Spreads keys over several backends with rendezvous (highest random weight) hashing"""
+
+    shared = True
+
+    def __init__(self, backends, names):
+        self.backends = list(backends)
+        self.names = list(names)
+
+    def backend_for(self, key):
+        def weight(position):
+            digest = hashlib.blake2b(f"{self.names[position]}\0{key}".encode('utf-8'), digest_size=8).digest()
+            return int.from_bytes(digest, 'big')
+        return self.backends[max(range(len(self.backends)), key=weight)]
+
+    def get(self, key):
+        return self.backend_for(key).get(key)
+
+    def set(self, key, data, ttl=None):
+        self.backend_for(key).set(key, data, ttl)
+
+    def delete(self, key):
+        self.backend_for(key).delete(key)
+
+
+def load_backend(signed=False):
+    """Backend chosen by CACHE_BACKEND (memory, file or redis)
+
+    The shared backends need ``signed`` entries (CACHE_SECRET): anyone who
+    can write to them could otherwise run code in every worker.
+    """
+    kind = os.getenv("CACHE_BACKEND", "memory").lower()
+    if kind in ("redis", "file") and not signed:
+        logger.warning("CACHE_BACKEND=%s needs CACHE_SECRET to sign entries; using a per-process cache", kind)
+        return MemoryBackend()
+    if kind == "redis":
+        urls = [url.strip() for url in os.getenv("CACHE_REDIS_URLS", "redis://localhost:6379/0").split(",")
+                if url.strip()]
+        try:
+            backends = [RedisBackend(url) for url in urls]
+        except ImportError:
+            # redis is optional; keep working with a per-process cache
+            logger.warning("CACHE_BACKEND=redis but the redis package is not installed; using a per-process cache")
+            return MemoryBackend()
+        return backends[0] if len(backends) == 1 else ShardedBackend(backends, urls)
+    if kind == "file":
+        return FileBackend()
+    return MemoryBackend()
+
+
+class SharedCache:
+    """Namespaced get/set of Python values on a cache backend"""
+
+    def __init__(self, backend=None, namespace="llm-chatbot", serializer=None, ttl=None):
+        self.serializer = serializer or CacheSerializer(os.getenv("CACHE_SECRET"))
+        signed = self.serializer.secret is not None
+        if backend is not None and backend.shared and not signed:
+            raise ValueError("A shared cache backend needs a CacheSerializer with a secret (CACHE_SECRET)")
+        self.backend = backend or load_backend(signed)
+        self.namespace = namespace
+        self.ttl = float(ttl or os.getenv("CACHE_TTL", "86400"))
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'errors': 0, 'writes': 0, 'bytes_read': 0, 'bytes_written': 0}
+
+    @property
+    def shared(self):
+        """Whether other processes see the same entries"""
+        return self.backend.shared
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                self.counters[name] += amount
+
+    def get(self, key, default=None):
+        """Cached value for ``key``, or ``default``"""
+        try:
+            data = self.backend.get(f"{self.namespace}:{key}")
+            if data is None:
+                self._count(misses=1)
+                return default
+            value = self.serializer.loads(data)
+        except Exception:
+            self._count(errors=1, misses=1)
+            return default
+        self._count(hits=1, bytes_read=len(data))
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store ``value``; returns False if the backend failed"""
+        try:
+            data = self.serializer.dumps(value)
+            self.backend.set(f"{self.namespace}:{key}", data, ttl or self.ttl)
+        except Exception:
+            self._count(errors=1)
+            return False
+        self._count(writes=1, bytes_written=len(data))
+        return True
+
+    def delete(self, key):
+        try:
+            self.backend.delete(f"{self.namespace}:{key}")
+        except Exception:
+            self._count(errors=1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                'backend': type(self.backend).__name__,
+                'shared': self.shared,
+                **self.counters,
+                'hit_rate': round(self.counters['hits'] / lookups, 3) if lookups else 0.0,
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """The process-wide SharedCache configured from the environment"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = SharedCache()
+        return _default
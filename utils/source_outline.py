@@ -0,0 +1,298 @@
+"""
+Streaming symbol outline of source code.
+
+Source files and dumps of many files pasted into one ``.txt`` get an
+outline instead of a preview: classes, functions and methods with their
+line numbers and nesting, the modules they import, and (for dumps) the
+files they contain, recognized from markers such as ``==> path <==``,
+``diff --git`` or ``// File: path``. Lines are matched one at a time
+against a few anchored regular expressions per language, so memory stays
+bounded: at most ``OUTLINE_MAX_SYMBOLS`` symbols are listed and the rest
+only counted.
+"""
+
+import os
+import re
+from collections import Counter
+
+EXTENSIONS = {
+    '.py': 'python', '.pyw': 'python', '.js': 'javascript', '.jsx': 'javascript', '.mjs': 'javascript',
+    '.ts': 'typescript', '.tsx': 'typescript', '.java': 'java', '.kt': 'kotlin', '.scala': 'scala',
+    '.cs': 'csharp', '.swift': 'swift', '.go': 'go', '.rs': 'rust', '.c': 'c', '.h': 'c',
+    '.cc': 'cpp', '.cpp': 'cpp', '.cxx': 'cpp', '.hpp': 'cpp', '.rb': 'ruby', '.php': 'php',
+}
+
+_MODIFIERS = r"(?:(?:public|private|protected|internal|static|final|abstract|sealed|partial|override|virtual|" \
+             r"async|synchronized|open|data|inline|export|default|extern|unsafe|const)\s+)*"
+_C_LIKE = [
+    ('class', re.compile(r"(?P<indent>[ \t]*)" + _MODIFIERS +
+                         r"(?P<kind>class|interface|enum|struct|record|object|trait|protocol|namespace)\s+(?P<name>\w+)")),
+    ('method', re.compile(r"(?P<indent>[ \t]*)" + _MODIFIERS +
+                          r"(?!(?:return|new|else|throw|case)\b)[\w<>\[\],.?*&:]+\s+[*&]*(?P<name>[A-Za-z_]\w*)\s*\([^;]*$")),
+]
+# Symbol kinds whose functions are methods
+CONTAINERS = frozenset(('class', 'interface', 'struct', 'record', 'object', 'trait', 'protocol', 'impl', 'type'))
+KEYWORDS = frozenset(('if', 'for', 'while', 'switch', 'catch', 'return', 'sizeof', 'else', 'do', 'using', 'lock'))
+
+PATTERNS = {
+    'python': [
+        ('class', re.compile(r"(?P<indent>[ \t]*)class\s+(?P<name>\w+)")),
+        ('function', re.compile(r"(?P<indent>[ \t]*)(?:async\s+)?def\s+(?P<name>\w+)")),
+    ],
+    'javascript': [
+        ('class', re.compile(r"(?P<indent>[ \t]*)(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+(?P<name>\w+)")),
+        ('function', re.compile(r"(?P<indent>[ \t]*)(?:export\s+)?(?:default\s+)?(?:async\s+)?function\*?\s+(?P<name>\w+)")),
+        ('function', re.compile(r"(?P<indent>[ \t]*)(?:export\s+)?(?:const|let|var)\s+(?P<name>\w+)\s*=\s*"
+                                r"(?:async\s*)?(?:function\b|\([^)]*\)\s*=>|\w+\s*=>)")),
+        ('type', re.compile(r"(?P<indent>[ \t]*)(?:export\s+)?(?:declare\s+)?(?:interface|type|enum)\s+(?P<name>\w+)")),
+        ('method', re.compile(r"(?P<indent>[ \t]+)(?:(?:public|private|protected|static|async|get|set|readonly)\s+)*"
+                              r"(?P<name>[A-Za-z_$][\w$]*)\s*\([^)]*\)\s*(?::\s*[^{=]+)?\{\s*$")),
+    ],
+    'go': [
+        ('function', re.compile(r"(?P<indent>)func\s+(?:\([^)]*\)\s*)?(?P<name>\w+)")),
+        ('type', re.compile(r"(?P<indent>)type\s+(?P<name>\w+)\s+(?:struct|interface)")),
+    ],
+    'rust': [
+        ('function', re.compile(r"(?P<indent>[ \t]*)(?:pub(?:\([^)]*\))?\s+)?(?:const\s+)?(?:async\s+)?(?:unsafe\s+)?"
+                                r"fn\s+(?P<name>\w+)")),
+        ('type', re.compile(r"(?P<indent>[ \t]*)(?:pub(?:\([^)]*\))?\s+)?(?:struct|enum|trait|mod|union)\s+(?P<name>\w+)")),
+        ('impl', re.compile(r"(?P<indent>[ \t]*)impl(?:<[^>]*>)?\s+(?P<name>[\w:<>, ]+?)\s*(?:\{|where|$)")),
+    ],
+    'ruby': [
+        ('class', re.compile(r"(?P<indent>[ \t]*)(?:class|module)\s+(?P<name>[\w:]+)")),
+        ('function', re.compile(r"(?P<indent>[ \t]*)def\s+(?P<name>[\w.?!=]+)")),
+    ],
+    'php': [
+        ('class', re.compile(r"(?P<indent>[ \t]*)(?:abstract\s+|final\s+)?(?:class|interface|trait)\s+(?P<name>\w+)")),
+        ('function', re.compile(r"(?P<indent>[ \t]*)(?:(?:public|private|protected|static)\s+)*function\s+&?(?P<name>\w+)")),
+    ],
+    'kotlin': [
+        _C_LIKE[0],
+        ('function', re.compile(r"(?P<indent>[ \t]*)" + _MODIFIERS + r"fun\s+(?:<[^>]*>\s*)?(?:[\w.]+\.)?(?P<name>\w+)")),
+    ],
+    'swift': [
+        _C_LIKE[0],
+        ('function', re.compile(r"(?P<indent>[ \t]*)" + _MODIFIERS + r"func\s+(?P<name>\w+)")),
+    ],
+}
+PATTERNS['typescript'] = PATTERNS['javascript']
+for _language in ('java', 'csharp', 'scala', 'c', 'cpp'):
+    PATTERNS[_language] = _C_LIKE
+
+IMPORT_RE = {
+    'python': re.compile(r"\s*(?:from\s+([\w.]+)\s+import|import\s+([\w.]+))"),
+    'javascript': re.compile(r"\s*(?:import\s.*?from\s+['\"]([^'\"]+)|(?:const|let|var)\s.*?require\(['\"]([^'\"]+))"),
+    'go': re.compile(r"\s*(?:import\s+)?\"([\w./-]+)\"\s*$"),
+    'rust': re.compile(r"\s*(?:pub\s+)?use\s+([\w:]+)"),
+    'java': re.compile(r"\s*import\s+(?:static\s+)?([\w.]+)"),
+    'kotlin': re.compile(r"\s*import\s+([\w.]+)"),
+    'scala': re.compile(r"\s*import\s+([\w.]+)"),
+    'csharp': re.compile(r"\s*using\s+(?:static\s+)?([\w.]+)\s*;"),
+    'swift': re.compile(r"\s*import\s+(\w+)"),
+    'c': re.compile(r"\s*#\s*include\s*[<\"]([^>\"]+)"),
+    'ruby': re.compile(r"\s*require(?:_relative)?\s+['\"]([^'\"]+)"),
+    'php': re.compile(r"\s*(?:use\s+([\w\\]+)|(?:require|include)(?:_once)?\s*\(?['\"]([^'\"]+))"),
+}
+IMPORT_RE['typescript'] = IMPORT_RE['javascript']
+IMPORT_RE['cpp'] = IMPORT_RE['c']
+
+COMMENT_RE = re.compile(r"\s*(?:#(?!\s*(?:include|define|undef|if|ifdef|ifndef|else|elif|endif|pragma|import)\b|!)"
+                        r"|//|/\*|\*|--|<!--)")
+FILE_MARKER_RE = re.compile(
+    r"(?:==> (?P<tail>.+?) <=="
+    r"|diff --git a/\S+ b/(?P<diff>\S+)"
+    r"|(?:#|//|/\*|--)+\s*(?:[Ff]ile|FILE|[Pp]ath)\s*[:=]\s*(?P<comment>[\w./\\-]+\.\w{1,5})"
+    r"|={3,}\s*(?P<banner>[\w./\\-]+\.\w{1,5})\s*={3,})\s*$"
+)
+
+
+def source_language(filename, lines=()):
+    """Language of a source file by extension, else by which patterns the sample lines match best"""
+    language = EXTENSIONS.get(os.path.splitext(filename or "")[1].lower())
+    if language:
+        return language
+    lines = [line for line in lines if line.strip()]
+    if len(lines) < 5:
+        return None
+    markers = [marker for marker in map(FILE_MARKER_RE.match, lines) if marker]
+    for marker in markers:
+        path = next(path for path in marker.groups() if path)
+        language = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if language:
+            # A dump of files: start with the first file's language
+            return language
+    scores = {}
+    for language, patterns in PATTERNS.items():
+        if language == 'typescript':
+            continue
+        imports = IMPORT_RE.get(language)
+        scores[language] = sum(
+            1 for line in lines
+            if any(pattern.match(line) for _, pattern in patterns) or (imports and imports.match(line))
+        )
+    language, hits = max(scores.items(), key=lambda item: item[1])
+    # Prose matches the looser patterns now and then; code (or a dump with file markers) much more
+    structural = sum(1 for line in lines if line.rstrip().endswith((':', '{', '}', ';', ')')))
+    if hits >= 3 and (hits >= 0.05 * len(lines) and structural >= 0.2 * len(lines) or markers):
+        return language
+    return None
+
+
+class SourceOutline:
+    """Symbols, imports and files of a piece of source code"""
+
+    __slots__ = ('language', 'lines', 'code_lines', 'comment_lines', 'blank_lines', 'files',
+                 'file_count', 'kinds', 'symbols', 'symbol_count', 'imports')
+
+    def __init__(self, language):
+        self.language = language
+        self.lines = self.code_lines = self.comment_lines = self.blank_lines = 0
+        self.files = []       # (path, first line) of each file in a dump
+        self.file_count = 0
+        self.kinds = {}       # kind -> count
+        self.symbols = []     # (file, line, depth, kind, name)
+        self.symbol_count = 0
+        self.imports = []     # (module, count), most used first
+
+    def digest(self):
+        """One line for the prompt"""
+        parts = [f"{self.language} source of {self.lines:,} lines ({self.code_lines:,} code, "
+                 f"{self.comment_lines:,} comment)"]
+        if self.file_count:
+            files = ", ".join(path for path, _ in self.files[:12])
+            parts.append(f"{self.file_count} files: {files}" + (" ..." if self.file_count > 12 else ""))
+        if self.kinds:
+            parts.append(", ".join(f"{count:,} {kind}" for kind, count in self.kinds.items()))
+        top = [name for _, _, depth, _, name in self.symbols if depth == 0]
+        if top:
+            parts.append("top-level: " + ", ".join(top[:40]) + (" ..." if len(top) > 40 else ""))
+        if self.imports:
+            parts.append("imports: " + ", ".join(module for module, _ in self.imports[:15]))
+        return "; ".join(parts)
+
+    def excerpts(self):
+        """Text to search instead of source too big to index: imports and every listed symbol"""
+        lines = ["imports: " + ", ".join(module for module, _ in self.imports)] if self.imports else []
+        lines += [f"{path + ': ' if path else ''}{kind} {name} (line {line})"
+                  for path, line, _, kind, name in self.symbols]
+        return "\n".join(lines)
+
+    def markdown(self, limit=80):
+        """Report section for the UI"""
+        section = "\n\n**Source Outline:**\n"
+        section += f"• Language: {self.language}\n"
+        section += f"• Lines: {self.lines:,} ({self.code_lines:,} code, {self.comment_lines:,} comment, "
+        section += f"{self.blank_lines:,} blank)\n"
+        if self.file_count:
+            section += f"• Files: {self.file_count}\n"
+        if self.kinds:
+            section += "• Symbols: " + ", ".join(f"{count:,} {kind}" for kind, count in self.kinds.items()) + "\n"
+        if self.imports:
+            section += "• Imports: " + ", ".join(f"{module} ({count})" for module, count in self.imports[:15]) + "\n"
+        if self.symbols:
+            section += "\n```\n"
+            current = None
+            for path, line, depth, kind, name in self.symbols[:limit]:
+                if path != current and path:
+                    section += f"{path}\n"
+                    current = path
+                indent = "  " * (depth + (1 if path else 0))
+                section += f"{indent}{kind} {name}  (line {line})\n"
+            if self.symbol_count > limit:
+                section += f"... {self.symbol_count - limit:,} more\n"
+            section += "```\n"
+        return section
+
+
+class SourceOutliner:
+    """Feed lines one at a time (or in lists); finish() returns a SourceOutline"""
+
+    def __init__(self, language, max_symbols=None, max_imports=2000, max_files=1000):
+        self.outline = SourceOutline(language)
+        self.max_symbols = int(max_symbols or os.getenv("OUTLINE_MAX_SYMBOLS", "5000"))
+        self.max_imports = max_imports
+        self.max_files = max_files
+        self.kinds = Counter()
+        self.imports = Counter()
+        self.path = None
+        self._file_start = 0
+        self._scopes = []  # (indent, kind) of the symbols enclosing the current line
+        self._language(language)
+
+    def _language(self, language):
+        self.language = language
+        self.patterns = PATTERNS.get(language, _C_LIKE)
+        self.import_re = IMPORT_RE.get(language)
+
+    def feed_lines(self, lines):
+        for line in lines:
+            self.feed(line)
+
+    def feed(self, line):
+        outline = self.outline
+        outline.lines += 1
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            outline.blank_lines += 1
+            return
+        if line[0] in "=d#/-" or line.startswith("==>"):
+            marker = FILE_MARKER_RE.match(line)
+            if marker:
+                self._start_file(next(path for path in marker.groups() if path))
+                return
+        if COMMENT_RE.match(line):
+            outline.comment_lines += 1
+            return
+        outline.code_lines += 1
+
+        if self.import_re is not None:
+            match = self.import_re.match(line)
+            if match:
+                module = next((name for name in match.groups() if name), None)
+                if module and (module in self.imports or len(self.imports) < self.max_imports):
+                    self.imports[module] += 1
+                return
+        for kind, pattern in self.patterns:
+            match = pattern.match(line)
+            if match is None:
+                continue
+            name = match.group('name').strip()
+            if name in KEYWORDS:
+                continue
+            if 'kind' in pattern.groupindex:
+                kind = match.group('kind')
+            # Nesting follows indentation: symbols indented deeper than the last belong to it
+            indent = len(match.group('indent').expandtabs(4))
+            scopes = self._scopes
+            while scopes and scopes[-1][0] >= indent:
+                scopes.pop()
+            if kind == 'function' and scopes and scopes[-1][1] in CONTAINERS:
+                kind = 'method'
+            self.kinds[kind] += 1
+            outline.symbol_count += 1
+            if len(outline.symbols) < self.max_symbols:
+                outline.symbols.append((self.path, outline.lines - self._file_start, len(scopes), kind, name))
+            scopes.append((indent, kind))
+            break
+
+    def _start_file(self, path):
+        path = path.strip()
+        self.path = path
+        outline = self.outline
+        self._file_start = outline.lines
+        self._scopes = []
+        outline.file_count += 1
+        if len(outline.files) < self.max_files:
+            outline.files.append((path, outline.lines))
+        language = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if language:
+            self._language(language)
+
+    def finish(self):
+        outline = self.outline
+        outline.kinds = dict(self.kinds.most_common())
+        outline.imports = self.imports.most_common(50)
+        if outline.file_count:
+            outline.language = ", ".join(sorted({EXTENSIONS.get(os.path.splitext(path)[1].lower(), outline.language)
+                                                 for path, _ in outline.files}))
+        return outline
@@ -0,0 +1,176 @@
+"""
+Lightweight retrieval index over extracted document text.
+
+Documents are split into overlapping chunks on paragraph boundaries and
+indexed with BM25, so the most relevant passages of a large file can be
+put in front of the model instead of just its first few hundred characters.
+"""
+
+import math
+import re
+from array import array
+from collections import Counter, defaultdict
+
+TOKEN_RE = re.compile(r"[a-z0-9_]+")
+
+# Very common words that carry no retrieval signal
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i in is it its of on or
+that the this to was were will with you your what which who how can do
+does about into me my we our they their them there than then so if not
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords or single characters"""
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _chunk_bounds(text, chunk_size, overlap):
+    """(start, end) offsets of the chunks of ``text``"""
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            # Prefer a paragraph break, then a line break, then a space
+            for separator in ("\n\n", "\n", " "):
+                cut = text.rfind(separator, start + chunk_size // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        yield start, end
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+
+
+def chunk_text(text, chunk_size=800, overlap=100):
+    """Split text into chunks of about ``chunk_size`` characters
+
+    Chunks end on paragraph or line breaks where possible and consecutive
+    chunks share ``overlap`` characters so sentences cut at a boundary are
+    still retrievable.
+    """
+    for start, end in _chunk_bounds(text, chunk_size, overlap):
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+
+
+def chunk_stream(pieces, chunk_size=800, overlap=100):
+    """Like chunk_text, but over an iterable of text pieces (e.g. PDF pages)
+
+    Chunks are emitted as soon as enough text has arrived, so indexing can
+    run alongside extraction.
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) < 2 * chunk_size:
+            continue
+        bounds = list(_chunk_bounds(buffer, chunk_size, overlap))
+        for start, end in bounds[:-1]:
+            chunk = buffer[start:end].strip()
+            if chunk:
+                yield chunk
+        # The last chunk may continue in the next piece
+        buffer = buffer[bounds[-1][0]:]
+    yield from chunk_text(buffer, chunk_size, overlap)
+
+
+class PackedPostings:
+    """Read-only postings restored from flat arrays, decoded per term on lookup"""
+
+    def __init__(self, terms, offsets, chunk_ids, frequencies):
+        self._positions = {term: position for position, term in enumerate(terms)}
+        self._offsets = offsets
+        self._chunk_ids = chunk_ids
+        self._frequencies = frequencies
+
+    def get(self, term, default=None):
+        position = self._positions.get(term)
+        if position is None:
+            return default
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return list(zip(self._chunk_ids[start:end], self._frequencies[start:end]))
+
+    def __len__(self):
+        return len(self._positions)
+
+
+class TextIndex:
+    """BM25 index over the chunks of one document"""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(chunk id, term frequency)]
+        self.lengths = []
+
+        for chunk_id, chunk in enumerate(self.chunks):
+            counts = Counter(tokenize(chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((chunk_id, tf))
+
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    @classmethod
+    def from_text(cls, text, chunk_size=800, overlap=100):
+        """Chunk and index a document"""
+        return cls(chunk_text(text, chunk_size, overlap))
+
+    @classmethod
+    def from_pieces(cls, pieces, chunk_size=800, overlap=100):
+        """Chunk and index text arriving in pieces"""
+        return cls(chunk_stream(pieces, chunk_size, overlap))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __getstate__(self):
+        # Flat arrays pickle and load an order of magnitude faster than
+        # a dict of lists of tuples, which matters for the shared cache
+        terms = list(self.postings._positions if isinstance(self.postings, PackedPostings) else self.postings)
+        offsets, chunk_ids, frequencies = array('I', [0]), array('I'), array('I')
+        for term in terms:
+            for chunk_id, tf in self.postings.get(term):
+                chunk_ids.append(chunk_id)
+                frequencies.append(tf)
+            offsets.append(len(chunk_ids))
+        return {
+            'chunks': self.chunks, 'k1': self.k1, 'b': self.b,
+            'lengths': array('I', self.lengths), 'avg_length': self.avg_length,
+            'terms': "\n".join(terms), 'offsets': offsets,
+            'chunk_ids': chunk_ids, 'frequencies': frequencies,
+        }
+
+    def __setstate__(self, state):
+        self.chunks = state['chunks']
+        self.k1 = state['k1']
+        self.b = state['b']
+        self.lengths = state['lengths']
+        self.avg_length = state['avg_length']
+        terms = state['terms'].split("\n") if state['terms'] else []
+        self.postings = PackedPostings(terms, state['offsets'], state['chunk_ids'], state['frequencies'])
+
+    def search(self, query, k=3):
+        """Top ``k`` chunks for ``query`` as (score, chunk id, text), best first"""
+        if not self.chunks:
+            return []
+
+        scores = defaultdict(float)
+        total = len(self.chunks)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / (self.avg_length or 1))
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(score, chunk_id, self.chunks[chunk_id]) for chunk_id, score in best]
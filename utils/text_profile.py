@@ -0,0 +1,311 @@
+"""
+Profile of a document's text, built in one chunked pass.
+
+Beyond word and line counts, the profile gives the model something to go
+on for a file too large to send: the language, keywords scored by TF-IDF
+against a bundled background list of common English words
+(assets/background_terms.txt), and structural cues such as an outline of
+the headings, fenced code blocks, tables and delimited (CSV/TSV) data.
+Text is fed in pieces (a whole file in slices, or PDF pages as they are
+extracted); each complete block of lines is scanned once with compiled
+regular expressions, Counters and a NumPy histogram of code points.
+"""
+
+import math
+import os
+import re
+from collections import Counter
+
+from utils.analysis_result import PREVIEW_CHARS, ExtractedText
+
+BACKGROUND_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "assets", "background_terms.txt")
+
+# Most frequent function words per language, for telling Latin-script languages apart
+LANGUAGE_STOPWORDS = {
+    'en': "the of and to in is that it was for on are with as be at by this have from or not but",
+    'de': "der die und den von zu das mit sich des auf für ist im dem nicht ein eine als auch es werden aus er hat dass sie nach wird bei",
+    'fr': "le la les de des et en du un une est que pour qui dans par sur pas au plus ne se ce il sont avec",
+    'es': "el la de que y en los del las un por con no una para es se al lo como más pero sus le",
+    'it': "il di che la e un per non una del della è sono le si con da gli nel alla anche come ma",
+    'pt': "de que e o da do em um para com não uma os no se na por mais as dos como mas ao",
+    'nl': "de het een en van in is dat op te zijn met voor niet die aan er ook als bij maar om",
+    'sv': "och i att det som en på är av för med till den har de inte om ett men",
+}
+LANGUAGE_STOPWORDS = {language: frozenset(words.split()) for language, words in LANGUAGE_STOPWORDS.items()}
+ALL_STOPWORDS = frozenset().union(*LANGUAGE_STOPWORDS.values())
+
+# Unicode blocks that identify a script (and, for most, the language)
+SCRIPTS = (
+    (0x41, 0x5A, 'Latin'), (0x61, 0x7A, 'Latin'), (0xC0, 0x24F, 'Latin'),
+    (0x370, 0x3FF, 'Greek'), (0x400, 0x4FF, 'Cyrillic'), (0x590, 0x5FF, 'Hebrew'),
+    (0x600, 0x6FF, 'Arabic'), (0x900, 0x97F, 'Devanagari'), (0xE00, 0xE7F, 'Thai'),
+    (0x3040, 0x30FF, 'Kana'), (0x4E00, 0x9FFF, 'Han'), (0xAC00, 0xD7AF, 'Hangul'),
+)
+SCRIPT_LANGUAGES = {'Greek': 'el', 'Cyrillic': 'ru', 'Hebrew': 'he', 'Arabic': 'ar',
+                    'Devanagari': 'hi', 'Thai': 'th', 'Hangul': 'ko'}
+
+TERM_RE = re.compile(r"[^\W\d_]{3,}")
+HEADING_RE = re.compile(r"^ {0,3}#{1,6}[ \t]+(.+?)[ \t#]*$", re.M)
+SETEXT_RE = re.compile(r"^([^\n]{3,80})\n(?:=+|-+)[ \t]*$", re.M)
+NUMBERED_RE = re.compile(r"^(\d+(?:\.\d+)*\.?)[ \t]+([A-Z][^\n.!?:;]{2,70})$", re.M)
+CAPS_RE = re.compile(r"^([A-Z][A-Z0-9 &,'-]{3,60})$", re.M)
+FENCE_RE = re.compile(r"^[ \t]*(?:```|~~~)", re.M)
+CODE_RE = re.compile(
+    r"^[ \t]*(?:def |class |import |from \S+ import |function |const |let |var |public |private |"
+    r"#include|return\b|[}\]);]+$)", re.M
+)
+# Statements and blocks ending in ; or { (checked separately: a leading .* would backtrack on every line)
+CODE_END_RE = re.compile(r"[;{][ \t]*$", re.M)
+TABLE_ROW_RE = re.compile(r"^[ \t]*\|.*\|[ \t]*$", re.M)
+TABLE_RULE_RE = re.compile(r"^[ \t]*\|?[ \t]*:?-{3,}:?[ \t]*(?:\|[ \t]*:?-{3,}:?[ \t]*)+\|?[ \t]*$", re.M)
+LIST_RE = re.compile(r"^[ \t]*(?:[-*•]|\d+[.)])[ \t]+\S", re.M)
+
+# Lines sampled to recognize delimited data
+DELIMITER_SAMPLE = 1000
+
+_background = None
+
+
+def background_ranks():
+    """term -> frequency rank in the background list (1 = most common)"""
+    global _background
+    if _background is None:
+        ranks = {}
+        try:
+            with open(BACKGROUND_PATH, encoding='utf-8') as handle:
+                for line in handle:
+                    term = line.strip()
+                    if term and not term.startswith('#'):
+                        ranks.setdefault(term, len(ranks) + 1)
+        except OSError:
+            pass
+        _background = ranks
+    return _background
+
+
+def idf(term, ranks):
+    """Inverse document frequency estimated from the term's background rank
+
+    By Zipf's law a term's document frequency falls roughly as 1/rank, so
+    its IDF grows with log(rank); unlisted terms count as rarer than all.
+    """
+    rank = ranks.get(term, 4 * len(ranks) + 1)
+    return math.log(1 + rank / 10)
+
+
+class TextProfile:
+    """Language, keywords and structure of a document's text"""
+
+    __slots__ = ('language', 'language_confidence', 'script', 'keywords', 'outline', 'headings',
+                 'code_blocks', 'code_lines', 'tables', 'table_rows', 'list_items', 'delimited')
+
+    def __init__(self):
+        self.language = None
+        self.language_confidence = 0.0
+        self.script = None
+        self.keywords = []      # [(term, count)], best first
+        self.outline = []       # first headings, in order
+        self.headings = 0
+        self.code_blocks = 0
+        self.code_lines = 0
+        self.tables = 0
+        self.table_rows = 0
+        self.list_items = 0
+        self.delimited = None   # (delimiter name, columns) for CSV/TSV-like data
+
+    def digest(self):
+        """Compact description, e.g. "lang en; keywords: revenue, board; 4 headings: ..." """
+        parts = []
+        if self.language:
+            parts.append(f"lang {self.language}")
+        if self.keywords:
+            parts.append("keywords: " + ", ".join(term for term, _ in self.keywords[:10]))
+        if self.headings:
+            outline = " | ".join(heading[:40] for heading in self.outline[:8])
+            parts.append(f"{self.headings} headings: {outline}")
+        if self.delimited:
+            name, columns = self.delimited
+            parts.append(f"{name} data, {columns} columns")
+        if self.tables:
+            parts.append(f"{self.tables} tables ({self.table_rows} rows)")
+        if self.code_blocks or self.code_lines > 20:
+            parts.append(f"code: {self.code_blocks} blocks, {self.code_lines} lines")
+        if self.list_items:
+            parts.append(f"{self.list_items} list items")
+        return "; ".join(parts)
+
+    def markdown(self):
+        """Report section for the UI"""
+        section = "\n\n**Content Profile:**\n"
+        if self.language:
+            section += f"• Language: {self.language} ({self.language_confidence:.0%}, {self.script} script)\n"
+        if self.keywords:
+            section += "• Keywords: " + ", ".join(f"{term} ({count})" for term, count in self.keywords[:12]) + "\n"
+        if self.headings:
+            section += f"• Headings: {self.headings} — " + " · ".join(self.outline[:8]) + "\n"
+        if self.delimited:
+            section += f"• Delimited Data: {self.delimited[0]}, {self.delimited[1]} columns\n"
+        if self.tables:
+            section += f"• Tables: {self.tables} ({self.table_rows} rows)\n"
+        if self.code_blocks or self.code_lines:
+            section += f"• Code: {self.code_blocks} fenced blocks, {self.code_lines} code-like lines\n"
+        if self.list_items:
+            section += f"• List Items: {self.list_items}\n"
+        return section
+
+
+class TextProfiler:
+    """Accumulates counts over text fed in pieces; finish() returns the results"""
+
+    def __init__(self, block_size=256 * 1024, max_outline=12, max_keywords=20):
+        self.block_size = block_size
+        self.max_outline = max_outline
+        self.max_keywords = max_keywords
+        self._buffer = []
+        self._buffered = 0
+        self.characters = 0
+        self.words = 0
+        self.newlines = 0
+        self.head = ""
+        self.last_char = ""
+        self.terms = Counter()
+        self.stopwords = Counter()
+        self.scripts = Counter()
+        self.profile = TextProfile()
+        self.fences = 0
+        self._sampled_lines = 0
+        self._delimiters = {',': Counter(), '\t': Counter(), ';': Counter()}
+
+    def feed(self, piece):
+        """Add the next piece of text"""
+        if not piece:
+            return
+        if len(self.head) < PREVIEW_CHARS:
+            self.head += piece[:PREVIEW_CHARS - len(self.head)]
+        self.characters += len(piece)
+        self.last_char = piece[-1]
+        self._buffer.append(piece)
+        self._buffered += len(piece)
+        if self._buffered >= self.block_size:
+            block = "".join(self._buffer)
+            # Scan whole lines only, so no word or heading is split between blocks
+            cut = block.rfind("\n") + 1
+            if cut:
+                self._scan(block[:cut])
+                block = block[cut:]
+            self._buffer = [block] if block else []
+            self._buffered = len(block)
+
+    def feed_text(self, text):
+        """Feed a whole string in blocks"""
+        for start in range(0, len(text), self.block_size):
+            self.feed(text[start:start + self.block_size])
+
+    def _scan(self, block):
+        import numpy as np
+
+        self.words += len(block.split())
+        self.newlines += block.count("\n")
+        # Stopwords are split off in finish()
+        self.terms.update(TERM_RE.findall(block.lower()))
+
+        # Script histogram: bucket every code point by the block it falls in
+        codes = np.frombuffer(block.encode('utf-32-le'), dtype='<u4')
+        edges = np.array([edge for start, end, _ in SCRIPTS for edge in (start, end + 1)], dtype=np.uint32)
+        counts = np.bincount(np.searchsorted(edges, codes, side='right'), minlength=len(edges) + 1)
+        for position, (_, _, script) in enumerate(SCRIPTS):
+            if counts[2 * position + 1]:
+                self.scripts[script] += int(counts[2 * position + 1])
+
+        profile = self.profile
+        headings = [match.group(1) for match in HEADING_RE.finditer(block)]
+        headings += [match.group(1) for match in SETEXT_RE.finditer(block)
+                     if not TABLE_ROW_RE.match(match.group(1))]
+        headings += [f"{match.group(1)} {match.group(2)}" for match in NUMBERED_RE.finditer(block)]
+        headings += [match.group(1).title() for match in CAPS_RE.finditer(block) if " " in match.group(1).strip()
+                     or len(match.group(1)) >= 6]
+        profile.headings += len(headings)
+        room = self.max_outline - len(profile.outline)
+        if room > 0:
+            # Keep document order within the block
+            positions = sorted((block.find(heading) if block.find(heading) >= 0 else len(block), heading.strip())
+                               for heading in headings)
+            profile.outline.extend(heading for _, heading in positions[:room])
+
+        self.fences += len(FENCE_RE.findall(block))
+        profile.code_lines += len(CODE_RE.findall(block)) + len(CODE_END_RE.findall(block))
+        profile.table_rows += len(TABLE_ROW_RE.findall(block))
+        profile.tables += len(TABLE_RULE_RE.findall(block))
+        profile.list_items += len(LIST_RE.findall(block))
+
+        if self._sampled_lines < DELIMITER_SAMPLE:
+            lines = block.split("\n", DELIMITER_SAMPLE - self._sampled_lines)[:DELIMITER_SAMPLE - self._sampled_lines]
+            lines = [line for line in lines if line.strip()]
+            self._sampled_lines += len(lines)
+            for delimiter, columns in self._delimiters.items():
+                columns.update(line.count(delimiter) for line in lines)
+
+    def finish(self):
+        """(ExtractedText, TextProfile) for everything fed so far"""
+        if self._buffer:
+            self._scan("".join(self._buffer))
+            self._buffer = []
+        profile = self.profile
+        for word in ALL_STOPWORDS & self.terms.keys():
+            self.stopwords[word] = self.terms.pop(word)
+        lines = self.newlines + (1 if self.characters and self.last_char != "\n" else 0)
+        text = ExtractedText(self.characters, self.words, lines, self.head)
+
+        profile.code_blocks = self.fences // 2
+        profile.script, profile.language, profile.language_confidence = self._language()
+
+        # Delimited data: most sampled lines have the same number (2+) of delimiters
+        for delimiter, name in ((',', 'CSV'), ('\t', 'TSV'), (';', 'semicolon-separated')):
+            count, lines_with_count = max(self._delimiters[delimiter].items(), key=lambda item: item[1],
+                                          default=(0, 0))
+            if count >= 2 and self._sampled_lines >= 3 and lines_with_count >= 0.8 * self._sampled_lines:
+                profile.delimited = (name, count + 1)
+                break
+
+        ranks = background_ranks()
+        # Terms seen once are noise in a long document
+        min_count = 2 if self.words > 500 else 1
+        scored = [
+            ((1 + math.log(count)) * idf(term, ranks), term, count)
+            for term, count in self.terms.items() if count >= min_count
+        ]
+        scored.sort(reverse=True)
+        profile.keywords = [(term, count) for _, term, count in scored[:self.max_keywords]]
+        return text, profile
+
+    def _language(self):
+        """(script, language code, confidence) from the script histogram and stopword hits"""
+        letters = sum(self.scripts.values())
+        if not letters:
+            return None, None, 0.0
+        script, count = self.scripts.most_common(1)[0]
+        if script in ('Han', 'Kana'):
+            kana = self.scripts.get('Kana', 0)
+            han = self.scripts.get('Han', 0)
+            # Japanese mixes kana into kanji text; Chinese has none
+            language = 'ja' if kana >= 0.1 * (kana + han) else 'zh'
+            return 'CJK', language, round((kana + han) / letters, 2)
+        if script != 'Latin':
+            return script, SCRIPT_LANGUAGES.get(script), round(count / letters, 2)
+        hits = {
+            language: sum(self.stopwords[word] for word in words)
+            for language, words in LANGUAGE_STOPWORDS.items()
+        }
+        language, best = max(hits.items(), key=lambda item: item[1])
+        total = sum(self.stopwords.values())
+        if not best or best < 5:
+            return script, None, 0.0
+        return script, language, round(best / total, 2)
+
+
+def profile_text(text):
+    """(ExtractedText, TextProfile) of a complete string"""
+    profiler = TextProfiler()
+    profiler.feed_text(text)
+    return profiler.finish()
@@ -0,0 +1,225 @@
+"""
+HTTP transport shared by the provider clients.
+
+The OpenAI SDK creates its own httpx client with default limits (keep-alive
+connections expire after 5 s idle) and opens it lazily, so the first
+request after a deploy, and the first after a quiet spell, pays DNS, TCP
+and TLS setup inside someone's turn. Instead every provider endpoint gets
+one pooled client per process (``http_pool``), configured from the
+environment:
+
+* ``AI_HTTP2``: ``auto`` or ``1`` speaks HTTP/2 when the ``h2`` package is
+  installed, so concurrent requests share one connection; ``0`` (default)
+  keeps HTTP/1.1 keep-alive. A cancelled HTTP/2 answer can only close its
+  own stream, which may not wake the thread reading it until the next frame
+  arrives, while HTTP/1.1 cancellation shuts the socket down at once;
+* ``AI_MAX_CONNECTIONS`` / ``AI_MAX_KEEPALIVE``: pool size and idle
+  connections kept open (defaults 64 and 16);
+* ``AI_KEEPALIVE_EXPIRY``: seconds an idle connection is kept (default 120);
+* ``AI_CA_BUNDLE``: CA file to verify the provider with (e.g. a local TLS stub).
+
+Streamed answers get their connection back too: the SDK stops reading at
+``data: [DONE]`` and closes the response one empty chunk before the end of
+an HTTP/1.1 body, which makes httpcore drop the connection; the transport
+reads that last chunk first.
+
+``warm_up`` opens a connection to every provider before the first user
+needs one; ``run.py`` and the API start it with the process. Each pool
+counts requests, new connections and TLS handshakes through httpcore's
+trace hook, so ``/v1/stats`` shows how often connections are reused.
+"""
+
+import importlib.util
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TransportConfig:
+    """Pool limits and protocol settings from the environment"""
+
+    __slots__ = ('http2', 'max_connections', 'max_keepalive', 'keepalive_expiry', 'ca_bundle')
+
+    def __init__(self, http2=None, max_connections=None, max_keepalive=None, keepalive_expiry=None,
+                 ca_bundle=None):
+        if http2 is None:
+            setting = os.getenv("AI_HTTP2", "0")
+            http2 = setting in ("auto", "1") and importlib.util.find_spec("h2") is not None
+        self.http2 = http2
+        self.max_connections = int(max_connections or os.getenv("AI_MAX_CONNECTIONS", "64"))
+        self.max_keepalive = int(max_keepalive if max_keepalive is not None
+                                 else os.getenv("AI_MAX_KEEPALIVE", "16"))
+        self.keepalive_expiry = float(keepalive_expiry or os.getenv("AI_KEEPALIVE_EXPIRY", "120"))
+        self.ca_bundle = ca_bundle or os.getenv("AI_CA_BUNDLE") or None
+
+
+class ConnectionStats:
+    """Requests against connections opened, from httpcore trace events"""
+
+    def __init__(self, samples=1000):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.http2_responses = 0
+        self.warm_ups = 0
+        self.connect_ms = deque(maxlen=samples)
+        self.tls_ms = deque(maxlen=samples)
+
+    def on_request(self, request):
+        # One trace callback per request, timing its own connection setup
+        started = {}
+
+        def trace(event, info):
+            step, _, phase = event.rpartition(".")
+            if phase == "started":
+                started[step] = time.perf_counter()
+            elif phase == "complete" and step in ("connection.connect_tcp", "connection.start_tls"):
+                elapsed = (time.perf_counter() - started.get(step, time.perf_counter())) * 1000
+                with self.lock:
+                    if step == "connection.connect_tcp":
+                        self.connections += 1
+                        self.connect_ms.append(elapsed)
+                    else:
+                        self.tls_handshakes += 1
+                        self.tls_ms.append(elapsed)
+
+        request.extensions["trace"] = trace
+
+    def on_response(self, response):
+        with self.lock:
+            self.requests += 1
+            if response.http_version == "HTTP/2":
+                self.http2_responses += 1
+
+    def snapshot(self):
+        with self.lock:
+            connect = sorted(self.connect_ms)
+            tls = sorted(self.tls_ms)
+            return {
+                'requests': self.requests,
+                'connections_opened': self.connections,
+                'reuse_rate': round(1 - self.connections / self.requests, 3) if self.requests else None,
+                'tls_handshakes': self.tls_handshakes,
+                'http2_share': round(self.http2_responses / self.requests, 3) if self.requests else None,
+                'connect_ms_p50': round(connect[len(connect) // 2], 1) if connect else None,
+                'tls_ms_p50': round(tls[len(tls) // 2], 1) if tls else None,
+                'warm_ups': self.warm_ups,
+            }
+
+
+def _transport(config):
+    import httpx
+
+    class DrainingStream(httpx.SyncByteStream):
+        """Response body that, once the SSE end marker went by, reads what is left on close"""
+
+        def __init__(self, stream):
+            self._stream = stream
+            self._chunks = None
+            self._done = False
+
+        def __iter__(self):
+            self._chunks = iter(self._stream)
+            for chunk in self._chunks:
+                if chunk.rstrip().endswith(b"data: [DONE]"):
+                    self._done = True
+                yield chunk
+
+        def close(self):
+            # Only after [DONE]: the server has finished, so the rest is just the final chunk.
+            # A stream cut off mid-answer is closed at once.
+            if self._done and self._chunks is not None:
+                for _ in self._chunks:
+                    pass
+            self._stream.close()
+
+    class PooledTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            response = super().handle_request(request)
+            if response.headers.get("content-type", "").startswith("text/event-stream"):
+                response.stream = DrainingStream(response.stream)
+            return response
+
+    return PooledTransport(
+        http2=config.http2,
+        verify=config.ca_bundle or True,
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+    )
+
+
+class HttpPool:
+    """A pooled httpx client plus its connection statistics"""
+
+    __slots__ = ('client', 'stats', 'config')
+
+    def __init__(self, timeout, config=None):
+        import httpx
+
+        self.config = config or TransportConfig()
+        self.stats = ConnectionStats()
+        self.client = httpx.Client(
+            transport=_transport(self.config),
+            timeout=timeout,
+            follow_redirects=True,
+            event_hooks={'request': [self.stats.on_request], 'response': [self.stats.on_response]},
+        )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def http_pool(base_url, timeout, connect_timeout):
+    """The process-wide pool for an endpoint and timeouts, created on first use"""
+    key = (base_url or "", timeout, connect_timeout)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            import httpx
+
+            pool = _pools[key] = HttpPool(httpx.Timeout(timeout, connect=connect_timeout))
+        return pool
+
+
+def warm_up(providers, timeout=5.0):
+    """Open a connection to every provider; returns {name: result} for logging
+
+    A small authenticated GET of ``/models`` resolves the host, connects,
+    negotiates TLS (and HTTP/2) and leaves the connection in the pool. Any
+    HTTP answer counts as warm, even an error status.
+    """
+    def one(provider):
+        start = time.perf_counter()
+        try:
+            response = provider.http.client.get(
+                f"{str(provider.client.base_url).rstrip('/')}/models",
+                headers=provider.client.auth_headers,
+                timeout=timeout,
+            )
+            response.read()
+            with provider.http.stats.lock:
+                provider.http.stats.warm_ups += 1
+            return provider.name, {'ok': True, 'status': response.status_code, 'http_version': response.http_version,
+                                   'ms': round((time.perf_counter() - start) * 1000, 1)}
+        except Exception as e:
+            return provider.name, {'ok': False, 'error': type(e).__name__,
+                                   'ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    if not providers:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(providers)) as pool:
+        return dict(pool.map(one, providers))
+
+
+def start_warm_up(providers, timeout=5.0):
+    """Run warm_up on a background thread; returns the thread"""
+    thread = threading.Thread(target=warm_up, args=(providers, timeout), name="warm-up", daemon=True)
+    thread.start()
+    return thread
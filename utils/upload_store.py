@@ -0,0 +1,267 @@
+"""
+Zero-copy handling of uploaded files.
+
+An UploadBuffer wraps an upload without copying it: small files are kept
+as a memoryview of the upload's own buffer, large ones are spilled once to
+the uploads directory and memory-mapped. Parsers get a seekable stream
+over the view or the spilled file's path, so peak memory per upload stays
+close to the file size. UploadLimits enforces per-file and per-session
+byte budgets.
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the per-file or per-session limit"""
+
+
+class UploadLimits:
+    """Byte limits and spill settings, configurable from the environment"""
+
+    def __init__(self, max_file_bytes=None, max_session_bytes=None, spill_threshold=None, spill_dir=None):
+        mb = 1024 * 1024
+        self.max_file_bytes = max_file_bytes or int(float(os.getenv("UPLOAD_MAX_FILE_MB", "50")) * mb)
+        self.max_session_bytes = max_session_bytes or int(float(os.getenv("UPLOAD_MAX_SESSION_MB", "200")) * mb)
+        self.spill_threshold = spill_threshold or int(float(os.getenv("UPLOAD_SPILL_MB", "8")) * mb)
+        self.spill_dir = spill_dir or os.path.join(os.getenv("UPLOAD_DIR", "uploads"), "spill")
+
+    def check_file(self, name, size):
+        """Raise UploadTooLarge if one file is over the limit"""
+        if size > self.max_file_bytes:
+            raise UploadTooLarge(
+                f"{name} is {size / (1024*1024):.1f} MB; the limit is "
+                f"{self.max_file_bytes / (1024*1024):.0f} MB per file"
+            )
+
+    def check_session(self, name, size, session_bytes):
+        """Raise UploadTooLarge if adding ``size`` bytes overflows the session budget"""
+        self.check_file(name, size)
+        if session_bytes + size > self.max_session_bytes:
+            raise UploadTooLarge(
+                f"Adding {name} would exceed the "
+                f"{self.max_session_bytes / (1024*1024):.0f} MB upload limit for this session"
+            )
+
+
+class ViewReader(io.RawIOBase):
+    """Seekable read-only stream over a memoryview, without copying it"""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = len(self._view) - self._pos
+        count = min(len(buffer), remaining)
+        if count <= 0:
+            return 0
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class UploadBuffer:
+    """An upload held as a memoryview or as a spilled, memory-mapped file"""
+
+    def __init__(self, name, data=None, path=None, owns_path=False):
+        self.name = name
+        self._base = data if isinstance(data, memoryview) else None
+        self._view = memoryview(data).cast('B') if data is not None else None
+        self._path = path
+        self._owns_path = owns_path
+        self._mmap = None
+        self._digest = None
+        self._lock = threading.Lock()
+        if self._view is not None:
+            self.size = self._view.nbytes
+        else:
+            self.size = os.path.getsize(path)
+
+    @classmethod
+    def wrap(cls, name, data):
+        """Buffer for bytes-like data or an existing UploadBuffer"""
+        return data if isinstance(data, cls) else cls(name, data)
+
+    @classmethod
+    def from_upload(cls, uploaded_file, limits=None):
+        """Buffer over an in-memory upload (e.g. Streamlit's UploadedFile)
+
+        Uses the upload's own buffer when it exposes one; files above the
+        spill threshold are written to disk once so parsers can work on a
+        path or an mmap.
+        """
+        limits = limits or UploadLimits()
+        name = getattr(uploaded_file, 'name', 'upload')
+        if hasattr(uploaded_file, 'getbuffer'):
+            view = uploaded_file.getbuffer()
+        else:
+            view = memoryview(uploaded_file.read())
+        limits.check_file(name, view.nbytes)
+
+        if view.nbytes <= limits.spill_threshold:
+            return cls(name, view)
+
+        try:
+            path = _spill(view, limits.spill_dir, name)
+        finally:
+            view.release()
+        return cls(name, path=path, owns_path=True)
+
+    @classmethod
+    def from_stream(cls, name, stream, limits=None):
+        """Buffer from a file-like object, spilling to disk past the threshold
+
+        Reads in chunks and raises UploadTooLarge as soon as the per-file
+        limit is crossed, without buffering the rest.
+        """
+        limits = limits or UploadLimits()
+        data = bytearray()
+        handle = None
+        path = None
+        size = 0
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                limits.check_file(name, size)
+                if handle is None and size > limits.spill_threshold:
+                    os.makedirs(limits.spill_dir, exist_ok=True)
+                    fd, path = tempfile.mkstemp(dir=limits.spill_dir, suffix=_suffix(name))
+                    handle = os.fdopen(fd, 'wb')
+                    handle.write(data)
+                    data = None
+                if handle is not None:
+                    handle.write(chunk)
+                else:
+                    data += chunk
+        except BaseException:
+            if handle is not None:
+                handle.close()
+                os.unlink(path)
+            raise
+
+        if handle is None:
+            return cls(name, data)
+        handle.close()
+        return cls(name, path=path, owns_path=True)
+
+    @property
+    def spilled(self):
+        """Whether the contents live on disk"""
+        return self._view is None
+
+    def view(self):
+        """memoryview of the contents (an mmap for spilled files)"""
+        if self._view is not None:
+            return self._view
+        with self._lock:
+            if self._mmap is None:
+                if self.size == 0:
+                    return memoryview(b'')
+                with open(self._path, 'rb') as handle:
+                    self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._mmap)
+
+    def head(self, count=8192):
+        """The first ``count`` bytes, for type sniffing"""
+        if self._view is not None:
+            return bytes(self._view[:count])
+        with open(self._path, 'rb') as handle:
+            return handle.read(count)
+
+    def stream(self):
+        """Seekable binary stream over the contents"""
+        if self._view is not None:
+            return ViewReader(self._view)
+        return open(self._path, 'rb')
+
+    def path(self, spill_dir=None):
+        """Path of a file holding the contents, spilling in-memory data if needed"""
+        with self._lock:
+            if self._path is None:
+                self._path = _spill(self._view, spill_dir or UploadLimits().spill_dir, self.name)
+                self._owns_path = True
+            return self._path
+
+    def sha256(self):
+        """Hex digest of the contents, computed once"""
+        if self._digest is None:
+            digest = hashlib.sha256()
+            if self._view is not None:
+                digest.update(self._view)
+            else:
+                with open(self._path, 'rb') as handle:
+                    for chunk in iter(lambda: handle.read(CHUNK_SIZE), b''):
+                        digest.update(chunk)
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def close(self):
+        """Release views and the mmap, and remove any file this buffer spilled"""
+        with self._lock:
+            # Hand the upload's buffer back so its owner can resize or close it
+            for view in (self._view, self._base):
+                if view is not None:
+                    try:
+                        view.release()
+                    except BufferError:
+                        pass
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    # A parser still holds a view; the mapping goes with it
+                    pass
+                self._mmap = None
+            if self._owns_path and self._path:
+                try:
+                    os.unlink(self._path)
+                except OSError:
+                    pass
+                self._path = None
+                self._owns_path = False
+
+    def __len__(self):
+        return self.size
+
+
+def _suffix(name):
+    return os.path.splitext(name)[1][:16]
+
+
+def _spill(view, spill_dir, name):
+    """Write ``view`` to a new file in ``spill_dir`` and return its path"""
+    os.makedirs(spill_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=spill_dir, suffix=_suffix(name))
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(view)
+    return path
@@ -0,0 +1,195 @@
+"""
+Batching of many images into few vision requests.
+
+Sending twenty screenshots as twenty full-size ``image_url`` parts makes
+one huge, slow request. Instead, small images are tiled into grid
+composites whose cells are labelled with the image number, and the
+resulting parts are packed into requests under a pixel budget. When one
+request is not enough, the requests run concurrently and their answers
+are merged in image order.
+"""
+
+import base64
+import io
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.frames import compose_grid
+
+
+class VisionItem:
+    """One uploaded image, numbered in upload order"""
+
+    __slots__ = ('number', 'filename', 'image')
+
+    def __init__(self, number, filename, image):
+        self.number = number
+        self.filename = filename
+        self.image = image  # PreparedImage
+
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+    @property
+    def sized(self):
+        """Whether the image's dimensions could be read"""
+        return bool(self.width and self.height)
+
+    @property
+    def pixels(self):
+        return self.width * self.height if self.sized else None
+
+    def open(self):
+        """Decoded PIL image"""
+        return self.image.open()
+
+
+def vision_items(file_analysis_results):
+    """VisionItems for the images among the analysis results, readable dimensions or not"""
+    items = []
+    for result in file_analysis_results or []:
+        if result.is_image:
+            items.append(VisionItem(len(items) + 1, result.filename, result.image))
+    return items
+
+
+class VisionBatch:
+    """Images and the content parts carrying them in one request"""
+
+    def __init__(self):
+        self.items = []
+        self.parts = []
+        self.pixels = 0
+
+    def add(self, items, part, pixels):
+        self.items.extend(items)
+        self.parts.append(part)
+        self.pixels += pixels
+
+    @property
+    def label(self):
+        numbers = sorted(item.number for item in self.items)
+        if len(numbers) == 1:
+            return f"Image {numbers[0]}"
+        if numbers[-1] - numbers[0] == len(numbers) - 1:
+            return f"Images {numbers[0]}–{numbers[-1]}"
+        return "Images " + ", ".join(str(number) for number in numbers)
+
+    def content(self, question, total):
+        """User message content: instructions, the question and the images"""
+        names = "\n".join(f"[{item.number}] {item.filename}" for item in sorted(self.items, key=lambda i: i.number))
+        if len(self.items) == total:
+            scope = f"The user uploaded {total} images:"
+        else:
+            scope = f"The user uploaded {total} images; these are {self.label.lower()}:"
+        text = (
+            f"{scope}\n{names}\n"
+            "Small images are combined into grids; each cell is labelled with its "
+            "[number]. Refer to images by number.\n\n"
+            f"{question}"
+        )
+        return [{"type": "text", "text": text}] + self.parts
+
+
+def _image_part(mime_type, data):
+    return {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{data}"}}
+
+
+def _encode(image):
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=85)
+    return base64.b64encode(output.getvalue()).decode('utf-8')
+
+
+class VisionBatcher:
+    """Plans and runs batched vision requests"""
+
+    def __init__(self, min_images=None, max_pixels=None, small_side=None, tile_side=None,
+                 grid_cells=None, max_concurrency=None):
+        self.min_images = int(min_images or os.getenv("VISION_BATCH_MIN", "4"))
+        self.max_pixels = int(max_pixels or os.getenv("VISION_MAX_PIXELS", "6000000"))
+        self.small_side = int(small_side or os.getenv("VISION_SMALL_SIDE", "768"))
+        self.tile_side = int(tile_side or os.getenv("VISION_TILE_SIDE", "512"))
+        self.grid_cells = int(grid_cells or os.getenv("VISION_GRID_CELLS", "4"))
+        self.max_concurrency = int(max_concurrency or os.getenv("VISION_MAX_CONCURRENCY", "4"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="vision")
+
+    def should_batch(self, items):
+        """Whether there are enough images for batching to pay off"""
+        return len(items) >= self.min_images
+
+    def _units(self, items):
+        """(items, content part, pixels) for each grid composite and large image"""
+        sized = [item for item in items if item.sized]
+        small = [item for item in sized if max(item.width, item.height) <= self.small_side]
+        large = [item for item in sized if max(item.width, item.height) > self.small_side]
+        units = []
+
+        for item in items:
+            if not item.sized:
+                # Could not be decoded here, so it cannot be tiled or shrunk: sent as it
+                # is, in a request of its own so a provider rejecting it fails no others
+                units.append(([item], _image_part(item.image.mime_type, item.image.base64()), self.max_pixels))
+
+        for first in range(0, len(small), self.grid_cells):
+            group = small[first:first + self.grid_cells]
+            if len(group) == 1:
+                item = group[0]
+                units.append((group, _image_part(item.image.mime_type, item.image.base64()), item.pixels))
+                continue
+            columns = math.ceil(math.sqrt(len(group)))
+            sheet = compose_grid(
+                [item.open() for item in group],
+                [f"[{item.number}] {item.filename}"[:40] for item in group],
+                max_side=self.tile_side * columns, tile_side=self.tile_side
+            )
+            units.append((group, _image_part('image/jpeg', _encode(sheet)), sheet.width * sheet.height))
+
+        for item in large:
+            if item.pixels <= self.max_pixels:
+                units.append(([item], _image_part(item.image.mime_type, item.image.base64()), item.pixels))
+                continue
+            # Too big for a request on its own: shrink to the budget
+            image = item.open()
+            scale = math.sqrt(self.max_pixels / item.pixels)
+            image.thumbnail((int(item.width * scale), int(item.height * scale)))
+            units.append(([item], _image_part('image/jpeg', _encode(image)), image.width * image.height))
+
+        units.sort(key=lambda unit: min(item.number for item in unit[0]))
+        return units
+
+    def plan(self, items):
+        """Pack the images into VisionBatches of at most ``max_pixels`` each"""
+        batches = []
+        current = VisionBatch()
+        for group, part, pixels in self._units(items):
+            if current.parts and current.pixels + pixels > self.max_pixels:
+                batches.append(current)
+                current = VisionBatch()
+            current.add(group, part, pixels)
+        if current.parts:
+            batches.append(current)
+        return batches
+
+    def run(self, router, requests, **kwargs):
+        """Send each (batch, messages) pair concurrently
+
+        Returns (batch, response or exception) pairs in input order.
+        """
+        futures = [
+            (batch, self._executor.submit(router.create, 'vision', messages=messages, **kwargs))
+            for batch, messages in requests
+        ]
+        outcomes = []
+        for batch, future in futures:
+            try:
+                outcomes.append((batch, future.result()))
+            except Exception as e:
+                outcomes.append((batch, e))
+        return outcomes